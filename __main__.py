@@ -0,0 +1,6 @@
+"""Allows running the cli with python <path to ws> scrape --config config.json"""
+import sys
+
+from cli import main
+
+sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+Compares the murl extraction of the bing engine with the regex it replaced on a synthetic result
+page shaped like the real ones. Usage: python benchmarks/bench_bing_parser.py [n_results]
+"""
+import random
+import re
+import string
+import sys
+import timeit
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from search_engines.bing import _parse_results  # pylint: disable=wrong-import-position
+
+MURL_PATTERN = re.compile(r"murl&quot;:&quot;(.*?)&quot;")
+MARKUP_SIZE = 2500  # characters of markup around every result of a real page
+
+
+def _regex_parse(html: str):
+    return MURL_PATTERN.findall(html)
+
+
+def _result_page(n_results: int) -> str:
+    rng = random.Random(0)
+    alphabet = string.ascii_lowercase + ' <>="/&;:'
+    results = []
+    for number in range(n_results):
+        markup = "".join(rng.choice(alphabet) for _ in range(MARKUP_SIZE))
+        results.append(
+            f'<div class="imgpt"><a class="iusc" m="{{&quot;cid&quot;:&quot;{number}&quot;,'
+            f'&quot;purl&quot;:&quot;https://example.com/page/{number}&quot;,'
+            f'&quot;murl&quot;:&quot;https://img.example.com/{number}/image.jpg&quot;,'
+            f'&quot;turl&quot;:&quot;https://tse.mm.bing.net/th?id={number}&quot;}}">'
+            f'{markup}</a></div>')
+    return f"<html>{''.join(results)}</html>"
+
+
+def main():
+    """Checks that both parsers agree and prints the time per page"""
+    n_results = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    html = _result_page(n_results)
+    assert _parse_results(html) == _regex_parse(html)
+
+    timings = {}
+    for name, parse in (("re.findall", _regex_parse), ("str.find", _parse_results)):
+        timings[name] = min(timeit.repeat(lambda parse=parse: parse(html), number=200,
+                                          repeat=5)) / 200
+        print(f"{name:<10} {timings[name] * 1e6:>8.1f} us per page of {n_results} results")
+    print(f"speedup    {timings['re.findall'] / timings['str.find']:>8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
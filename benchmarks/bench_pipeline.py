@@ -0,0 +1,111 @@
+"""
+End to end benchmark of the scrape pipeline against the local fake server.
+Every configuration runs in a fresh process, which reports images/sec, peak memory and cpu time.
+Usage: python benchmarks/bench_pipeline.py --n-samples 200 1000 --workers 4 16
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+from fake_server import FakeServer, FakeServerConfig
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+UNLIMITED_RATE = 1e6
+
+
+def _run_pipeline(bing_url: str, duckgo_url: str, engines: List[str], keywords: List[str],
+                  n_samples: int, n_workers: int, max_jobs: int) -> Dict:
+    """Runs a scrape in this (fresh) process and returns its measurements"""
+    # pylint: disable=import-outside-toplevel
+    from search_engines.registry import SearchEngineFactory
+    from utils.rate_limit import get_rate_limiter
+    from utils.scheduler import ScrapeScheduler, expand_jobs
+
+    SearchEngineFactory.get_se_class("Bing SE").BING_IMAGE_URL = bing_url
+    SearchEngineFactory.get_se_class("Duckgo SE").DUCKGO_URL = duckgo_url
+    # the fake server does not throttle, measure the pipeline and not the rate limiter
+    rate_limiter = get_rate_limiter(urlsplit(bing_url).netloc)
+    rate_limiter.rate = rate_limiter.max_rate = rate_limiter.burst = UNLIMITED_RATE
+
+    with tempfile.TemporaryDirectory() as dataset_path:
+        scheduler = ScrapeScheduler(Path(dataset_path), n_samples, max_jobs=max_jobs,
+                                    n_workers=n_workers)
+        start, start_cpu = time.perf_counter(), time.process_time()
+        results = scheduler.run(expand_jobs(engines, keywords))
+        duration, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+
+    n_images = sum(result.n_images for result in results)
+    return {
+        "n_images": n_images,
+        "seconds": duration,
+        "images_per_second": n_images / duration if duration else 0.0,
+        "cpu_seconds": cpu,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "errors": [result.error for result in results if result.error],
+    }
+
+
+def _parse_args() -> argparse.Namespace:
+    defaults = FakeServerConfig()
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-samples", type=int, nargs="+", default=[200, 1000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--engines", nargs="+", default=["Bing SE", "Duckgo SE"])
+    parser.add_argument("--keywords", type=int, default=4, help="number of keywords")
+    parser.add_argument("--jobs", type=int, default=4, help="jobs which run at the same time")
+    parser.add_argument("--latency", type=float, default=defaults.latency)
+    parser.add_argument("--image-size", type=int, default=defaults.image_size)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--junk-rate", type=float, default=defaults.junk_rate)
+    parser.add_argument("--image-hosts", type=int, default=defaults.image_hosts,
+                        help="the downloads per host are limited, so this caps the workers used")
+    parser.add_argument("--json", type=Path, default=None, help="also write the results here")
+    return parser.parse_args()
+
+
+def main():
+    """Runs every n_samples x workers combination and prints a table"""
+    args = _parse_args()
+    keywords = [f"keyword{number}" for number in range(args.keywords)]
+    config = FakeServerConfig(n_results=max(args.n_samples), latency=args.latency,
+                              image_size=args.image_size, error_rate=args.error_rate,
+                              junk_rate=args.junk_rate, image_hosts=args.image_hosts)
+    spawn = multiprocessing.get_context("spawn")
+
+    print(f"{'n_samples':>9} {'workers':>7} {'images':>7} {'expected':>8} {'time (s)':>9} "
+          f"{'images/s':>9} {'cpu (s)':>8} {'peak MiB':>9}")
+    rows = []
+    with FakeServer(config) as server:
+        for n_samples in args.n_samples:
+            # every engine returns the same urls for a keyword, so they are only downloaded once
+            expected = sum(server.expected_images(keyword, n_samples) for keyword in keywords)
+            for n_workers in args.workers:
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    row = executor.submit(_run_pipeline, server.bing_url, server.duckgo_url,
+                                          args.engines, keywords, n_samples, n_workers,
+                                          args.jobs).result()
+                row.update(n_samples=n_samples, workers=n_workers, expected=expected)
+                rows.append(row)
+                print(f"{n_samples:>9} {n_workers:>7} {row['n_images']:>7} {expected:>8} "
+                      f"{row['seconds']:>9.2f} {row['images_per_second']:>9.1f} "
+                      f"{row['cpu_seconds']:>8.2f} {row['peak_rss_mib']:>9.1f}")
+                for error in row["errors"]:
+                    print(f"    job error: {error}")
+
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Local stand in for the search engines and the image hosts, so the pipeline can be benchmarked
+without the internet. It serves bing style murl pages, duckgo i.js json with next cursors and
+images which are jpeg, png, junk or errors with configurable latency and size.
+The images are spread over several image hosts (ports), like the results of a real search
+"""
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0"
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+BING_PAGE_SIZE = 100
+DUCKGO_PAGE_SIZE = 100
+
+
+class FakeServerConfig(NamedTuple):
+    """Behaviour of the fake server"""
+    n_results: int = 1000  # results per keyword and search engine
+    latency: float = 0.02  # seconds before every response
+    jitter: float = 0.01  # random extra latency in seconds
+    image_size: int = 50 * 1024  # bytes
+    error_rate: float = 0.05  # share of image urls answering with 500
+    junk_rate: float = 0.05  # share of image urls answering with html
+    image_hosts: int = 8  # servers the image urls are spread over, each with its own port
+
+
+def _image_kind(keyword: str, number: int, config: FakeServerConfig) -> str:
+    """Decides deterministically what an image url serves"""
+    roll = (zlib.crc32(f"{keyword}/{number}".encode()) % 10000) / 10000
+    if roll < config.error_rate:
+        return "error"
+    if roll < config.error_rate + config.junk_rate:
+        return "junk"
+    return "png" if number % 4 == 0 else "jpg"
+
+
+def _make_handler(server: "FakeServer"):
+    config = server.config
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """Answers the search and image requests"""
+        protocol_version = "HTTP/1.1"  # keep-alive like the real servers
+
+        def log_message(self, *_):  # pylint: disable=arguments-differ
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str):
+            time.sleep(config.latency + random.random() * config.jitter)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """duckgo vqd handshake"""
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._send(200, b"<script>vqd=4-1234567890&</script>", "text/html")
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """bing pages, duckgo pages and images"""
+            parts = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+            if parts.path == "/images/async":
+                self._bing_page(query)
+            elif parts.path == "/i.js":
+                self._duckgo_page(query)
+            elif parts.path.startswith("/img/"):
+                self._image(parts.path)
+            else:
+                self._send(404, b"not found", "text/plain")
+
+        def _image_url(self, keyword: str, number: int) -> str:
+            ext = "png" if number % 4 == 0 else "jpg"
+            image_url = server.image_urls[number % len(server.image_urls)]
+            return f"{image_url}/img/{keyword}/{number}.{ext}"
+
+        def _bing_page(self, query):
+            keyword = query.get("q", "")
+            first = int(query.get("first", 0))
+            numbers = range(first, min(first + BING_PAGE_SIZE, config.n_results))
+            html = "".join(f'<a m="{{murl&quot;:&quot;{self._image_url(keyword, number)}&quot;}}">'
+                           for number in numbers)
+            self._send(200, f"<html>{html}</html>".encode(), "text/html")
+
+        def _duckgo_page(self, query):
+            keyword = query.get("q", "")
+            offset = int(query.get("s", 0))
+            numbers = range(offset, min(offset + DUCKGO_PAGE_SIZE, config.n_results))
+            data = {"results": [{"image": self._image_url(keyword, number)} for number in numbers]}
+            if offset + DUCKGO_PAGE_SIZE < config.n_results:
+                data["next"] = f"i.js?q={keyword}&s={offset + DUCKGO_PAGE_SIZE}"
+            self._send(200, json.dumps(data).encode(), "application/json")
+
+        def _image(self, path: str):
+            _, _, keyword, file_name = path.split("/", 3)
+            number = int(file_name.split(".")[0])
+            kind = _image_kind(keyword, number, config)
+            if kind == "error":
+                self._send(500, b"internal error", "text/plain")
+            elif kind == "junk":
+                self._send(200, b"<html>" + b"x" * config.image_size + b"</html>", "text/html")
+            else:
+                header = PNG_HEADER if kind == "png" else JPEG_HEADER
+                # unique content per url so every image gets its own md5
+                body = header + path.encode() + b"\0" * max(config.image_size - len(path), 0)
+                self._send(200, body, f"image/{'png' if kind == 'png' else 'jpeg'}")
+
+    return Handler
+
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients drop kept alive connections when they exit or abort a rejected download
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+class FakeServer:
+    """Runs the fake search engines and image hosts in a background thread"""
+
+    def __init__(self, config: Optional[FakeServerConfig] = None, host: str = "127.0.0.1"):
+        self.config = config or FakeServerConfig()
+        handler = _make_handler(self)
+        # the first server answers the searches, downloads are limited per host and port
+        self._servers = [_QuietServer((host, 0), handler)
+                         for _ in range(1 + max(self.config.image_hosts, 1))]
+        self.base_url, *self.image_urls = [f"http://{host}:{server.server_port}"
+                                           for server in self._servers]
+        self._threads = [threading.Thread(target=server.serve_forever, daemon=True)
+                         for server in self._servers]
+
+    @property
+    def bing_url(self) -> str:
+        """Replacement for Bing.BING_IMAGE_URL"""
+        return f"{self.base_url}/images/async?q="
+
+    @property
+    def duckgo_url(self) -> str:
+        """Replacement for DuckGo.DUCKGO_URL"""
+        return f"{self.base_url}/"
+
+    def expected_images(self, keyword: str, n_samples: int) -> int:
+        """Returns how many of the first n_samples results of a keyword are images"""
+        return sum(_image_kind(keyword, number, self.config) in ("jpg", "png")
+                   for number in range(min(n_samples, self.config.n_results)))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        """Starts serving"""
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops serving"""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,57 @@
+"""
+Measures the cold start of the cli and the import cost of every search engine.
+Every measurement runs in a fresh interpreter. Usage: python benchmarks/import_time.py [repeats]
+"""
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, 'selenium' in sys.modules)
+"""
+
+MODULES = [
+    "utils.scheduler",
+    "search_engines.bing",
+    "search_engines.duckgo",
+    "search_engines.google",
+]
+
+
+def _import_time(module: str):
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(module=module)],
+                            cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout
+    seconds, selenium_loaded = output.split()
+    return float(seconds), selenium_loaded == "True"
+
+
+def _cli_start_time() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "cli.py", "--help"], cwd=REPO_ROOT, capture_output=True,
+                   check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    """Prints the median of every measurement"""
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    cli_start = statistics.median(_cli_start_time() for _ in range(repeats))
+    print(f"{'cli cold start (python cli.py --help)':<40} {cli_start * 1000:>8.1f} ms")
+
+    for module in MODULES:
+        runs = [_import_time(module) for _ in range(repeats)]
+        seconds = statistics.median(run[0] for run in runs)
+        selenium = "loads selenium" if runs[0][1] else ""
+        print(f"{'import ' + module:<40} {seconds * 1000:>8.1f} ms  {selenium}".rstrip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Non interactive entry point which runs a scrape from a saved config and exits.
+Usage: python cli.py scrape --config config.json --workers 16
+       python cli.py search --config config.json --output urls.jsonl
+Distributed: python cli.py enqueue --config config.json --queue /shared/queue.db
+             python cli.py work --queue /shared/queue.db  (on every machine, any number of times)
+             python cli.py status --queue /shared/queue.db
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from webscraper_config import Config as WsConfig
+
+REQUIRED_FIELDS = ("dataset_path", "keywords", "n_samples", "search_engines")
+
+EXIT_OK = 0
+EXIT_JOB_FAILED = 1
+EXIT_BAD_CONFIG = 2
+
+
+def _add_scrape_args(parser: argparse.ArgumentParser):
+    """Adds the options of the scheduler and the metrics"""
+    parser.add_argument("--workers", type=int, default=None,
+                        help="download threads per job")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="jobs which run at the same time")
+    parser.add_argument("--jobs-per-engine", type=int, default=None,
+                        help="jobs which use the same search engine at the same time")
+    parser.add_argument("--no-page-cache", action="store_true",
+                        help="always request the search result pages")
+    parser.add_argument("--near-duplicates", type=int, default=None, metavar="DISTANCE",
+                        help="reject images whose perceptual hash differs from one in the dataset "
+                             "by at most DISTANCE bits (needs pillow)")
+    parser.add_argument("--process", action="store_true",
+                        help="decode every image in worker processes, reject broken ones and name "
+                             "them by their real format (needs pillow)")
+    parser.add_argument("--format", default=None, choices=["jpg", "png", "webp", "gif"],
+                        help="convert the images to this format, implies --process")
+    parser.add_argument("--max-side", type=int, default=None, metavar="PIXELS",
+                        help="downscale bigger images to fit PIXELS x PIXELS, implies --process")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="image processing processes (default: number of cpus)")
+    parser.add_argument("--target", action="store_true",
+                        help="scrape until n_samples images per job are saved instead of "
+                             "collecting n_samples urls")
+    parser.add_argument("--layout", default=None, choices=["flat", "prefix", "shards"],
+                        help="store the images flat, in hash prefix dirs or in tar shards and "
+                             "write a manifest.jsonl (default: flat without manifest)")
+    parser.add_argument("--shard-size", type=int, default=None, metavar="IMAGES",
+                        help="images per tar shard of --layout shards")
+    parser.add_argument("--metrics-json", type=Path, default=None,
+                        help="write the metrics of the run as json to this file")
+    parser.add_argument("--metrics-prometheus", type=Path, default=None,
+                        help="write the metrics of the run in prometheus text format to this file")
+    parser.add_argument("--live-metrics", type=float, default=None, metavar="SECONDS",
+                        help="print a metrics summary to stderr every SECONDS")
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="ws", description="Scrapes image datasets")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scrape_parser = subparsers.add_parser(
+        "scrape", help="run every search engine x keyword job of a config")
+    scrape_parser.add_argument("--config", type=Path, default=Path("config.json"),
+                               help="config saved from the interactive menu "
+                                    "(default: config.json)")
+    _add_scrape_args(scrape_parser)
+
+    search_parser = subparsers.add_parser(
+        "search", help="only collect the urls of every search engine x keyword job with the "
+                       "async search engines")
+    search_parser.add_argument("--config", type=Path, default=Path("config.json"),
+                               help="config saved from the interactive menu "
+                                    "(default: config.json)")
+    search_parser.add_argument("--searches", type=int, default=None,
+                               help="searches which run at the same time")
+    search_parser.add_argument("--no-page-cache", action="store_true",
+                               help="always request the search result pages")
+    search_parser.add_argument("--output", type=Path, default=None,
+                               help="write the urls as json lines to this file")
+
+    enqueue_parser = subparsers.add_parser(
+        "enqueue", help="split the jobs of a config into tasks of a work queue which is shared "
+                        "by workers")
+    enqueue_parser.add_argument("--config", type=Path, default=Path("config.json"),
+                                help="config saved from the interactive menu "
+                                     "(default: config.json)")
+    enqueue_parser.add_argument("--queue", required=True,
+                                help="path of the queue database or BACKEND://LOCATION")
+    enqueue_parser.add_argument("--task-size", type=int, default=None, metavar="URLS",
+                                help="urls per task of the search engines which can start at an "
+                                     "offset")
+
+    work_parser = subparsers.add_parser("work",
+                                        help="run tasks of a work queue until it is drained")
+    work_parser.add_argument("--queue", required=True,
+                             help="path of the queue database or BACKEND://LOCATION")
+    work_parser.add_argument("--dataset", type=Path, default=None,
+                             help="download into this dir instead of the dataset_path of the "
+                                  "config")
+    work_parser.add_argument("--lease", type=float, default=None, metavar="SECONDS",
+                             help="a task is taken over by another worker if this worker does "
+                                  "not report for SECONDS")
+    work_parser.add_argument("--name", default=None,
+                             help="name of the worker and its tar shards, unique among the "
+                                  "workers of the queue (default: HOST-PID)")
+    _add_scrape_args(work_parser)
+
+    status_parser = subparsers.add_parser("status", help="show the progress of a work queue")
+    status_parser.add_argument("--queue", required=True,
+                               help="path of the queue database or BACKEND://LOCATION")
+    return parser.parse_args(argv)
+
+
+def _load_config(path: Path) -> Optional[WsConfig]:
+    config = WsConfig()
+    if not config.load_config(path):
+        print(f"{path} is not a config file", file=sys.stderr)
+        return None
+
+    missing = [field for field in REQUIRED_FIELDS if not config.to_json().get(field)]
+    if missing:
+        print(f"{path} is missing {', '.join(missing)}", file=sys.stderr)
+        return None
+    return config
+
+
+def _create_scheduler(args: argparse.Namespace, dataset_path: Path, n_samples: int,
+                      shard_name: str = ""):
+    """
+    Returns a ScrapeScheduler with the options of _add_scrape_args. Processes which write to the
+    same dataset need different shard names
+    """
+    # imported here so that parsing the arguments and checking the config stays fast
+    # pylint: disable=import-outside-toplevel
+    from utils.dataset_writer import DatasetWriter
+    from utils.image_processing import ProcessOptions
+    from utils.page_cache import PageCache
+    from utils.scheduler import ScrapeScheduler
+
+    options = {name: value for name, value in (("n_workers", args.workers),
+                                               ("max_jobs", args.jobs),
+                                               ("max_jobs_per_engine", args.jobs_per_engine),
+                                               ("near_duplicate_distance", args.near_duplicates),
+                                               ("n_processes", args.processes))
+               if value is not None}
+    if args.process or args.format or args.max_side:
+        options["process_options"] = ProcessOptions(args.format, args.max_side)
+    if args.target:
+        options["target_mode"] = True
+    if args.layout:
+        shard_options = {}
+        if args.layout == "shards":
+            shard_options = {"name": shard_name}
+            if args.shard_size:
+                shard_options["shard_size"] = args.shard_size
+        options["writer"] = DatasetWriter.for_path(dataset_path, args.layout, **shard_options)
+    return ScrapeScheduler(dataset_path, n_samples,
+                           page_cache=None if args.no_page_cache else PageCache(), **options)
+
+
+def _run_with_metrics(args: argparse.Namespace, run: Callable[[], list]) -> list:
+    """Calls run while the live metrics are printed and exports the metrics afterwards"""
+    from utils.metrics import get_metrics  # pylint: disable=import-outside-toplevel
+
+    metrics = get_metrics()
+    stop_live_metrics = metrics.stream_live(args.live_metrics) if args.live_metrics else None
+    try:
+        return run()
+    finally:
+        if stop_live_metrics is not None:
+            stop_live_metrics.set()
+        if args.metrics_json:
+            metrics.export(args.metrics_json, "json")
+        if args.metrics_prometheus:
+            metrics.export(args.metrics_prometheus, "prometheus")
+
+
+def scrape(args: argparse.Namespace) -> int:
+    """Runs all jobs of the config and returns the exit status"""
+    config = _load_config(args.config)
+    if config is None:
+        return EXIT_BAD_CONFIG
+
+    # pylint: disable=import-outside-toplevel
+    from utils.metrics import get_metrics
+    from utils.scheduler import expand_jobs, format_summary
+
+    scheduler = _create_scheduler(args, Path(config.dataset_path), config.n_samples)
+    start = time.perf_counter()
+    results = _run_with_metrics(
+        args, lambda: scheduler.run(expand_jobs(config.search_engines, config.keywords)))
+    print(format_summary(results, time.perf_counter() - start))
+    print(scheduler.url_deduplicator.report())
+    if args.target:
+        print(scheduler.success_rates.report())
+    print(get_metrics().summary())
+
+    return EXIT_JOB_FAILED if any(result.error for result in results) else EXIT_OK
+
+
+def search(args: argparse.Namespace) -> int:
+    """Collects the urls of all jobs of the config in one event loop and returns the exit status"""
+    config = _load_config(args.config)
+    if config is None:
+        return EXIT_BAD_CONFIG
+
+    # pylint: disable=import-outside-toplevel
+    from utils.async_search import search as search_urls
+    from utils.page_cache import PageCache
+    from utils.scheduler import expand_jobs
+
+    options = {"max_searches": args.searches} if args.searches else {}
+    results = search_urls(expand_jobs(config.search_engines, config.keywords), config.n_samples,
+                          page_cache=None if args.no_page_cache else PageCache(), **options)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            for result in results:
+                for url in result.urls:
+                    output_file.write(json.dumps({"engine": result.job.search_engine,
+                                                  "keyword": result.job.keyword,
+                                                  "url": url}) + "\n")
+    print(f"{'search engine':<15} {'keyword':<25} {'urls':>7} {'time (s)':>9}  error")
+    for result in results:
+        line = (f"{result.job.search_engine:<15} {result.job.keyword:<25} {len(result.urls):>7} "
+                f"{result.duration:>9.1f}  {result.error or ''}")
+        print(line.rstrip())
+    print(f"{len(results)} searches, {sum(len(result.urls) for result in results)} urls")
+
+    return EXIT_JOB_FAILED if any(result.error for result in results) else EXIT_OK
+
+
+def _open_queue(location: str):
+    from utils.work_queue import open_work_queue  # pylint: disable=import-outside-toplevel
+
+    try:
+        return open_work_queue(location)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return None
+
+
+def enqueue(args: argparse.Namespace) -> int:
+    """Adds the tasks of the config to the work queue and returns the exit status"""
+    config = _load_config(args.config)
+    if config is None:
+        return EXIT_BAD_CONFIG
+
+    # pylint: disable=import-outside-toplevel
+    from utils.scheduler import expand_jobs
+    from utils.work_queue import split_jobs
+
+    options = {"task_size": args.task_size} if args.task_size else {}
+    tasks = split_jobs(expand_jobs(config.search_engines, config.keywords), config.n_samples,
+                       **options)
+    work_queue = _open_queue(args.queue)
+    if work_queue is None:
+        return EXIT_BAD_CONFIG
+    try:
+        work_queue.set_config(config.to_json())
+        n_added = work_queue.add_tasks(tasks)
+    finally:
+        work_queue.close()
+    print(f"{n_added} of {len(tasks)} tasks added to {args.queue}")
+    return EXIT_OK
+
+
+def work(args: argparse.Namespace) -> int:
+    """Runs tasks of the work queue until it is drained and returns the exit status"""
+    # pylint: disable=import-outside-toplevel
+    from utils.metrics import get_metrics
+    from utils.scheduler import format_summary
+    from utils.work_queue import QueueWorker, default_worker_name
+
+    work_queue = _open_queue(args.queue)
+    if work_queue is None:
+        return EXIT_BAD_CONFIG
+    try:
+        config = work_queue.get_config()
+        if config is None:
+            print(f"{args.queue} has no config, run enqueue first", file=sys.stderr)
+            return EXIT_BAD_CONFIG
+        name = args.name or default_worker_name()
+        scheduler = _create_scheduler(args, args.dataset or Path(config["dataset_path"]),
+                                      config["n_samples"], shard_name=name)
+        options = {"lease_seconds": args.lease} if args.lease else {}
+        worker = QueueWorker(work_queue, scheduler, name=name, **options)
+
+        start = time.perf_counter()
+        results = _run_with_metrics(args, worker.run)
+        print(format_summary(results, time.perf_counter() - start))
+        print(get_metrics().summary())
+        print(_format_status(work_queue.status()))
+    finally:
+        work_queue.close()
+    return EXIT_JOB_FAILED if any(result.error for result in results) else EXIT_OK
+
+
+def _format_status(status: dict) -> str:
+    return ", ".join(f"{status.get(state, 0)} {state}"
+                     for state in ("pending", "leased", "done", "failed"))
+
+
+def queue_status(args: argparse.Namespace) -> int:
+    """Prints the progress of the work queue and returns the exit status"""
+    work_queue = _open_queue(args.queue)
+    if work_queue is None:
+        return EXIT_BAD_CONFIG
+    try:
+        print(_format_status(work_queue.status()))
+        for failure in work_queue.failures():
+            print(f"{failure['search_engine']:<15} {failure['keyword']:<25} "
+                  f"{failure['offset']:>7}  {failure['attempts']} attempts: {failure['error']}")
+    finally:
+        work_queue.close()
+    return EXIT_OK
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parses the command line and runs the command"""
+    args = _parse_args(argv)
+    commands = {"scrape": scrape, "search": search, "enqueue": enqueue, "work": work,
+                "status": queue_status}
+    try:
+        return commands[args.command](args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
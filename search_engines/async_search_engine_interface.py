@@ -0,0 +1,125 @@
+"""Interface which any async search engine has to implement"""
+import asyncio
+import time
+from abc import ABC
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional, it is only needed for the async search engines
+    aiohttp = None
+
+from utils.http_session import DEFAULT_TIMEOUT
+from utils.metrics import get_metrics
+from utils.rate_limit import get_rate_limiter
+from .search_engine_interface import EmptyPageMixin
+
+
+def client_session(limit: int = 100) -> "aiohttp.ClientSession":
+    """
+    Returns a session with at most limit connections and the timeouts of the sync sessions.
+    Call it inside the event loop which uses the session
+    """
+    if aiohttp is None:
+        raise RuntimeError("the async search engines need aiohttp, install it with pip")
+    connect_timeout, read_timeout = DEFAULT_TIMEOUT
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit),
+                                 timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                                               sock_read=read_timeout))
+
+
+class AsyncSearchEngineInterface(EmptyPageMixin, ABC):
+    """
+    Async counterpart of SearchEngineInterface. Nothing is scraped in __init__, iterating the
+    engine with async for scrapes the result pages while the urls are consumed, so many engines
+    run concurrently in one event loop and a search is cancelled with its task.
+    The engines share pagination through cursor, the page cache, the per host rate limiters,
+    the empty page handling and the metrics with the sync engines. The page cache is read and
+    written in a thread, so its disk access does not block the event loop.
+    Requests use the aiohttp session passed as session, otherwise every search opens its own
+    """
+
+    def __init__(self, keyword: str, n_images: int, **kwargs):
+        self.keyword = keyword
+        self.n_images = n_images
+        self.cursor: Dict = dict(kwargs.get("cursor") or {})
+        self.page_cache = kwargs.get("page_cache")
+        self.session: Optional["aiohttp.ClientSession"] = kwargs.get("session")
+        self._empty_pages = 0
+        # the name the engine is registered with, it labels the metrics
+        self.name = getattr(self, "SE_NAME", type(self).__name__)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.iter_img_urls()
+
+    async def _iter_img_links(self) -> AsyncIterator[str]:
+        """This scrapes the search engine and yields at most n_images urls as they are found"""
+        raise NotImplementedError
+        yield  # pylint: disable=unreachable  # makes the stub an async generator like the engines
+
+    async def iter_img_urls(self) -> AsyncIterator[str]:
+        """Yields the urls and records them and the time spent searching in the metrics"""
+        own_session = self.session is None
+        if own_session:
+            self.session = client_session()
+        metrics = get_metrics()
+        links = self._iter_img_links()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    link = await links.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    metrics.inc("search_seconds_total", time.perf_counter() - start,
+                                engine=self.name)
+                metrics.inc("search_urls_total", engine=self.name)
+                yield link
+        finally:
+            await links.aclose()
+            if own_session:
+                await self.session.close()
+                self.session = None
+
+    async def get_img_urls(self) -> List[str]:
+        """Scrapes and returns all urls"""
+        return [link async for link in self]
+
+    async def _request(self, method: str, url: str, **kwargs) -> str:
+        """
+        Sends a request through the session after waiting for the rate limiter of the host and
+        reports the response back to it. Returns the text of the response, an empty text for
+        error statuses
+        """
+        host = urlsplit(url).netloc
+        rate_limiter = get_rate_limiter(host)
+        await rate_limiter.acquire_async()
+        start = time.perf_counter()
+        async with self.session.request(method, url, **kwargs) as response:
+            text = await response.text()
+        latency = time.perf_counter() - start
+        rate_limiter.on_response(response.status, latency)
+
+        metrics = get_metrics()
+        metrics.observe("search_request_seconds", latency, engine=self.name, host=host)
+        metrics.inc("search_requests_total", engine=self.name, host=host, status=response.status)
+        metrics.inc("search_bytes_total", len(text), engine=self.name)
+        return text if response.status < 400 else ""
+
+    async def _fetch_page(self, method: str, url: str,
+                          is_valid: Optional[Callable[[str], bool]] = None, **kwargs) -> str:
+        """
+        Returns the text of a result page, from the page cache if the engine has one.
+        Only pages accepted by is_valid are cached, so empty pages are requested again
+        """
+        if self.page_cache is None:
+            return await self._request(method, url, **kwargs)
+
+        key, text = await asyncio.to_thread(self.page_cache.lookup, method, url, **kwargs)
+        if text is None:
+            text = await self._request(method, url, **kwargs)
+            if text and (is_valid is None or is_valid(text)):
+                await asyncio.to_thread(self.page_cache.put, key, text)
+        return text
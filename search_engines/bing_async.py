@@ -0,0 +1,35 @@
+"""Async implementation of bing SE"""
+from .async_search_engine_interface import AsyncSearchEngineInterface
+from .bing import USER_AGENT, PAGE_SIZE, Bing, _has_results, _parse_results, _search_url
+from .registry import SearchEngineFactory
+
+
+@SearchEngineFactory.register_se(name="Bing SE", asynchronous=True)
+class AsyncBing(AsyncSearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Async implementation of bing image search, it pages like Bing"""
+
+    BING_IMAGE_URL = Bing.BING_IMAGE_URL
+
+    async def _iter_img_links(self):
+        page = self.cursor.get("first", 0)
+        n_found = 0
+        while n_found < self.n_images:
+            self.cursor["first"] = page
+            search_url = _search_url(self.BING_IMAGE_URL, self.keyword, page)
+
+            html = await self._fetch_page("GET", search_url, is_valid=_has_results,
+                                          headers=USER_AGENT)
+
+            results = _parse_results(html)
+            if not self._page_done(search_url, len(results)):
+                return
+            if not results:
+                continue  # probably throttled, try the same page again
+
+            page += PAGE_SIZE
+            for link in results:
+                yield link
+                n_found += 1
+
+                if n_found == self.n_images:
+                    return
@@ -0,0 +1,107 @@
+"""Pool of warm headless chrome instances for the selenium based search engines"""
+import atexit
+import functools
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_RECYCLE_AFTER = 50  # pages
+
+
+@functools.lru_cache(maxsize=None)
+def chrome_driver_path() -> str:
+    """Resolves (and downloads if necessary) the chromedriver binary once per process"""
+    return ChromeDriverManager().install()
+
+
+def start_chrome() -> webdriver.Chrome:
+    """Starts a new headless chrome"""
+    options = Options()
+    options.add_argument("--headless=new")
+    return webdriver.Chrome(service=Service(chrome_driver_path()), options=options)
+
+
+class WebDriverPool:
+    """
+    Keeps up to size started drivers and hands them out one job at a time.
+    A driver is quit and replaced after it loaded recycle_after pages or raised a
+    WebDriverException, so leaking or crashed browsers do not slow down later jobs
+    """
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, recycle_after: int = DEFAULT_RECYCLE_AFTER,
+                 factory: Callable[[], webdriver.Remote] = start_chrome):
+        self.size = size
+        self.recycle_after = recycle_after
+        self._factory = factory
+
+        self._idle: queue.LifoQueue = queue.LifoQueue()  # the most recently used driver is warmest
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._pages: Dict[int, int] = {}
+
+    @staticmethod
+    def _quit(driver: webdriver.Remote):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    @contextmanager
+    def driver(self) -> Iterator[webdriver.Remote]:
+        """Lends a driver for loading a single page. Blocks while all drivers are in use"""
+        self._slots.acquire()
+        try:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._factory()
+
+            healthy = True
+            try:
+                yield driver
+            except WebDriverException:
+                healthy = False
+                raise
+            finally:
+                with self._lock:
+                    pages = self._pages.pop(id(driver), 0) + 1
+                    if healthy and pages < self.recycle_after:
+                        self._pages[id(driver)] = pages
+                        self._idle.put(driver)
+                    else:
+                        self._quit(driver)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Quits all idle drivers"""
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._pages.pop(id(driver), None)
+            self._quit(driver)
+
+
+_shared_pool: Optional[WebDriverPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_driver_pool() -> WebDriverPool:
+    """Returns the pool shared by all jobs. Its drivers are quit when the process exits"""
+    global _shared_pool  # pylint: disable=global-statement
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = WebDriverPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
@@ -2,57 +2,94 @@
 import json
 import re
 
-import requests
-
 from .registry import SearchEngineFactory
 from .search_engine_interface import SearchEngineInterface
 
+HEADERS = {
+    "authority": "duckduckgo.com",
+    "accept": "application/json, text/javascript, */*; q=0.01",
+    "sec-fetch-dest": "empty",
+    "x-requested-with": "XMLHttpRequest",
+    "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36",
+    "sec-fetch-site": "same-origin",
+    "sec-fetch-mode": "cors",
+    "referer": "https://duckduckgo.com/",
+    "accept-language": "en-US,en;q=0.9"
+}
+VQD_PATTERN = re.compile(r'vqd=([\d-]+)&', re.M | re.I)
+FIRST_PAGE = "i.js"
+
+
+def _has_results(text: str) -> bool:
+    try:
+        return bool(json.loads(text).get("results"))
+    except (json.JSONDecodeError, AttributeError):
+        return False
+
+
+def _has_vqd(text: str) -> bool:
+    return "vqd=" in text
+
+
+def _parse_vqd(text: str) -> str:
+    """Returns the token of the search which the json api needs"""
+    return VQD_PATTERN.search(text).group(1)
+
+
+def _json_params(keyword: str, vqd: str):
+    return (
+        ("l", "us-en"),
+        ("o", "json"),
+        ("q", keyword),
+        ("vqd", vqd),
+        ("f", ",,,"),
+        ("p", "1"),
+        ("v7exp", "a")
+    )
+
+
+def _parse_results(text: str) -> dict:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return {}  # duckgo answers with an html error page when it throttles
+
 
 @SearchEngineFactory.register_se(name="Duckgo SE")
 class DuckGo(SearchEngineInterface):  # pylint: disable=too-few-public-methods
     """Implementation of duckgo image search"""
 
-    def _collect_img_links(self):
-        url = "https://duckduckgo.com/"
-        params = {"q": self.keyword}
-        headers = {
-            "authority": "duckduckgo.com",
-            "accept": "application/json, text/javascript, */*; q=0.01",
-            "sec-fetch-dest": "empty",
-            "x-requested-with": "XMLHttpRequest",
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 "
-                          "(KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36",
-            "sec-fetch-site": "same-origin",
-            "sec-fetch-mode": "cors",
-            "referer": "https://duckduckgo.com/",
-            "accept-language": "en-US,en;q=0.9"
-        }
-
-        res = requests.post(url, data=params, timeout=3.000)
-        search_object = re.search(r'vqd=([\d-]+)&', res.text, re.M | re.I)
-
-        params = (
-            ("l", "us-en"),
-            ("o", "json"),
-            ("q", self.keyword),
-            ("vqd", search_object.group(1)),
-            ("f", ",,,"),
-            ("p", "1"),
-            ("v7exp", "a")
-        )
-
-        request_url = url + "i.js"
-
-        while len(self._image_urls) < self.n_images:
-            res = requests.get(request_url, headers=headers, params=params)
-            data = json.loads(res.text)
+    DUCKGO_URL = "https://duckduckgo.com/"
+
+    def _iter_img_links(self):
+        url = self.DUCKGO_URL
+
+        if "vqd" not in self.cursor:
+            res_text = self._fetch_page("POST", url, is_valid=_has_vqd, data={"q": self.keyword},
+                                        timeout=3.000)
+            self.cursor["vqd"] = _parse_vqd(res_text)
+
+        params = _json_params(self.keyword, self.cursor["vqd"])
+        request_url = url + self.cursor.get("next", FIRST_PAGE)
+
+        n_found = 0
+        while n_found < self.n_images:
+            data = _parse_results(self._fetch_page("GET", request_url, is_valid=_has_results,
+                                                   headers=HEADERS, params=params))
+            if not self._page_done(request_url, len(data.get("results", []))):
+                return
+            if not data.get("results"):
+                continue  # probably throttled, try the same page again
 
             for result in data.get("results"):
-                self._image_urls.append(result.get("image"))
+                yield result.get("image")
+                n_found += 1
 
-                if len(self._image_urls) == self.n_images:
-                    break
+                if n_found == self.n_images:
+                    return
 
             if "next" not in data:
                 return
+            self.cursor["next"] = data.get("next")
             request_url = url + data.get("next")
@@ -0,0 +1,48 @@
+"""Async implementation of duckgo SE"""
+from .async_search_engine_interface import AsyncSearchEngineInterface, aiohttp
+from .duckgo import (FIRST_PAGE, HEADERS, DuckGo, _has_results, _has_vqd, _json_params,
+                     _parse_results, _parse_vqd)
+from .registry import SearchEngineFactory
+
+VQD_TIMEOUT = 3.0  # seconds
+
+
+@SearchEngineFactory.register_se(name="Duckgo SE", asynchronous=True)
+class AsyncDuckGo(AsyncSearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Async implementation of duckgo image search, it pages like DuckGo"""
+
+    DUCKGO_URL = DuckGo.DUCKGO_URL
+
+    async def _iter_img_links(self):
+        url = self.DUCKGO_URL
+
+        if "vqd" not in self.cursor:
+            res_text = await self._fetch_page("POST", url, is_valid=_has_vqd,
+                                              data={"q": self.keyword},
+                                              timeout=aiohttp.ClientTimeout(total=VQD_TIMEOUT))
+            self.cursor["vqd"] = _parse_vqd(res_text)
+
+        params = _json_params(self.keyword, self.cursor["vqd"])
+        request_url = url + self.cursor.get("next", FIRST_PAGE)
+
+        n_found = 0
+        while n_found < self.n_images:
+            data = _parse_results(await self._fetch_page("GET", request_url,
+                                                         is_valid=_has_results, headers=HEADERS,
+                                                         params=params))
+            if not self._page_done(request_url, len(data.get("results", []))):
+                return
+            if not data.get("results"):
+                continue  # probably throttled, try the same page again
+
+            for result in data.get("results"):
+                yield result.get("image")
+                n_found += 1
+
+                if n_found == self.n_images:
+                    return
+
+            if "next" not in data:
+                return
+            self.cursor["next"] = data.get("next")
+            request_url = url + data.get("next")
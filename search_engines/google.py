@@ -1,15 +1,44 @@
 """Implementation of google SE"""
 import time
 
-from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
+from utils.metrics import get_metrics
+
+from .driver_pool import get_driver_pool
 from .search_engine_interface import SearchEngineInterface
 from .registry import SearchEngineFactory
 
+THUMBNAILS_XPATH = ("/html/body/div[2]/c-wiz/div[4]/div[1]/div/div/div/div[1]/div[1]/span/div[1]"
+                    "/div[1]/div/a[1]/div[1]/img")
+PREVIEW_XPATH = "//*[@id='Sva75c']/div/div/div[3]/div[2]/c-wiz/div/div[1]/div[1]/div[2]/div/a/img"
+WAIT_TIMEOUT = 10  # seconds to wait for the first results and for a preview
+SCROLL_TIMEOUT = 3  # seconds to wait for more results after scrolling
+
+# Google embeds the full resolution urls of all loaded results as ["url",height,width] in the
+# scripts of the page. This collects them in a single round trip instead of a click per thumbnail
+EXTRACT_URLS_SCRIPT = r"""
+const pattern = /\["(https?:\/\/[^"]+?)",\d+,\d+\]/g;
+const urls = new Set();
+for (const script of document.querySelectorAll("script")) {
+    for (const match of script.textContent.matchAll(pattern)) {
+        let url = match[1];
+        try {
+            url = JSON.parse('"' + url + '"');
+        } catch (error) {
+            continue;
+        }
+        if (!url.includes("gstatic.com")) {
+            urls.add(url);
+        }
+    }
+}
+return Array.from(urls);
+"""
+
 
 @SearchEngineFactory.register_se(name="Google SE")
 class Google(SearchEngineInterface):  # pylint: disable=too-few-public-methods
@@ -18,38 +47,87 @@ class Google(SearchEngineInterface):  # pylint: disable=too-few-public-methods
     This is the slower compared to bing and duckgo because it has to use selenium.
     This is because by using requests it would only be possible to get the preview image of the
     first 100 images, because javascript needs to be rendered.
+    The browsers come from a pool of warm drivers shared by all keywords, pass driver_pool to use
+    a different pool than the shared one.
+    The full resolution urls are extracted from the page with one script. Only if that finds too
+    few the thumbnails are clicked, waiting for each preview instead of sleeping.
     """
 
-    def _collect_img_links(self):
-        scrolls = int(self.n_images / 50) + 1
-        url = f"https://www.google.com/search?q={self.keyword}&source=lnms&tbm=isch"
+    def __init__(self, keyword: str, n_images: int, **kwargs):
+        # set before super().__init__ because that already scrapes if not in stream mode
+        self.driver_pool = kwargs.get("driver_pool") or get_driver_pool()
+        self.images_per_second = 0.0
+        super().__init__(keyword, n_images, **kwargs)
 
-        options = Options()
-        options.headless = True
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
+    def _load_thumbnails(self, driver):
+        """Scrolls until n_images thumbnails are loaded or no more results appear"""
+        thumbs = WebDriverWait(driver, WAIT_TIMEOUT).until(
+            EC.presence_of_all_elements_located((By.XPATH, THUMBNAILS_XPATH)))
 
-        driver.get(url)
+        def more_thumbs(driver, n_thumbs=0):
+            found = driver.find_elements(By.XPATH, THUMBNAILS_XPATH)
+            return found if len(found) > n_thumbs else False
 
-        for _ in range(scrolls):
+        while len(thumbs) < self.n_images:
             driver.execute_script("window.scrollBy(0, 1000000)")
+            try:
+                thumbs = WebDriverWait(driver, SCROLL_TIMEOUT).until(
+                    lambda driver, n_thumbs=len(thumbs): more_thumbs(driver, n_thumbs))
+            except TimeoutException:
+                break  # google does not load more results
+        return thumbs
 
-        div_number = 1
-        while True:
-            thumb = driver.find_element(By.XPATH, "/html/body/div[2]/c-wiz/div[4]/div[1]/div/div"
-                                                  "/div/div[1]/div[1]/span/div[1]/div[1]/div"
-                                                  f"[{div_number}]/a[1]/div[1]/img")
+    @staticmethod
+    def _click_for_url(driver, thumb, previous_src):
+        """Opens the preview of thumb and waits until it shows a full resolution url"""
+        def preview_src(driver):
+            try:
+                src = driver.find_element(By.XPATH, PREVIEW_XPATH).get_attribute("src")
+            except StaleElementReferenceException:
+                return False
+            # the preview first shows the base64 thumbnail and the old image
+            return src if src and src.startswith("http") and src != previous_src else False
 
+        with get_metrics().time("google_click_seconds"):
             thumb.click()
-            time.sleep(.75)
+            try:
+                return WebDriverWait(driver, WAIT_TIMEOUT).until(preview_src)
+            except TimeoutException:
+                return None
 
-            element = thumb.find_element(By.XPATH, "//*[@id='Sva75c']/div/div/div[3]/div[2]/c-wiz/"
-                                                   "div/div[1]/div[1]/div[2]/div/a/img")
+    def _iter_img_links(self):
+        url = f"https://www.google.com/search?q={self.keyword}&source=lnms&tbm=isch"
+        start = time.perf_counter()
+        found = set()
 
-            self._image_urls.append(element.get_attribute("src"))
+        try:
+            with self.driver_pool.driver() as driver:
+                with get_metrics().time("google_page_load_seconds"):
+                    driver.get(url)
+                    thumbs = self._load_thumbnails(driver)
 
-            div_number += 1
-            if len(self._image_urls) == self.n_images:
-                break
+                for link in driver.execute_script(EXTRACT_URLS_SCRIPT):
+                    found.add(link)
+                    yield link
+                    if len(found) == self.n_images:
+                        return
 
-        driver.quit()
+                previous_src = None
+                for thumb in thumbs:
+                    link = self._click_for_url(driver, thumb, previous_src)
+                    if link is not None:
+                        # the preview keeps showing this image until the next one has loaded
+                        previous_src = link
+                    if link is None or link in found:
+                        continue
+                    found.add(link)
+                    yield link
+                    if len(found) == self.n_images:
+                        return
+        finally:
+            duration = time.perf_counter() - start
+            self.images_per_second = len(found) / duration if duration else 0.0
+            metrics = get_metrics()
+            metrics.observe("google_search_seconds", duration)
+            metrics.set_gauge("search_images_per_second", self.images_per_second,
+                              engine=self.name)
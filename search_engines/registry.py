@@ -1,46 +1,85 @@
 """This contains the factory for the search engines"""
+import importlib
 
 
 class SearchEngineFactory:
-    """Implementation of the Factory Pattern"""
+    """
+    Implementation of the Factory Pattern.
+    Search engines can also be registered lazily by the path of their module. The module is only
+    imported when the search engine is requested and registers the class itself with register_se.
+    Async search engines are registered with asynchronous=True under the name of their synchronous
+    counterpart, so the names of a config work for both
+    """
     _SEARCH_ENGINES = {}
+    _LAZY_SEARCH_ENGINES = {}
+    _ASYNC_SEARCH_ENGINES = {}
+    _LAZY_ASYNC_SEARCH_ENGINES = {}
+
+    @classmethod
+    def _registries(cls, asynchronous: bool):
+        if asynchronous:
+            return cls._ASYNC_SEARCH_ENGINES, cls._LAZY_ASYNC_SEARCH_ENGINES
+        return cls._SEARCH_ENGINES, cls._LAZY_SEARCH_ENGINES
+
+    @classmethod
+    def get_se_class(cls, name: str, asynchronous: bool = False):
+        """Returns the class of the search engine, imports its module if it is lazily registered"""
+        engines, lazy_engines = cls._registries(asynchronous)
+        if name not in engines and name in lazy_engines:
+            importlib.import_module(lazy_engines[name])
+        if name in engines:
+            return engines.get(name)
+        raise ValueError(f"{name} is not a valid {'async ' if asynchronous else ''}SE")
 
     @classmethod
     def get_se(cls, name: str, keyword: str, n_images: int, **kwargs):
         """This returns an initialized object of the search engine given by the name"""
-        if name in cls._SEARCH_ENGINES:
-            return cls._SEARCH_ENGINES.get(name)(keyword, n_images, **kwargs)
-        raise ValueError(f"{name} is not a valid SE")
+        return cls.get_se_class(name)(keyword, n_images, **kwargs)
 
     @classmethod
-    def get_names(cls):
+    def get_async_se(cls, name: str, keyword: str, n_images: int, **kwargs):
+        """This returns an initialized object of the async search engine given by the name"""
+        return cls.get_se_class(name, asynchronous=True)(keyword, n_images, **kwargs)
+
+    @classmethod
+    def get_names(cls, asynchronous: bool = False):
         """Returns a list of the names of registered search engines"""
-        return list(cls._SEARCH_ENGINES.keys())
+        engines, lazy_engines = cls._registries(asynchronous)
+        return list(dict.fromkeys([*lazy_engines, *engines]))
 
     @classmethod
     def get_number_of_ses(cls):
         """Returns how many search engines are currently registered"""
-        return len(cls._SEARCH_ENGINES)
+        return len(cls.get_names())
 
     @classmethod
-    def register_se(cls, name: str):
+    def register_se(cls, name: str, asynchronous: bool = False):
         """This can be used to decorate a class and register it in the factory"""
         def wrapper(_cls):
-            cls._SEARCH_ENGINES[name] = _cls
+            _cls.SE_NAME = name
+            cls._registries(asynchronous)[0][name] = _cls
             return _cls
         return wrapper
 
     @classmethod
-    def remove_se(cls, name: str):
+    def register_lazy(cls, name: str, module_path: str, asynchronous: bool = False):
+        """Registers a search engine whose module is imported on the first get_se"""
+        cls._registries(asynchronous)[1][name] = module_path
+
+    @classmethod
+    def remove_se(cls, name: str, asynchronous: bool = False):
         """This can be used to remove a search engine from the factory"""
-        if name in cls._SEARCH_ENGINES:
-            cls._SEARCH_ENGINES.pop(name)
+        engines, lazy_engines = cls._registries(asynchronous)
+        if name in engines or name in lazy_engines:
+            engines.pop(name, None)
+            lazy_engines.pop(name, None)
             return True
         return False
 
 
-# Disable all the import warnings at this point. This is intended
-# pylint: disable=unused-import,wrong-import-position,cyclic-import
-import search_engines.google
-import search_engines.bing
-import search_engines.duckgo
+# The engines are only imported when they are used, so e.g. selenium is not loaded for bing
+SearchEngineFactory.register_lazy("Google SE", "search_engines.google")
+SearchEngineFactory.register_lazy("Bing SE", "search_engines.bing")
+SearchEngineFactory.register_lazy("Duckgo SE", "search_engines.duckgo")
+SearchEngineFactory.register_lazy("Bing SE", "search_engines.bing_async", asynchronous=True)
+SearchEngineFactory.register_lazy("Duckgo SE", "search_engines.duckgo_async", asynchronous=True)
@@ -1,26 +1,144 @@
 """Interface which any search engine has to implement"""
+import time
 from abc import ABC
-from typing import List
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
 
+import requests
 
-class SearchEngineInterface(ABC):
-    """Interface of the search engines. Implement this when you add a new se"""
+from utils.http_session import get_session
+from utils.metrics import get_metrics
+from utils.rate_limit import get_rate_limiter
+
+MAX_EMPTY_PAGES = 3
+
+
+class EmptyPageMixin:  # pylint: disable=too-few-public-methods
+    """
+    Empty page handling of the sync and async search engines. The engine needs a name and an
+    _empty_pages counter
+    """
+    name: str
+    _empty_pages: int
+
+    def _page_done(self, url: str, n_results: int) -> bool:
+        """
+        Reports the number of results found on the page of url.
+        Returns False if the engine should stop because it keeps getting empty pages
+        """
+        get_metrics().inc("search_pages_total", engine=self.name,
+                          result="ok" if n_results else "empty")
+        if n_results:
+            self._empty_pages = 0
+            return True
+
+        self._empty_pages += 1
+        get_rate_limiter(urlsplit(url).netloc).on_empty_page()
+        return self._empty_pages < MAX_EMPTY_PAGES
+
+
+class SearchEngineInterface(EmptyPageMixin, ABC):
+    """
+    Interface of the search engines. Implement this when you add a new se.
+    By default the urls are collected in __init__. With stream=True nothing is scraped up front
+    and iter_img_urls yields the urls while the result pages arrive.
+    Engines keep their pagination state in cursor. An engine created with the cursor of an earlier
+    run continues with the page the cursor points to.
+    Result pages requested through _fetch_page are cached if a page_cache is given and rate limited
+    per host. Engines report the number of results of every page with _page_done, which stops the
+    engine after MAX_EMPTY_PAGES empty pages in a row.
+    Engines check n_images while they page, so in stream mode it can be raised during the search
+    to get more urls.
+    Requests, pages, found urls and the time spent searching are recorded in the shared metrics.
+    Engines which address their pages by result offset name the cursor key of the offset in
+    OFFSET_CURSOR, so a keyword can be split into parts which are scraped independently.
+    """
+    OFFSET_CURSOR: Optional[str] = None
 
     def __init__(self, keyword: str, n_images: int, **kwargs):
         self._image_urls: List[str] = []
         self.keyword = keyword
         self.n_images = n_images
         self.callback = kwargs.get("callback")
+        self.stream = kwargs.get("stream", False)
+        self.cursor: Dict = dict(kwargs.get("cursor") or {})
+        self.page_cache = kwargs.get("page_cache")
+        self._empty_pages = 0
+        self.n_yielded = 0
+        # the name the engine is registered with, it labels the metrics
+        self.name = getattr(self, "SE_NAME", type(self).__name__)
 
-        self._collect_img_links()
+        if not self.stream:
+            self._collect_img_links()
 
     def __iter__(self):
         """Iterator over image_urls"""
-        yield from self._image_urls
+        yield from self.iter_img_urls()
+
+    def _iter_img_links(self) -> Iterator[str]:
+        """This scrapes the search engine and yields at most n_images urls as they are found"""
+        raise NotImplementedError
+
+    def _instrumented_links(self) -> Iterator[str]:
+        """Yields from _iter_img_links and records the found urls and the time spent searching"""
+        metrics = get_metrics()
+        links = self._iter_img_links()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    link = next(links)
+                except StopIteration:
+                    return
+                finally:
+                    metrics.inc("search_seconds_total", time.perf_counter() - start,
+                                engine=self.name)
+                metrics.inc("search_urls_total", engine=self.name)
+                self.n_yielded += 1
+                yield link
+        finally:
+            links.close()
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request through the shared search session with its timeouts and retries.
+        It waits for the rate limiter of the host and reports the response back to it
+        """
+        host = urlsplit(url).netloc
+        rate_limiter = get_rate_limiter(host)
+        rate_limiter.acquire()
+        start = time.perf_counter()
+        response = get_session().request(method, url, **kwargs)
+        latency = time.perf_counter() - start
+        rate_limiter.on_response(response.status_code, latency)
+
+        metrics = get_metrics()
+        metrics.observe("search_request_seconds", latency, engine=self.name, host=host)
+        metrics.inc("search_requests_total", engine=self.name, host=host,
+                    status=response.status_code)
+        metrics.inc("search_bytes_total", len(response.content), engine=self.name)
+        return response
+
+    def _fetch_page(self, method: str, url: str, is_valid: Optional[Callable[[str], bool]] = None,
+                    **kwargs) -> str:
+        """
+        Returns the text of a result page, from the page cache if the engine has one.
+        Only pages accepted by is_valid are cached, so empty pages are requested again
+        """
+        if self.page_cache is None:
+            return self._request(method, url, **kwargs).text
+        return self.page_cache.fetch(self._request, method, url, is_valid=is_valid, **kwargs)
 
     def _collect_img_links(self):
         """This starts scraping and saves urls to image_urls"""
-        raise NotImplementedError
+        self._image_urls.extend(self._instrumented_links())
+
+    def iter_img_urls(self) -> Iterator[str]:
+        """Yields the image_urls. In stream mode they are scraped lazily and not kept in memory"""
+        if self.stream:
+            yield from self._instrumented_links()
+        else:
+            yield from self._image_urls
 
     def get_img_urls(self):
         """Return the image_urls"""
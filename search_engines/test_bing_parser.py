@@ -0,0 +1,51 @@
+"""Offline Bing unittests, the result pages are served from memory"""
+
+import threading
+import time
+import unittest
+
+from search_engines.bing import Bing, _parse_results
+
+
+class FakePagesBing(Bing):  # pylint: disable=too-few-public-methods
+    """Bing whose pages have 100 results each, the page at offset 100 is empty once"""
+
+    def __init__(self, *args, **kwargs):
+        self.requested = []
+        self.running = self.max_running = 0
+        self.lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _fetch_page(self, method, url, is_valid=None, **kwargs):
+        with self.lock:
+            self.requested.append(url)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        first = int(url.split("&first=")[1].split("&")[0])
+        if first == 100 and self.requested.count(url) == 1:
+            return "<html></html>"
+        return "".join(f'm="{{murl&quot;:&quot;https://example.com/{first + i}.jpg&quot;}}"'
+                       for i in range(100))
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_parse_results(self):
+        """All murl urls of a page are found in order"""
+        html = ('<a m="{&quot;murl&quot;:&quot;https://a.com/1.jpg&quot;}">x</a>'
+                '<a m="{&quot;murl&quot;:&quot;https://b.com/2.png&quot;,&quot;t&quot;:1}">')
+        self.assertEqual(_parse_results(html), ["https://a.com/1.jpg", "https://b.com/2.png"])
+        self.assertEqual(_parse_results("<html></html>"), [])
+
+    def test_page_window(self):
+        """The needed pages are requested at once and the urls still arrive in order"""
+        bing = FakePagesBing("moon", 350)
+        self.assertEqual(bing.get_img_urls(), [f"https://example.com/{i}.jpg" for i in range(350)])
+        self.assertEqual(bing.max_running, Bing.PAGE_WINDOW)
+        self.assertEqual(len(bing.requested), 5)  # 4 pages and the empty page again
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""WebDriverPool unittests, they use fake drivers and need no browser"""
+
+import threading
+import unittest
+
+from selenium.common.exceptions import WebDriverException
+
+from search_engines.driver_pool import WebDriverPool
+
+
+class FakeDriver:  # pylint: disable=too-few-public-methods
+    """Driver which only records whether it was quit"""
+
+    def __init__(self):
+        self.quit_called = False
+
+    def quit(self):
+        """Quits the fake browser"""
+        self.quit_called = True
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.drivers = []
+
+    def _factory(self) -> FakeDriver:
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+    def test_reuse(self):
+        """Released drivers are lent again and quit after recycle_after pages"""
+        pool = WebDriverPool(size=2, recycle_after=3, factory=self._factory)
+        for _ in range(4):
+            with pool.driver():
+                pass
+        self.assertEqual(len(self.drivers), 2)
+        self.assertTrue(self.drivers[0].quit_called)
+        self.assertFalse(self.drivers[1].quit_called)
+
+        pool.close()
+        self.assertTrue(self.drivers[1].quit_called)
+
+    def test_max_size(self):
+        """At most size drivers are lent at the same time"""
+        pool = WebDriverPool(size=1, factory=self._factory)
+        lent = threading.Event()
+
+        def borrow():
+            with pool.driver():
+                lent.set()
+
+        with pool.driver():
+            threading.Thread(target=borrow, daemon=True).start()
+            self.assertFalse(lent.wait(0.2))
+        self.assertTrue(lent.wait(5))
+        self.assertEqual(len(self.drivers), 1)
+
+    def test_broken_driver(self):
+        """A driver which raised a WebDriverException is quit and replaced"""
+        pool = WebDriverPool(size=1, factory=self._factory)
+        with self.assertRaises(WebDriverException):
+            with pool.driver():
+                raise WebDriverException("chrome not reachable")
+        self.assertTrue(self.drivers[0].quit_called)
+
+        with pool.driver() as driver:
+            self.assertIs(driver, self.drivers[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,9 +7,10 @@ from enum import Enum, auto
 from typing import Callable, Type, Dict, Union, Tuple
 
 from search_engines.registry import SearchEngineFactory
-from search_engines.search_engine_interface import SearchEngineInterface
 from webscraper_config import Config as WsConfig
-from utils.download_urls import download_urls
+from utils.metrics import get_metrics
+from utils.page_cache import PageCache
+from utils.scheduler import ScrapeScheduler, expand_jobs, format_summary
 
 
 def clear():
@@ -96,16 +97,19 @@ class MainMenu(State):
 
     def scrape(self):
         """
-        Starts the scraping process by getting the search engine implementation and initializing it
+        Starts the scraping process. Every search engine and keyword combination is a job and the
+        jobs are run in parallel by the scheduler. A summary of all jobs is printed at the end
         """
         config = self.config.to_json()
-        n_samples = config.get("n_samples")
-        for search_engine in config.get("search_engines"):
-            for keyword in config.get("keywords"):
-                concrete_search_engine: SearchEngineInterface = \
-                    SearchEngineFactory.get_se(search_engine, keyword=keyword, n_images=n_samples)
-                download_urls(pathlib.Path(self.config.dataset_path),
-                              concrete_search_engine.get_img_urls())
+        scheduler = ScrapeScheduler(pathlib.Path(self.config.dataset_path), config.get("n_samples"),
+                                    page_cache=PageCache())
+
+        start = time.perf_counter()
+        results = scheduler.run(expand_jobs(config.get("search_engines"), config.get("keywords")))
+        print(format_summary(results, time.perf_counter() - start))
+        print(scheduler.url_deduplicator.report())
+        print(get_metrics().summary())
+
         press_any_key()
         self.callback(Transitions.CURRENT)
 
@@ -0,0 +1,139 @@
+"""Command line unittests with search engines and images served locally"""
+
+import contextlib
+import io
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from cli import EXIT_BAD_CONFIG, EXIT_JOB_FAILED, EXIT_OK, main
+from search_engines.registry import SearchEngineFactory
+from search_engines.search_engine_interface import SearchEngineInterface
+
+
+class PngHandler(BaseHTTPRequestHandler):
+    """Answers every path with a different png"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the request"""
+        body = b"\x89PNG\r\n\x1a\n" + self.path.encode() * 10
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class LocalSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine whose results are images of the local server, starting at the offset"""
+    OFFSET_CURSOR = "offset"
+    host = ""
+
+    def _iter_img_links(self):
+        offset = self.cursor.get(self.OFFSET_CURSOR, 0)
+        yield from (f"http://{self.host}/{self.keyword}/{i}.png"
+                    for i in range(offset, offset + self.n_images))
+
+
+class BrokenSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine which fails on the first page"""
+
+    def _iter_img_links(self):
+        raise ValueError("no result page")
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PngHandler)
+        LocalSe.host = f"127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        SearchEngineFactory.register_se("Local SE")(LocalSe)
+        SearchEngineFactory.register_se("Broken SE")(BrokenSe)
+
+    @classmethod
+    def tearDownClass(cls):
+        SearchEngineFactory.remove_se("Local SE")
+        SearchEngineFactory.remove_se("Broken SE")
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = Path(self.tmp_dir.name)
+        self.dataset_path = self.path / "dataset"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _config(self, **fields) -> str:
+        config = {"dataset_path": str(self.dataset_path), "keywords": ["moon", "sun"],
+                  "n_samples": 5, "search_engines": ["Local SE"], **fields}
+        config_path = self.path / "config.json"
+        config_path.write_text(json.dumps(config), encoding="utf-8")
+        return str(config_path)
+
+    def _main(self, *argv: str) -> int:
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            status = main(list(argv))
+        self.stderr = stderr.getvalue()  # pylint: disable=attribute-defined-outside-init
+        return status
+
+    def test_bad_config(self):
+        """Missing config files and fields are reported with exit status 2"""
+        self.assertEqual(self._main("scrape", "--config", str(self.path / "missing.json")),
+                         EXIT_BAD_CONFIG)
+        self.assertIn("is not a config file", self.stderr)
+
+        self.assertEqual(self._main("scrape", "--config", self._config(keywords=[])),
+                         EXIT_BAD_CONFIG)
+        self.assertIn("is missing keywords", self.stderr)
+        self.assertFalse(self.dataset_path.exists())
+
+    def test_scrape(self):
+        """All jobs succeed with exit status 0, a failed job gives exit status 1"""
+        config = self._config()
+        self.assertEqual(self._main("scrape", "--config", config, "--no-page-cache"), EXIT_OK)
+        self.assertEqual(len(list(self.dataset_path.glob("*.png"))), 10)
+
+        config = self._config(search_engines=["Local SE", "Broken SE"])
+        self.assertEqual(self._main("scrape", "--config", config, "--no-page-cache"),
+                         EXIT_JOB_FAILED)
+
+    def test_queue(self):
+        """A config is enqueued, worked off and reported, unknown backends are refused"""
+        queue = str(self.path / "queue.db")
+        self.assertEqual(self._main("work", "--queue", queue), EXIT_BAD_CONFIG)
+        self.assertIn("has no config", self.stderr)
+
+        self.assertEqual(self._main("enqueue", "--config", self._config(), "--queue", queue,
+                                    "--task-size", "2"), EXIT_OK)
+        # a single job, so no thread waits for the tasks of another one
+        self.assertEqual(self._main("work", "--queue", queue, "--no-page-cache", "--jobs", "1"),
+                         EXIT_OK)
+        self.assertEqual(self._main("status", "--queue", queue), EXIT_OK)
+        self.assertEqual(len(list(self.dataset_path.glob("*.png"))), 10)
+
+        self.assertEqual(self._main("status", "--queue", "redis://localhost"), EXIT_BAD_CONFIG)
+        self.assertIn("is not a queue backend", self.stderr)
+
+    def test_queue_shards(self):
+        """The tar shards of a worker are named after it"""
+        queue = str(self.path / "queue.db")
+        self.assertEqual(self._main("enqueue", "--config", self._config(), "--queue", queue),
+                         EXIT_OK)
+        self.assertEqual(self._main("work", "--queue", queue, "--no-page-cache", "--jobs", "1",
+                                    "--layout", "shards", "--name", "worker-1"), EXIT_OK)
+        self.assertEqual([path.name for path in self.dataset_path.glob("*.tar")],
+                         ["shard-worker-1-000000.tar"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Runs many keyword searches concurrently in one event loop with the async search engines"""
+import asyncio
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+from search_engines.async_search_engine_interface import client_session
+from search_engines.registry import SearchEngineFactory
+from utils.page_cache import PageCache
+from utils.scheduler import ScrapeJob
+
+DEFAULT_MAX_SEARCHES = 64
+
+
+class SearchResult(NamedTuple):
+    """Urls found by the search of a ScrapeJob"""
+    job: ScrapeJob
+    urls: List[str]
+    duration: float
+    error: Optional[str] = None
+
+
+async def search_async(jobs: Iterable[ScrapeJob], n_images: int,
+                       max_searches: int = DEFAULT_MAX_SEARCHES,
+                       page_cache: Optional[PageCache] = None,
+                       on_url: Optional[Callable[[ScrapeJob, str], None]] = None
+                       ) -> List[SearchResult]:
+    """
+    Searches n_images urls for every job in the running event loop. At most max_searches run at
+    the same time and all of them share one aiohttp session, the hosts are still rate limited.
+    on_url is called with the job and every url as soon as it is found. A failing search keeps
+    the urls it found before the error.
+    Returns the results in the order of the jobs
+    """
+    semaphore = asyncio.Semaphore(max_searches)
+
+    async with client_session(limit=max_searches) as session:
+        async def search(job: ScrapeJob) -> SearchResult:
+            async with semaphore:
+                start = time.perf_counter()
+                urls: List[str] = []
+                try:
+                    search_engine = SearchEngineFactory.get_async_se(
+                        job.search_engine, keyword=job.keyword, n_images=n_images,
+                        page_cache=page_cache, session=session)
+                    async for url in search_engine:
+                        urls.append(url)
+                        if on_url is not None:
+                            on_url(job, url)
+                except Exception as error:  # pylint: disable=broad-except
+                    # a failing search must not cancel the other searches
+                    return SearchResult(job, urls, time.perf_counter() - start, repr(error))
+                return SearchResult(job, urls, time.perf_counter() - start)
+
+        return list(await asyncio.gather(*(search(job) for job in jobs)))
+
+
+def search(jobs: Iterable[ScrapeJob], n_images: int, **kwargs) -> List[SearchResult]:
+    """Runs search_async in a new event loop, see there for the arguments"""
+    return asyncio.run(search_async(jobs, n_images, **kwargs))
@@ -0,0 +1,145 @@
+"""Checkpoints which allow an interrupted scrape job to be resumed"""
+import hashlib
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Set
+
+from search_engines.search_engine_interface import SearchEngineInterface
+
+CHECKPOINT_DIR = ".checkpoints"
+
+
+class JobCheckpoint:
+    """
+    Progress of a single (search engine, keyword) job.
+    It records the collected urls, the pagination cursor of the search engine and the urls whose
+    download is completed. Every change is appended as a json line, so it is on disk right away and
+    a killed run loses at most the line it was writing
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        self.urls: List[str] = []
+        self.cursor: Dict = {}
+        self.completed: Set[str] = set()
+        self.saved: Set[str] = set()
+        self.search_done = False
+
+        self._known_urls: Set[str] = set()
+        self._lock = threading.Lock()
+
+        if self.file_path.exists():
+            self._replay()
+
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        # line buffered so every event is on disk as soon as it is recorded
+        self._file = open(  # pylint: disable=consider-using-with
+            self.file_path, "a", encoding="utf-8", buffering=1)
+
+    @classmethod
+    def for_job(cls, dataset_path: Path, search_engine: str, keyword: str,
+                part: str = "") -> "JobCheckpoint":
+        """
+        Returns the checkpoint of the job inside the checkpoint dir of the dataset. Jobs which
+        only scrape a part of the results of a keyword pass a name of the part
+        """
+        name = f"{search_engine}\0{keyword}" + (f"\0{part}" if part else "")
+        slug = re.sub(r"[^a-z0-9]+", "_", f"{search_engine}_{keyword}_{part}".lower()).strip("_")
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        return cls(dataset_path / CHECKPOINT_DIR / f"{slug[:50]}_{digest}.jsonl")
+
+    def _replay(self):
+        with open(self.file_path, "r", encoding="utf-8") as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a run that was killed mid write can leave a partial last line
+                if "url" in event:
+                    self.urls.append(event["url"])
+                    self._known_urls.add(event["url"])
+                    self.cursor = event.get("cursor", self.cursor)
+                elif "done" in event:
+                    self.completed.add(event["done"])
+                    if event.get("saved", True):
+                        self.saved.add(event["done"])
+                elif "reopen" in event:
+                    self.completed.discard(event["reopen"])
+                    self.saved.discard(event["reopen"])
+                elif "search_done" in event:
+                    self.search_done = True
+
+    def _write(self, event: Dict):
+        with self._lock:
+            self._file.write(json.dumps(event) + "\n")
+
+    def add_url(self, url: str, cursor: Dict) -> bool:
+        """Records a collected url and the cursor of the page it was found on"""
+        if url in self._known_urls:
+            return False
+        self.urls.append(url)
+        self._known_urls.add(url)
+        self.cursor = dict(cursor)
+        self._write({"url": url, "cursor": self.cursor})
+        return True
+
+    def mark_done(self, url: str, saved: bool = True):
+        """
+        Records that the download of url is completed and whether the image was saved.
+        Can be used as on_done of download_urls
+        """
+        with self._lock:
+            self.completed.add(url)
+            if saved:
+                self.saved.add(url)
+        self._write({"done": url, "saved": saved})
+
+    @property
+    def n_saved(self) -> int:
+        """Number of urls whose image was saved"""
+        return len(self.saved)
+
+    def reopen_missing(self, is_stored: Callable[[str], bool]) -> int:
+        """
+        Marks the saved urls for which is_stored returns False as not downloaded, so they are
+        downloaded again. A killed run can record urls whose image never reached the dataset, e.g.
+        the ones in an unfinished shard. Returns the number of reopened urls
+        """
+        missing = [url for url in self.saved if not is_stored(url)]
+        for url in missing:
+            with self._lock:
+                self.completed.discard(url)
+                self.saved.discard(url)
+            self._write({"reopen": url})
+        return len(missing)
+
+    def finish_search(self):
+        """Records that the search engine has no more results"""
+        self.search_done = True
+        self._write({"search_done": True})
+
+    def iter_img_urls(self, search_engine: SearchEngineInterface, n_images: int) -> Iterator[str]:
+        """
+        Yields the urls of the job which are not downloaded yet. First the urls collected by an
+        earlier run are replayed, then search_engine continues from the saved cursor until n_images
+        urls are collected. search_engine has to be created in stream mode with the cursor of this
+        checkpoint
+        """
+        yield from [url for url in self.urls if url not in self.completed]
+
+        if self.search_done or len(self.urls) >= n_images:
+            return
+        for url in search_engine.iter_img_urls():
+            # the page of the cursor is fetched again, so skip the urls which are already known
+            if self.add_url(url, search_engine.cursor):
+                yield url
+            if len(self.urls) >= n_images:
+                return
+        self.finish_search()
+
+    def close(self):
+        """Closes the checkpoint file"""
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,244 @@
+"""Layouts in which the downloaded images are stored and the manifest of the dataset"""
+import json
+import os
+import re
+import tarfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.perceptual_hash import Image
+
+MANIFEST_FILE_NAME = "manifest.jsonl"
+PREFIX_LENGTH = 2
+DEFAULT_SHARD_SIZE = 1000  # images
+DEFAULT_MAX_SHARD_BYTES = 1024 * 1024 * 1024
+SHARD_BUFFER_SIZE = 1024 * 1024
+SHARD_PATTERN = re.compile(r"^\.?shard-(?:(.+)-)?(\d+)\.tar(\.part)?$")
+
+
+def _image_size(path: Path) -> Tuple[Optional[int], Optional[int]]:
+    """Returns width and height from the header of the image, None and None without pillow"""
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None, None
+
+
+class DatasetWriter:
+    """
+    Stores the images flat in the dataset dir as {md5}.{ext} and appends a record with url, file,
+    hash, size and dimensions of every image to the json lines manifest. The record is written
+    before write returns, so it is never behind the download index
+    """
+    LAYOUT = "flat"
+
+    _instances: Dict[Path, "DatasetWriter"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, dataset_path: Path):
+        self.dataset_path = dataset_path.resolve()
+        self.dataset_path.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.dataset_path / MANIFEST_FILE_NAME
+        self._lock = threading.Lock()
+        self._pending: List[Dict] = []
+        # line buffered so every record is on disk as soon as it is added
+        self._manifest = open(  # pylint: disable=consider-using-with
+            self.manifest_path, "a", encoding="utf-8", buffering=1)
+
+    @classmethod
+    def for_path(cls, dataset_path: Path, layout: str = LAYOUT, **kwargs) -> "DatasetWriter":
+        """
+        Returns the writer of the dataset for one of LAYOUTS. Jobs writing to the same dataset
+        share one writer, so they have to use the same layout and options
+        """
+        dataset_path = dataset_path.resolve()
+        with cls._instances_lock:
+            if dataset_path not in cls._instances:
+                cls._instances[dataset_path] = LAYOUTS[layout](dataset_path, **kwargs)
+            writer = cls._instances[dataset_path]
+        if writer.LAYOUT != layout:
+            raise ValueError(f"{dataset_path} is already written with the {writer.LAYOUT} layout")
+        for name, value in kwargs.items():
+            if getattr(writer, name) != value:
+                raise ValueError(f"{dataset_path} is already written with {name} "
+                                 f"{getattr(writer, name)}")
+        return writer
+
+    def location(self, file_name: str) -> str:
+        """Returns where the image file_name is stored, relative to the dataset dir"""
+        return file_name
+
+    def is_stored(self, file_name: str) -> bool:
+        """Returns True if the image file_name is in the dataset"""
+        return (self.dataset_path / self.location(file_name)).exists()
+
+    def directory(self, location: str) -> Path:
+        """Returns the directory which has to be synced to make the stored image durable"""
+        return (self.dataset_path / location).parent
+
+    def _store(self, tmp_path: Path, file_name: str) -> str:
+        """Moves the image into the dataset and returns its location"""
+        os.replace(tmp_path, self.dataset_path / file_name)
+        return file_name
+
+    def write(self, tmp_path: Path, file_name: str, record: Dict) -> str:
+        """
+        Moves the image at tmp_path into the dataset as file_name and adds record (e.g. url,
+        keyword and engine) to the manifest. Returns the location of the image
+        """
+        width, height = _image_size(tmp_path)
+        record = {**record, "size": tmp_path.stat().st_size, "width": width, "height": height}
+        with self._lock:
+            record["file"] = self._store(tmp_path, file_name)
+            self._add_record(record)
+        return record["file"]
+
+    def _add_record(self, record: Dict):
+        self._manifest.write(json.dumps(record) + "\n")
+
+    def _flush(self):
+        """Appends the buffered records to the manifest with a single write"""
+        if self._pending:
+            self._manifest.write("".join(json.dumps(record) + "\n" for record in self._pending))
+            self._pending = []
+
+    def _finish(self):
+        self._flush()
+
+    def close(self):
+        """Writes the buffered records. for_path will open the writer again"""
+        with self._instances_lock:
+            if self._instances.get(self.dataset_path) is self:
+                self._instances.pop(self.dataset_path)
+        with self._lock:
+            if not self._manifest.closed:
+                self._finish()
+                self._manifest.close()
+
+
+class PrefixDatasetWriter(DatasetWriter):
+    """
+    Stores the images in subdirectories named by the first PREFIX_LENGTH characters of their hash,
+    so even big datasets have no directory with more than a few thousand files
+    """
+    LAYOUT = "prefix"
+
+    def location(self, file_name: str) -> str:
+        return f"{file_name[:PREFIX_LENGTH]}/{file_name}"
+
+    def _store(self, tmp_path: Path, file_name: str) -> str:
+        location = self.location(file_name)
+        (self.dataset_path / location).parent.mkdir(exist_ok=True)
+        os.replace(tmp_path, self.dataset_path / location)
+        return location
+
+
+class ShardDatasetWriter(DatasetWriter):
+    """
+    Packs the images into webdataset style tar shards of at most shard_size images or
+    max_shard_bytes. The open shard is a hidden .part file which is synced and renamed to
+    shard-NNNNNN.tar when it is full or the writer is closed, so a shard is either complete or not
+    there. The manifest records of a shard are written when it is finalized.
+    Processes which write to the same dataset at the same time, e.g. the workers of a work queue,
+    need different names, which become part of their shard names (shard-{name}-NNNNNN.tar).
+    Unfinished shards of a killed run with the same name are deleted. The download index does not
+    find their images anymore, so JobCheckpoint.reopen_missing hands their urls out again
+    """
+    LAYOUT = "shards"
+
+    def __init__(self, dataset_path: Path, shard_size: int = DEFAULT_SHARD_SIZE,
+                 max_shard_bytes: int = DEFAULT_MAX_SHARD_BYTES, name: str = ""):
+        super().__init__(dataset_path)
+        self.shard_size = shard_size
+        self.max_shard_bytes = max_shard_bytes
+        self.name = name
+
+        # identical images found under several urls are only stored once
+        self._locations: Dict[str, str] = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    try:
+                        location = json.loads(line)["file"]
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+                    self._locations[location.rsplit("/", 1)[-1]] = location
+
+        numbers = [-1]
+        for path in self.dataset_path.iterdir():
+            match = SHARD_PATTERN.match(path.name)
+            # the shards of other names may be written by a running process
+            if match and (match.group(1) or "") == name:
+                # the numbers of unfinished shards are not used again, the index may point to them
+                numbers.append(int(match.group(2)))
+                if match.group(3):
+                    path.unlink()
+        self._next_shard = max(numbers) + 1
+
+        self._shard_name = ""
+        self._shard_file = None
+        self._tar: Optional[tarfile.TarFile] = None
+        self._shard_images = 0
+        self._shard_bytes = 0
+
+    def location(self, file_name: str) -> str:
+        return self._locations.get(file_name, file_name)
+
+    def is_stored(self, file_name: str) -> bool:
+        # the images of the open shard count as stored, unfinished shards of old runs are deleted
+        return file_name in self._locations
+
+    def directory(self, location: str) -> Path:
+        # the image is in the open shard, finalizing it renames the shard in the dataset dir
+        return self.dataset_path
+
+    def _store(self, tmp_path: Path, file_name: str) -> str:
+        if file_name in self._locations:
+            tmp_path.unlink()
+            return self._locations[file_name]
+
+        if self._tar is None:
+            prefix = f"shard-{self.name}-" if self.name else "shard-"
+            self._shard_name = f"{prefix}{self._next_shard:06d}.tar"
+            self._next_shard += 1
+            self._shard_file = open(  # pylint: disable=consider-using-with
+                self.dataset_path / f".{self._shard_name}.part", "wb", buffering=SHARD_BUFFER_SIZE)
+            self._tar = tarfile.open(  # pylint: disable=consider-using-with
+                fileobj=self._shard_file, mode="w")
+        self._tar.add(tmp_path, arcname=file_name)
+        self._shard_images += 1
+        self._shard_bytes += tmp_path.stat().st_size
+        tmp_path.unlink()
+
+        location = f"{self._shard_name}/{file_name}"
+        self._locations[file_name] = location
+        return location
+
+    def _add_record(self, record: Dict):
+        self._pending.append(record)
+        if self._shard_images >= self.shard_size or self._shard_bytes >= self.max_shard_bytes:
+            self._finalize_shard()
+
+    def _finalize_shard(self):
+        """Completes the open shard on disk, renames it and writes its manifest records"""
+        if self._tar is not None:
+            self._tar.close()
+            self._shard_file.flush()
+            os.fsync(self._shard_file.fileno())
+            self._shard_file.close()
+            os.replace(self.dataset_path / f".{self._shard_name}.part",
+                       self.dataset_path / self._shard_name)
+            self._tar, self._shard_file = None, None
+            self._shard_images = self._shard_bytes = 0
+        self._flush()
+
+    def _finish(self):
+        self._finalize_shard()
+
+
+LAYOUTS = {writer.LAYOUT: writer
+           for writer in (DatasetWriter, PrefixDatasetWriter, ShardDatasetWriter)}
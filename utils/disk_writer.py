@@ -0,0 +1,205 @@
+"""Write-behind stage which stores the downloaded images off the download threads"""
+import collections
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from utils.metrics import Metrics, get_metrics
+
+DEFAULT_N_THREADS = 4
+DEFAULT_MAX_QUEUE_BYTES = 64 * 1024 * 1024
+DEFAULT_SYNC_EVERY = 256  # files written before the directories are synced
+DEFAULT_SYNC_SECONDS = 2.0  # the directories are synced at least this often while files come in
+
+
+class _WriteRequest(NamedTuple):
+    tmp_path: Path
+    size: int
+    finish: Callable[[Path], Tuple[object, Optional[Path]]]
+    future: Future
+    labels: Dict[str, str]
+    queued: float
+
+
+def _sync_file(path: Path):
+    """Makes the data of the file durable"""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sync_directory(directory: Path):
+    """Makes the renames in directory durable"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehindWriter:
+    """
+    Makes images durable in n_threads background threads, so a slow disk or network file system
+    does not stall the downloads.
+    submit queues the temp file a download streamed an image to. A writer thread fsyncs it and
+    calls finish with its path, which moves the file to its final name and returns the directory
+    it moved the file into. These directories are synced in batches of sync_every files (or every
+    sync_seconds) instead of after every rename, and whenever the queue runs empty. The future of
+    a file gets the result of finish only after the sync of its directory, so nothing recorded by
+    the callbacks of the future (e.g. the download index) is ahead of the disk. While more than
+    max_queue_bytes of files wait in the queue submit blocks, so the downloads slow down to the
+    speed of the disk.
+    The queue depth, the time images wait in the queue, the fsync latency and the time the
+    downloads were blocked are recorded in the metrics
+    """
+
+    def __init__(self, n_threads: int = DEFAULT_N_THREADS,
+                 max_queue_bytes: int = DEFAULT_MAX_QUEUE_BYTES,
+                 sync_every: int = DEFAULT_SYNC_EVERY, sync_seconds: float = DEFAULT_SYNC_SECONDS,
+                 fsync: bool = True, metrics: Optional[Metrics] = None):
+        self.n_threads = n_threads
+        self.max_queue_bytes = max_queue_bytes
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.fsync = fsync
+        self.metrics = metrics or get_metrics()
+
+        self._queue: Deque[_WriteRequest] = collections.deque()
+        self._queued_bytes = 0
+        self._active = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._unsynced: Set[Path] = set()
+        self._unsynced_results: List[Tuple[Future, object]] = []
+        self._last_sync = time.monotonic()
+        self._sync_lock = threading.Lock()
+
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(n_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def _set_queue_gauges(self):
+        self.metrics.set_gauge("disk_queue_depth", len(self._queue))
+        self.metrics.set_gauge("disk_queue_bytes", self._queued_bytes)
+
+    def submit(self, tmp_path: Path, size: int,
+               finish: Callable[[Path], Tuple[object, Optional[Path]]], **labels) -> Future:
+        """
+        Queues the temp file of size bytes, blocks while the queue is full. The writer deletes it
+        if finish fails or the future is cancelled. finish returns a result and the directory of
+        the file or None if it deleted the file. The returned future gets the result once the
+        directory is synced, or the exception of finish
+        """
+        future: Future = Future()
+        start = time.perf_counter()
+        with self._condition:
+            # a single image bigger than the limit is let through an empty queue
+            while self._queue and self._queued_bytes + size > self.max_queue_bytes \
+                    and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError("the writer is closed")
+            self._queue.append(_WriteRequest(tmp_path, size, finish, future, labels,
+                                             time.perf_counter()))
+            self._queued_bytes += size
+            self._set_queue_gauges()
+            self._condition.notify_all()
+        blocked = time.perf_counter() - start
+        if blocked > 0.001:
+            self.metrics.inc("disk_backpressure_seconds_total", blocked, **labels)
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                request = self._queue.popleft()
+                self._queued_bytes -= request.size
+                self._active += 1
+                self._set_queue_gauges()
+                self._condition.notify_all()
+            try:
+                self._write(request)
+            finally:
+                with self._condition:
+                    self._active -= 1
+                    idle = not self._queue and not self._active
+                    self._condition.notify_all()
+            self._maybe_sync(idle)
+
+    def _write(self, request: _WriteRequest):
+        start = time.perf_counter()
+        self.metrics.observe("disk_queue_seconds", start - request.queued, **request.labels)
+        if not request.future.set_running_or_notify_cancel():
+            request.tmp_path.unlink(missing_ok=True)
+            return
+        try:
+            if self.fsync:
+                _sync_file(request.tmp_path)
+            self.metrics.observe("disk_write_seconds", time.perf_counter() - start,
+                                 **request.labels)
+            result, directory = request.finish(request.tmp_path)
+        except BaseException as error:  # pylint: disable=broad-except
+            # the fsync or finish failed before the temp file was moved or deleted
+            request.tmp_path.unlink(missing_ok=True)
+            request.future.set_exception(error)
+            return
+        with self._sync_lock:
+            if directory is not None:
+                self._unsynced.add(directory)
+            self._unsynced_results.append((request.future, result))
+
+    def _maybe_sync(self, idle: bool):
+        with self._sync_lock:
+            if not idle and len(self._unsynced_results) < self.sync_every \
+                    and time.monotonic() - self._last_sync < self.sync_seconds:
+                return
+        self.sync()
+
+    def sync(self):
+        """
+        Syncs the directories which got files since the last sync and resolves the futures of
+        the files. If a sync fails the futures get its error
+        """
+        with self._sync_lock:
+            directories, self._unsynced = self._unsynced, set()
+            results, self._unsynced_results = self._unsynced_results, []
+            self._last_sync = time.monotonic()
+            try:
+                if self.fsync and directories:
+                    start = time.perf_counter()
+                    for directory in directories:
+                        _sync_directory(directory)
+                    self.metrics.observe("disk_sync_seconds", time.perf_counter() - start)
+            except OSError as error:
+                for future, _ in results:
+                    future.set_exception(error)
+                return
+        for future, result in results:
+            future.set_result(result)
+
+    def flush(self):
+        """Waits until all queued images are written and syncs their directories"""
+        with self._condition:
+            while self._queue or self._active:
+                self._condition.wait()
+        self.sync()
+
+    def close(self):
+        """Writes the queued images and stops the threads"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.sync()
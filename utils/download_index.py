@@ -0,0 +1,84 @@
+"""Persistent index of the images which were already downloaded into a dataset"""
+import json
+import threading
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+
+class IndexEntry(NamedTuple):
+    """Hash and file name of the image a url was downloaded to"""
+    md5: str
+    file_name: str
+
+
+class DownloadIndex:
+    """
+    Maps source urls to the hash and file of the downloaded image.
+    The index is an append only json lines file in the dataset dir. It is read into a dict once
+    when it is opened, so every lookup is O(1) and never touches the network
+    """
+    FILE_NAME = ".download_index.jsonl"
+
+    _instances: Dict[Path, "DownloadIndex"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, dataset_path: Path):
+        self.dataset_path = dataset_path.resolve()
+        self.file_path = self.dataset_path / self.FILE_NAME
+        self._entries: Dict[str, IndexEntry] = {}
+        self._lock = threading.Lock()
+
+        if self.file_path.exists():
+            with open(self.file_path, "r", encoding="utf-8") as index_file:
+                for line in index_file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a run that was killed mid write can leave a partial last line
+                    self._entries[record["url"]] = IndexEntry(record["md5"], record["file_name"])
+
+        # line buffered so every entry is on disk as soon as it is added
+        self._file = open(  # pylint: disable=consider-using-with
+            self.file_path, "a", encoding="utf-8", buffering=1)
+
+    @classmethod
+    def for_path(cls, dataset_path: Path) -> "DownloadIndex":
+        """Returns the index of the dataset. Jobs writing to the same dataset share one index"""
+        dataset_path = dataset_path.resolve()
+        with cls._instances_lock:
+            if dataset_path not in cls._instances:
+                cls._instances[dataset_path] = cls(dataset_path)
+            return cls._instances[dataset_path]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url: str):
+        return self.get(url) is not None
+
+    def get(self, url: str) -> Optional[IndexEntry]:
+        """
+        Returns the entry of the url if the image is still in the dataset.
+        The file name of an image in a shard is <shard>/<file name>, then the shard has to exist
+        """
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        path = self.dataset_path / entry.file_name
+        if not (path.exists() or path.parent.is_file()):
+            return None
+        return entry
+
+    def add(self, url: str, md5: str, file_name: str):
+        """Records that url was saved as file_name"""
+        with self._lock:
+            self._entries[url] = IndexEntry(md5, file_name)
+            self._file.write(json.dumps({"url": url, "md5": md5, "file_name": file_name}) + "\n")
+
+    def close(self):
+        """Closes the index file. for_path will open the index again"""
+        with self._instances_lock:
+            if self._instances.get(self.dataset_path) is self:
+                self._instances.pop(self.dataset_path)
+        with self._lock:
+            self._file.close()
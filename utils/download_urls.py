@@ -1,18 +1,91 @@
+"""Concurrent download of image urls into the dataset directory"""
+import functools
 import hashlib
-import io
-from typing import List
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import requests
 
-MAGIC_NUMBERS = [
-    b"\xff\xd8\xff",  # jpg
-    b"\x89\x50\x4e",  # png but only first 3 byte
-]
+from utils.dataset_writer import DatasetWriter
+from utils.disk_writer import WriteBehindWriter
+from utils.download_index import DownloadIndex
+from utils.host_health import get_host_health
+from utils.http_session import IMAGE_SESSION, get_session
+from utils.image_processing import ImageProcessor
+from utils.metrics import Metrics, get_metrics
+from utils.perceptual_hash import NearDuplicateIndex, dhash
+from utils.target_count import DownloadTarget
 
+# first bytes of the accepted image formats and the extension the images are saved with
+MAGIC_NUMBERS = {
+    b"\xff\xd8\xff": "jpg",
+    b"\x89PNG": "png",
+    b"GIF8": "gif",
+    b"RIFF": "webp",  # followed by the file size and b"WEBP", see _detect_format
+}
+HEAD_SIZE = 12
 
-def _check_magic_number(line):
-    return line in MAGIC_NUMBERS
+DEFAULT_N_WORKERS = 16
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_MAX_IMAGE_SIZE = 20 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# statuses which count as a failure of the host, 429 so a throttling host is left alone for a while
+HOST_FAILURE_STATUSES = (429, 500, 502, 503, 504)
+
+# some image hosts do not send an image/* Content-Type
+OCTET_STREAM_TYPES = {"application/octet-stream", "binary/octet-stream"}
+
+_STOP = object()  # sentinel telling a worker that no more urls will come
+
+
+class _HostLimiter:
+    """Limits how many downloads run against the same host at the same time"""
+
+    def __init__(self, max_per_host: int):
+        self._max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    def get(self, url: str) -> threading.BoundedSemaphore:
+        """Returns the semaphore guarding the host of the url"""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self._max_per_host)
+            return self._semaphores[host]
+
+
+_host_limiters: Dict[int, _HostLimiter] = {}
+_host_limiters_lock = threading.Lock()
+
+
+def _get_host_limiter(max_per_host: int) -> _HostLimiter:
+    """
+    Returns the limiter shared by all downloads of the process which allow max_per_host
+    downloads per host, so parallel jobs together stay within the limit
+    """
+    with _host_limiters_lock:
+        if max_per_host not in _host_limiters:
+            _host_limiters[max_per_host] = _HostLimiter(max_per_host)
+        return _host_limiters[max_per_host]
+
+
+def _detect_format(head: bytes) -> Optional[str]:
+    """Returns the extension of the image format the file starts with or None"""
+    for magic_number, extension in MAGIC_NUMBERS.items():
+        if head.startswith(magic_number):
+            if extension == "webp" and head[8:HEAD_SIZE] != b"WEBP":
+                return None  # another riff container, e.g. a wav or avi file
+            return extension
+    return None
 
 
 def _check_path(path: Path):
@@ -28,24 +101,452 @@ def _check_path(path: Path):
     return path
 
 
-def download_urls(download_path: Path, url_list: List[str]):
-    download_path = _check_path(download_path)
-    for link in url_list:
+def _check_headers(response: requests.Response, max_image_size: int) -> bool:
+    """Checks status, Content-Type and Content-Length before the body is read"""
+    if not response.ok:
+        return False
+
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type and not content_type.startswith("image/") \
+            and content_type not in OCTET_STREAM_TYPES:
+        return False
+
+    content_length = response.headers.get("Content-Length", "")
+    return not content_length.isdigit() or int(content_length) <= max_image_size
+
+
+def _read_head(chunks: Iterator[bytes], size: int) -> bytes:
+    """Reads chunks until at least size bytes are available"""
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            break
+    return head
+
+
+class _Body(NamedTuple):
+    path: Optional[Path]  # hidden temp file with the image
+    md5: str
+    size: int
+
+
+def _write_body(chunks: Iterator[bytes], head: bytes, directory: Path,
+                max_image_size: int) -> _Body:
+    """
+    Writes head and the remaining chunks to a temp file in directory while the md5 is computed,
+    so only a chunk of the image is in memory. path of the result is None if the image is bigger
+    than max_image_size, then the file is deleted and the rest of the response is not read
+    """
+    md5 = hashlib.md5(head)
+    size = len(head)
+    handle, tmp_name = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(handle, "wb") as tmp_file:
+            tmp_file.write(head)
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_image_size:
+                    break
+                md5.update(chunk)
+                tmp_file.write(chunk)
+    except BaseException:
+        tmp_path.unlink()
+        raise
+    if size > max_image_size:
+        tmp_path.unlink()
+        return _Body(None, "", size)
+    return _Body(tmp_path, md5.hexdigest(), size)
+
+
+class _Fetched(NamedTuple):
+    """Result of the network part of a download, body and extension are set for images"""
+    result: str
+    reason: str = ""
+    body: Optional[_Body] = None
+    extension: str = ""
+
+
+def _done_future(value: Optional[bool]) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
+
+
+class _Downloader:
+    """
+    Downloads single urls. Urls in the download index are skipped without a request, html pages,
+    videos and responses bigger than max_image_size are dropped and the file extension is taken
+    from the first bytes of the image. Every url is recorded in the metrics with its result (saved,
+    known, rejected with a reason, skipped or error), its latency and the bytes transferred. Every
+    request is reported to the health of its host (see utils.host_health) and urls of hosts whose
+    circuit is open are skipped without a request.
+    The images are streamed to temp files in the download path and handed to the disk_writer,
+    whose threads sync, check and store them while the download thread continues with the next
+    url. With near_duplicates images whose perceptual hash is close to one in the dataset are
+    rejected. With a processor every image is decoded in its worker processes, which rejects
+    broken images, fixes the extension and resizes or converts it as configured. With a writer the
+    images are stored in its layout (e.g. tar shards) and recorded in its manifest together with
+    manifest_fields, e.g. keyword and search engine
+    """
+
+    def __init__(self, session: requests.Session, host_limiter: _HostLimiter, index: DownloadIndex,
+                 download_path: Path, max_image_size: int, metrics: Metrics,
+                 metric_labels: Dict[str, str], disk_writer: WriteBehindWriter,
+                 near_duplicates: Optional[NearDuplicateIndex] = None,
+                 processor: Optional[ImageProcessor] = None,
+                 writer: Optional[DatasetWriter] = None,
+                 manifest_fields: Optional[Dict[str, str]] = None):
+        self.session = session
+        self.host_limiter = host_limiter
+        self.index = index
+        self.download_path = download_path
+        self.max_image_size = max_image_size
+        self.metrics = metrics
+        self.metric_labels = metric_labels
+        self.disk_writer = disk_writer
+        self.near_duplicates = near_duplicates
+        self.processor = processor
+        self.writer = writer
+        self.manifest_fields = manifest_fields or {}
+
+    def download(self, link: str) -> Future:
+        """
+        Downloads a url. The result of the future is True if an image was saved or is already in
+        the dataset and None if the download was skipped because its host is down. The future of
+        an image is done when the disk writer stored it and synced its directory, only then the
+        url is added to the download index
+        """
+        start = time.perf_counter()
+        fetched = self._fetch(link)
+        if fetched.body is None:
+            return _done_future(self._report(link, start, fetched.result, fetched.reason))
+
+        def finish(tmp_path: Path) -> Tuple[Tuple[Optional[bool], Optional[str]], Optional[Path]]:
+            result, reason, location = self._store(link, tmp_path, fetched.body.md5,
+                                                   fetched.extension)
+            directory = self._directory(location) if result == "saved" else None
+            return (self._report(link, start, result, reason), location), directory
+
+        future: Future = Future()
+
+        def synced(write_future: Future):
+            try:
+                saved, location = write_future.result()
+            except BaseException as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+                return
+            if location is not None:
+                self.index.add(link, fetched.body.md5, location)
+            future.set_result(saved)
+
         try:
-            r = requests.get(link)
-        except requests.exceptions.ReadTimeout:
-            continue
-        except requests.exceptions.ConnectionError:
-            continue
+            write_future = self.disk_writer.submit(fetched.body.path, fetched.body.size, finish,
+                                                   **self.metric_labels)
+        except BaseException:
+            fetched.body.path.unlink()
+            raise
+        write_future.add_done_callback(synced)
+        return future
 
-        bytes_file = io.BytesIO(r.content)
+    def report_skipped(self, link: str, reason: str):
+        """Records a url which is skipped without being downloaded"""
+        self._report(link, time.perf_counter(), "skipped", reason)
 
-        if not _check_magic_number(bytes_file.read(3)):
-            continue
+    def _report(self, link: str, start: float, result: str, reason: str) -> Optional[bool]:
+        """Records the result in the metrics and returns the result of the download future"""
+        host = urlsplit(link).netloc.lower()
 
-        img_t = link.rsplit(".", 1)[-1][:3]  # only get 3 chars
-        md5 = hashlib.md5(bytes_file.getvalue()).hexdigest()
+        reason_label = {"reason": reason} if reason else {}
+        self.metrics.inc("download_results_total", result=result, host=host, **reason_label,
+                         **self.metric_labels)
+        if result == "skipped":
+            return None
+        if result != "known":
+            self.metrics.observe("download_seconds", time.perf_counter() - start,
+                                 **self.metric_labels)
+        return result in ("saved", "known")
+
+    def _fetch(self, link: str) -> _Fetched:
+        """
+        Requests the url and returns the body of an image or the result and the reason of a
+        rejection. The response is streamed, so html pages, videos and too big files are aborted
+        after the headers or the first chunk
+        """
+        if link in self.index:
+            return _Fetched("known")
+
+        health = get_host_health(urlsplit(link).netloc)
+        if not health.allow():
+            return _Fetched("skipped", "host_down")
+
+        with self.host_limiter.get(link):
+            start = time.perf_counter()
+            failed = True
+            try:
+                with self.session.get(link, stream=True) as r:
+                    failed = r.status_code in HOST_FAILURE_STATUSES
+                    if not _check_headers(r, self.max_image_size):
+                        return _Fetched("rejected", "headers")
+
+                    chunks = r.iter_content(CHUNK_SIZE)
+                    head = _read_head(chunks, HEAD_SIZE)
+                    extension = _detect_format(head)
+                    if extension is None:
+                        self.metrics.inc("download_bytes_total", len(head), **self.metric_labels)
+                        return _Fetched("rejected", "magic_number")
+
+                    body = _write_body(chunks, head, self.download_path, self.max_image_size)
+            except requests.exceptions.RequestException:
+                # timeouts, connection errors after the retries, invalid urls etc.
+                failed = True
+                return _Fetched("error")
+            finally:
+                if failed:
+                    health.on_failure(time.perf_counter() - start)
+                else:
+                    health.on_success(time.perf_counter() - start)
+
+        self.metrics.inc("download_bytes_total", body.size, **self.metric_labels)
+        if body.path is None:
+            return _Fetched("rejected", "size")
+        return _Fetched("saved", body=body, extension=extension)
+
+    def _directory(self, location: str) -> Path:
+        """Returns the directory the image at location was moved into"""
+        if self.writer is not None:
+            return self.writer.directory(location)
+        return self.download_path
+
+    def _is_stored(self, file_name: str) -> bool:
+        """Returns True if the image file_name is in the dataset"""
+        if self.writer is not None:
+            return self.writer.is_stored(file_name)
+        return (self.download_path / file_name).exists()
+
+    def _store(self, link: str, tmp_path: Path, md5: str,
+               extension: str) -> Tuple[str, str, Optional[str]]:
+        """
+        Checks the image in the temp file and moves it into the dataset, runs on the disk writer.
+        Returns the result, the reason of a rejection and the location the url is indexed with
+        """
+        value = None
+        if self.processor is not None:
+            start = time.perf_counter()
+            processed = self.processor.process(tmp_path, phash=self.near_duplicates is not None)
+            self.metrics.observe("process_seconds", time.perf_counter() - start,
+                                 **self.metric_labels)
+            if processed.path is None:  # the processor deleted the file
+                return "rejected", processed.reason, None
+            tmp_path, extension, value = Path(processed.path), processed.extension, processed.phash
+        file_name = f"{md5}.{extension}"
+
+        if self.near_duplicates is not None:
+            if value is None:
+                try:
+                    value = dhash(tmp_path)
+                except Exception:  # pylint: disable=broad-except
+                    # pillow raises all kinds of errors, e.g. DecompressionBombError for huge images
+                    tmp_path.unlink()
+                    return "rejected", "undecodable", None
+            duplicate = self.near_duplicates.check_and_add(value, file_name, self._is_stored)
+            if duplicate is not None:
+                tmp_path.unlink()
+                # the url is indexed with the duplicate, so later runs skip it without a download
+                if self.writer is not None:
+                    duplicate = self.writer.location(duplicate)
+                return "rejected", "near_duplicate", duplicate
         # use hash as name so duplicates are overwritten
+        start = time.perf_counter()
+        if self.writer is None:
+            os.replace(tmp_path, self.download_path / file_name)
+        else:
+            file_name = self.writer.write(tmp_path, file_name, {"url": link, "md5": md5,
+                                                                **self.manifest_fields})
+        self.metrics.observe("disk_store_seconds", time.perf_counter() - start,
+                             **self.metric_labels)
+        return "saved", "", file_name
+
+
+class _Outcomes:
+    """
+    Collects the results of the downloads, which finish on the download threads or on the disk
+    writer threads, and calls on_done with them
+    """
+
+    def __init__(self, on_done: Optional[Callable[[str, bool], None]]):
+        self.on_done = on_done
+        self.saved = 0
+        self.errors: List[BaseException] = []
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def track(self, link: str, future: Future):
+        """Handles the result of the future when it is done"""
+        with self._condition:
+            self._pending += 1
+        future.add_done_callback(functools.partial(self._done, link))
+
+    def _done(self, link: str, future: Future):
+        try:
+            is_saved = future.result()
+            if is_saved is None:
+                return  # skipped, the url stays open in a checkpoint so the next run tries again
+            if self.on_done is not None:
+                self.on_done(link, is_saved)
+            with self._condition:
+                self.saved += is_saved
+        except Exception as error:  # pylint: disable=broad-except
+            self.errors.append(error)
+        finally:
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify_all()
+
+    def wait(self):
+        """Waits until every tracked download is done"""
+        with self._condition:
+            while self._pending:
+                self._condition.wait()
+
+
+def _worker(url_queue: queue.Queue, download: Callable[[str], Future], outcomes: _Outcomes):
+    """Consumes urls from the queue until the stop sentinel is received"""
+    while (link := url_queue.get()) is not _STOP:
+        try:
+            outcomes.track(link, download(link))
+        except Exception as error:  # pylint: disable=broad-except
+            # keep draining the queue so the producer never blocks, the error is raised later
+            outcomes.errors.append(error)
+
+
+def _release_target(target: DownloadTarget, future: Future):
+    saved = None if future.exception() else future.result()
+    if saved is None:  # skipped or crashed, the url did not tell anything
+        target.cancel()
+    else:
+        target.release(saved)
+
+
+def _take_urls(url_list: Iterable[str], target: Optional[DownloadTarget]) -> Iterator[str]:
+    """Yields the urls, with a target only while more downloads are needed to reach it"""
+    if target is None:
+        yield from url_list
+        return
+
+    urls = iter(url_list)
+    while target.acquire():
+        try:
+            link = next(urls)
+        except StopIteration:
+            target.cancel()
+            return
+        yield link
+
+
+def _hand_out(url_list: Iterable[str], url_queue: queue.Queue, slow_queue: queue.Queue,
+              downloader: _Downloader, target: Optional[DownloadTarget]):
+    """
+    Puts the urls into the queue of their lane. Urls of hosts which are slow on average go to the
+    slow lane, so they cannot hold up the downloads from fast hosts. When the slow lane is full
+    its urls are deferred until all other urls are handed out, up to the size of the slow queue,
+    further ones are skipped
+    """
+    metrics, metric_labels = downloader.metrics, downloader.metric_labels
+    deferred: List[str] = []
+    for link in _take_urls(url_list, target):
+        if not get_host_health(urlsplit(link).netloc).slow:
+            url_queue.put(link)
+            continue
+        metrics.inc("download_slow_lane_total", **metric_labels)
+        try:
+            slow_queue.put_nowait(link)
+        except queue.Full:
+            # waiting for the slow lane would stop the fast lane as well
+            if len(deferred) < slow_queue.maxsize:
+                metrics.inc("download_deferred_total", **metric_labels)
+                deferred.append(link)
+            else:  # skipped, the url stays open in a checkpoint so the next run tries again
+                downloader.report_skipped(link, "slow_lane_full")
+            if target is not None:
+                target.cancel()  # a deferred url is taken again after the others
+    for link in _take_urls(deferred, target):
+        slow_queue.put(link)
+
+
+def download_urls(download_path: Path, url_list: Iterable[str],
+                  n_workers: int = DEFAULT_N_WORKERS, max_per_host: int = DEFAULT_MAX_PER_HOST,
+                  queue_size: int = DEFAULT_QUEUE_SIZE,
+                  index: Optional[DownloadIndex] = None,
+                  max_image_size: int = DEFAULT_MAX_IMAGE_SIZE,
+                  on_done: Optional[Callable[[str, bool], None]] = None,
+                  session: Optional[requests.Session] = None,
+                  metrics: Optional[Metrics] = None,
+                  metric_labels: Optional[Dict[str, str]] = None,
+                  near_duplicates: Optional[NearDuplicateIndex] = None,
+                  processor: Optional[ImageProcessor] = None,
+                  writer: Optional[DatasetWriter] = None,
+                  manifest_fields: Optional[Dict[str, str]] = None,
+                  target: Optional[DownloadTarget] = None,
+                  slow_workers: Optional[int] = None,
+                  disk_writer: Optional[WriteBehindWriter] = None) -> int:
+    """
+    Downloads the urls with n_workers threads and returns the number of saved images. url_list may
+    be a generator, e.g. a search engine in stream mode, at most queue_size urls are buffered.
+    The checks and storage options are described in _Downloader, the slow lane in _hand_out and
+    the per host limit in _get_host_limiter. With a target urls are only taken until target.n_images
+    images are probably saved. on_done gets every url which was not skipped and whether it was
+    saved. A given disk_writer is synced but not closed
+    """
+    download_path = _check_path(download_path)
+    index = index or DownloadIndex.for_path(download_path)
+    # an image host can send any Retry-After, which would hold the worker and the host slot
+    session = session or get_session(IMAGE_SESSION, retries=1, respect_retry_after=False)
+    metrics = metrics or get_metrics()
+    metric_labels = metric_labels or {}
+    own_disk_writer = disk_writer is None
+    if own_disk_writer:
+        disk_writer = WriteBehindWriter(metrics=metrics)
+    downloader = _Downloader(session, _get_host_limiter(max_per_host), index, download_path,
+                             max_image_size, metrics, metric_labels, disk_writer, near_duplicates,
+                             processor, writer, manifest_fields)
+    download = downloader.download
+    if target is not None:
+        def download_for_target(link: str) -> Future:
+            try:
+                future = downloader.download(link)
+            except BaseException:
+                target.cancel()
+                raise
+            future.add_done_callback(functools.partial(_release_target, target))
+            return future
+
+        download = download_for_target
+
+    url_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    slow_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    outcomes = _Outcomes(on_done)
+    lanes = [(url_queue, n_workers), (slow_queue, slow_workers or max(n_workers // 4, 1))]
+    workers = [(lane_queue, threading.Thread(target=_worker, daemon=True,
+                                             args=(lane_queue, download, outcomes)))
+               for lane_queue, n_lane_workers in lanes for _ in range(n_lane_workers)]
+    for _, worker in workers:
+        worker.start()
+
+    try:
+        _hand_out(url_list, url_queue, slow_queue, downloader, target)
+    finally:
+        for lane_queue, _ in workers:
+            lane_queue.put(_STOP)
+        for _, worker in workers:
+            worker.join()
+        outcomes.wait()
+        if own_disk_writer:
+            disk_writer.close()
+        else:
+            disk_writer.sync()
 
-        with open(download_path / f"{md5}.{img_t}", "wb") as img_file:
-            img_file.write(bytes_file.getvalue())
+    if outcomes.errors:
+        raise outcomes.errors[0]
+    return outcomes.saved
@@ -0,0 +1,84 @@
+"""Health of the image hosts: circuit breakers for dead hosts and latency tracking for slow ones"""
+import threading
+import time
+from typing import Dict
+
+FAILURE_THRESHOLD = 3  # failures in a row which open the circuit
+OPEN_SECONDS = 30.0  # requests to a host with an open circuit are skipped this long
+MAX_OPEN_SECONDS = 300.0
+SLOW_LATENCY = 5.0  # seconds, hosts whose average download takes longer are slow
+LATENCY_SMOOTHING = 0.3  # weight of the latest download in the average latency
+
+
+class HostHealth:
+    """
+    Circuit breaker and average latency of a single host.
+    After FAILURE_THRESHOLD failed downloads in a row the circuit opens and allow returns False
+    for open_seconds. Then a single trial download is allowed (half open), its success closes the
+    circuit and its failure opens it again for twice as long
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD,
+                 open_seconds: float = OPEN_SECONDS, slow_latency: float = SLOW_LATENCY):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.slow_latency = slow_latency
+        self.latency = 0.0
+        self.failures = 0
+
+        self._cooldown = open_seconds
+        self._open_until = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def slow(self) -> bool:
+        """True if the downloads from the host take longer than slow_latency on average"""
+        return self.latency > self.slow_latency
+
+    @property
+    def is_open(self) -> bool:
+        """True if the host failed too often and its cooldown is not over"""
+        return self.failures >= self.failure_threshold and time.monotonic() < self._open_until
+
+    def allow(self) -> bool:
+        """Returns False if a download from the host should be skipped"""
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return True
+            if time.monotonic() < self._open_until or self._trial_running:
+                return False
+            self._trial_running = True  # half open, only this download tests the host
+            return True
+
+    def on_success(self, latency: float):
+        """Records a download which got a response"""
+        with self._lock:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+            self.failures = 0
+            self._cooldown = self.open_seconds
+            self._trial_running = False
+
+    def on_failure(self, latency: float):
+        """Records a download which failed with a timeout, connection error or server error"""
+        with self._lock:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+            self.failures += 1
+            if self._trial_running:
+                self._cooldown = min(self._cooldown * 2, MAX_OPEN_SECONDS)
+            if self.failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self._cooldown
+            self._trial_running = False
+
+
+_hosts: Dict[str, HostHealth] = {}
+_hosts_lock = threading.Lock()
+
+
+def get_host_health(host: str) -> HostHealth:
+    """Returns the health of the host which is shared by all jobs"""
+    host = host.lower()
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = HostHealth()
+        return _hosts[host]
@@ -0,0 +1,75 @@
+"""Shared http sessions with connection pooling, timeouts and retries"""
+import threading
+from typing import Dict, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SEARCH_SESSION = "search"
+IMAGE_SESSION = "images"
+
+DEFAULT_TIMEOUT = (5.0, 20.0)  # connect and read timeout in seconds
+DEFAULT_POOL_SIZE = 32  # connections kept alive per host
+DEFAULT_MAX_HOSTS = 128  # hosts whose connection pools are kept
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class TimeoutSession(requests.Session):
+    """Session which applies a default timeout to every request without one"""
+
+    def __init__(self, timeout: Timeout = DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, *args, **kwargs)
+
+
+def build_session(timeout: Timeout = DEFAULT_TIMEOUT, pool_size: int = DEFAULT_POOL_SIZE,
+                  retries: int = DEFAULT_RETRIES,
+                  backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+                  respect_retry_after: bool = True) -> TimeoutSession:
+    """
+    Creates a keep-alive session with a connection pool of pool_size per host. Requests failing
+    with a connection error or one of RETRY_STATUSES are retried with exponential backoff, or
+    after the Retry-After of the response if respect_retry_after is set
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+                  respect_retry_after_header=respect_retry_after, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=DEFAULT_MAX_HOSTS, pool_maxsize=pool_size,
+                          max_retries=retry)
+
+    session = TimeoutSession(timeout)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_sessions: Dict[str, TimeoutSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name: str = SEARCH_SESSION, **kwargs) -> TimeoutSession:
+    """
+    Returns the shared session with the given name. It is created with build_session(**kwargs) on
+    the first call, later kwargs are ignored
+    """
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = build_session(**kwargs)
+        return _sessions[name]
+
+
+def close_sessions():
+    """Closes all shared sessions and their connections"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,115 @@
+"""Decoding, validation and normalization of downloaded images in worker processes"""
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from utils.perceptual_hash import Image, dhash
+
+# pillow format names and the extension the images are saved with
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+EXTENSION_FORMATS = {extension: name for name, extension in FORMAT_EXTENSIONS.items()}
+DEFAULT_QUALITY = 90
+
+
+class ProcessOptions(NamedTuple):
+    """What the processing stage does with every image besides decoding it"""
+    target_format: Optional[str] = None  # extension like "jpg", None keeps the original format
+    max_side: Optional[int] = None  # bigger images are downscaled to fit max_side x max_side
+    quality: int = DEFAULT_QUALITY  # of jpeg and webp images which are written again
+
+
+class ProcessResult(NamedTuple):
+    """Outcome of process_image. path is None if the image was rejected for reason"""
+    path: Optional[str]
+    extension: str = ""
+    reason: str = ""
+    phash: Optional[int] = None
+
+
+def _save(image, path: str, extension: str, options: ProcessOptions) -> str:
+    """Writes the image as extension to a new temp file next to path and returns its path"""
+    if extension == "jpg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")  # jpeg has no alpha channel or palette
+    handle, out_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".part")
+    try:
+        with os.fdopen(handle, "wb") as out_file:
+            image.save(out_file, EXTENSION_FORMATS[extension], quality=options.quality)
+    except BaseException:
+        os.unlink(out_path)
+        raise
+    return out_path
+
+
+def process_image(path: str, options: ProcessOptions, phash: bool = False) -> ProcessResult:
+    """
+    Runs in a worker process. Decodes the whole image, so truncated and corrupt files are
+    rejected, and detects its real format. Images are resized and converted as given by options,
+    animated images keep only their first frame then. The rejected or replaced file at path is
+    deleted. With phash the perceptual hash of the result is computed as well
+    """
+    try:
+        with Image.open(path) as image:
+            image.verify()  # checks the structure and e.g. png checksums
+        with Image.open(path) as image:
+            image.load()  # decodes all pixels, truncated files fail here
+            extension = FORMAT_EXTENSIONS.get(image.format)
+            if extension is None:
+                os.unlink(path)
+                return ProcessResult(None, reason="format")
+
+            target = options.target_format or extension
+            if options.max_side and max(image.size) > options.max_side:
+                image.thumbnail((options.max_side, options.max_side))
+            elif target == extension:
+                return ProcessResult(path, extension, phash=dhash(Path(path)) if phash else None)
+            out_path = _save(image, path, target, options)
+    except Exception:  # pylint: disable=broad-except
+        # pillow raises all kinds of errors for broken files, e.g. OSError, SyntaxError, IndexError
+        os.unlink(path)
+        return ProcessResult(None, reason="undecodable")
+
+    os.unlink(path)
+    return ProcessResult(out_path, target, phash=dhash(Path(out_path)) if phash else None)
+
+
+class ImageProcessor:
+    """
+    Process pool for process_image. The download threads hand their files to it and wait for the
+    result, so decoding runs on all cores while the other threads keep downloading.
+    The pool is started on the first image and can be used again after close
+    """
+
+    def __init__(self, n_processes: Optional[int] = None,
+                 options: ProcessOptions = ProcessOptions()):
+        if Image is None:
+            raise RuntimeError("image processing needs pillow, install it with pip")
+        if options.target_format is not None and options.target_format not in EXTENSION_FORMATS:
+            raise ValueError(f"{options.target_format} is not one of "
+                             f"{', '.join(EXTENSION_FORMATS)}")
+        self.n_processes = n_processes or os.cpu_count()
+        self.options = options
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # forking a process with running download threads can deadlock the children
+                self._executor = ProcessPoolExecutor(
+                    self.n_processes, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def process(self, path: Path, phash: bool = False) -> ProcessResult:
+        """Processes the image in a worker process and blocks until it is done"""
+        return self._get_executor().submit(process_image, str(path), self.options, phash).result()
+
+    def close(self):
+        """Waits for the running images and stops the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
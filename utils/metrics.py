@@ -0,0 +1,213 @@
+"""Counters, gauges and latency histograms of a scrape run with json and prometheus export"""
+import bisect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value for the prometheus text format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative latency histogram like the prometheus one"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Adds a single value"""
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """Returns the number of values <= every bucket"""
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+    def to_json(self) -> dict:
+        """Returns the histogram as dict"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip((str(bucket) for bucket in self.buckets),
+                                self.cumulative_counts())),
+        }
+
+
+class Metrics:
+    """
+    Thread safe registry of labeled counters, gauges and histograms.
+    The search engines, the downloader and the http layer record into the shared registry
+    returned by get_metrics
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increases the counter name with the labels by value"""
+        key = _labels(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Sets the gauge name with the labels to the current value"""
+        key = _labels(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def gauge(self, name: str, **labels) -> Optional[float]:
+        """Returns the value of the gauge or None if it was never set"""
+        with self._lock:
+            return self._gauges.get(name, {}).get(_labels(labels))
+
+    def observe(self, name: str, value: float, **labels):
+        """Adds value to the histogram name with the labels"""
+        key = _labels(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels) -> Iterator[None]:
+        """Observes the duration of the with block in the histogram name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name: str, **labels) -> float:
+        """Returns the sum of the counter over all label sets which contain the given labels"""
+        wanted = set(_labels(labels))
+        with self._lock:
+            return sum(value for key, value in self._counters.get(name, {}).items()
+                       if wanted <= set(key))
+
+    def to_json(self) -> dict:
+        """Returns all metrics as dict"""
+        with self._lock:
+            return {
+                "start_time": self.start_time,
+                "duration": time.time() - self.start_time,
+                "counters": {name: [{"labels": dict(key), "value": value}
+                                    for key, value in values.items()]
+                             for name, values in self._counters.items()},
+                "gauges": {name: [{"labels": dict(key), "value": value}
+                                  for key, value in values.items()]
+                           for name, values in self._gauges.items()},
+                "histograms": {name: [{"labels": dict(key), **histogram.to_json()}
+                                      for key, histogram in values.items()]
+                               for name, values in self._histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """Returns all metrics in the prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                lines.append(f"# TYPE ws_{name} counter")
+                for key, value in values.items():
+                    lines.append(f"ws_{name}{_format_labels(key)} {value}")
+            for name, values in sorted(self._gauges.items()):
+                lines.append(f"# TYPE ws_{name} gauge")
+                for key, value in values.items():
+                    lines.append(f"ws_{name}{_format_labels(key)} {value}")
+            for name, values in sorted(self._histograms.items()):
+                lines.append(f"# TYPE ws_{name} histogram")
+                for key, histogram in values.items():
+                    for bucket, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                        bucket_labels = _format_labels(key, f'le="{bucket}"')
+                        lines.append(f"ws_{name}_bucket{bucket_labels} {count}")
+                    inf_labels = _format_labels(key, 'le="+Inf"')
+                    lines.append(f"ws_{name}_bucket{inf_labels} {histogram.count}")
+                    lines.append(f"ws_{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"ws_{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Returns a one line overview with the throughput of the run"""
+        duration = max(time.time() - self.start_time, 1e-9)
+        saved = self.total("download_results_total", result="saved")
+        downloaded = self.total("download_bytes_total")
+        return (f"{self.total('search_urls_total'):.0f} urls found, "
+                f"{saved:.0f} images saved ({saved / duration:.1f} images/s), "
+                f"{self.total('download_results_total', result='rejected'):.0f} rejected, "
+                f"{self.total('download_results_total', result='error'):.0f} errors, "
+                f"{downloaded / duration / 1024 / 1024:.2f} MiB/s" + self._disk_summary())
+
+    def _disk_summary(self) -> str:
+        """Returns the state of the disk writer queue if there is one"""
+        depth = self.gauge("disk_queue_depth")
+        if depth is None:
+            return ""
+        blocked = self.total("disk_backpressure_seconds_total")
+        return (f", disk queue {depth:.0f} images "
+                f"({(self.gauge('disk_queue_bytes') or 0) / 1024 / 1024:.1f} MiB), "
+                f"downloads blocked {blocked:.1f}s")
+
+    def export(self, path: str, fmt: str = "json"):
+        """Writes the metrics to path as json or prometheus text"""
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            if fmt == "prometheus":
+                metrics_file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), metrics_file, indent=2)
+
+    def stream_live(self, interval: float = 5.0,
+                    stream: Optional[TextIO] = None) -> threading.Event:
+        """
+        Prints the summary every interval seconds from a daemon thread.
+        Set the returned event to stop printing
+        """
+        stop = threading.Event()
+
+        def printer():
+            while not stop.wait(interval):
+                print(self.summary(), file=stream or sys.stderr, flush=True)
+
+        threading.Thread(target=printer, daemon=True).start()
+        return stop
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Returns the registry shared by the whole process"""
+    return _metrics
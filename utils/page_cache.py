@@ -0,0 +1,122 @@
+"""On disk cache for the result pages of the search engines"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+DEFAULT_TTL = 6 * 60 * 60  # seconds, DuckGo vqd tokens are not valid much longer
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+
+def default_cache_dir() -> Path:
+    """Returns the cache dir below $XDG_CACHE_HOME or ~/.cache"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "ws" / "search_pages"
+
+
+class PageCache:
+    """
+    Caches the text of search engine responses on disk.
+    Entries older than ttl seconds are ignored. When the cache grows over max_size bytes the least
+    recently used entries are removed. The mtime of an entry is its last use
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None, ttl: float = DEFAULT_TTL,
+                 max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sizes: Dict[Path, int] = {path: path.stat().st_size
+                                        for path in self.cache_dir.glob("*.json")}
+
+    @staticmethod
+    def key(method: str, url: str, **kwargs) -> str:
+        """Returns the cache key of a request. Headers are not part of the key"""
+        request = json.dumps([method.upper(), url, kwargs.get("params"), kwargs.get("data")],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached text or None if there is no fresh entry"""
+        path = self.cache_dir / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("created", 0) > self.ttl:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def put(self, key: str, text: str):
+        """Stores text under key and evicts the least recently used entries if necessary"""
+        path = self.cache_dir / f"{key}.json"
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_dir, suffix=".tmp",
+                                         delete=False) as tmp_file:
+            json.dump({"created": time.time(), "text": text}, tmp_file)
+        os.replace(tmp_file.name, path)
+
+        with self._lock:
+            self._sizes[path] = path.stat().st_size
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_size:
+            return
+
+        def last_used(path: Path) -> float:
+            try:
+                return path.stat().st_mtime
+            except OSError:
+                return 0
+
+        for path in sorted(self._sizes, key=last_used):
+            if total <= self.max_size:
+                break
+            total -= self._sizes.pop(path)
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def lookup(self, method: str, url: str, **kwargs) -> Tuple[str, Optional[str]]:
+        """Returns the key of the request and its cached text or None. Counts hits and misses"""
+        key = self.key(method, url, **kwargs)
+        text = self.get(key)
+        with self._lock:
+            if text is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return key, text
+
+    def fetch(self, request: Callable, method: str, url: str,
+              is_valid: Optional[Callable[[str], bool]] = None, **kwargs) -> str:
+        """
+        Returns the text of the response from the cache or performs the request with
+        request(method, url, **kwargs). Only successful responses are cached and if is_valid is
+        given only those whose text it accepts, e.g. pages which are not empty
+        """
+        key, text = self.lookup(method, url, **kwargs)
+        if text is not None:
+            return text
+
+        response = request(method, url, **kwargs)
+        if response.ok and (is_valid is None or is_valid(response.text)):
+            self.put(key, response.text)
+        return response.text
@@ -0,0 +1,158 @@
+"""Near duplicate detection with perceptual hashes"""
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # pillow is optional, it is only needed for near duplicate detection
+    Image = None
+
+HASH_SIZE = 8  # the hashes have HASH_SIZE * HASH_SIZE bits
+HASH_BITS = HASH_SIZE * HASH_SIZE
+DEFAULT_MAX_DISTANCE = 6
+
+
+def dhash(path: Path, hash_size: int = HASH_SIZE) -> int:
+    """
+    Returns the difference hash of the image. Every bit tells if a pixel of the downscaled grayscale
+    image is brighter than its right neighbour, so re-encoded and resized copies get (almost) the
+    same hash
+    """
+    if Image is None:
+        raise RuntimeError("near duplicate detection needs pillow, install it with pip")
+
+    with Image.open(path) as image:
+        # lets jpeg decode at a fraction of the size, which is much faster for big images
+        image.draft("L", (hash_size * 4, hash_size * 4))
+        pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).tobytes()
+
+    value = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            value = value << 1 | (left > right)
+    return value
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Returns the number of bits in which the hashes differ"""
+    return bin(first ^ second).count("1")
+
+
+class MultiIndexHashIndex:
+    """
+    Index of hashes for hamming distance queries (multi index hashing).
+    The hashes are split into max_distance + 1 chunks and every chunk is indexed in its own table.
+    Two hashes within max_distance have at least one identical chunk, so a query only compares the
+    few hashes sharing a chunk instead of every hash in the index
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE, bits: int = HASH_BITS):
+        self.max_distance = max_distance
+        n_chunks = max_distance + 1
+        chunk_bits = [bits // n_chunks + (i < bits % n_chunks) for i in range(n_chunks)]
+        self._chunks: List[Tuple[int, int]] = []  # shift and mask of every chunk
+        shift = 0
+        for n_bits in chunk_bits:
+            self._chunks.append((shift, (1 << n_bits) - 1))
+            shift += n_bits
+        self._tables: List[Dict[int, List[Tuple[int, str]]]] = [{} for _ in self._chunks]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value: int, name: str):
+        """Adds a hash with the name of its image"""
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault(value >> shift & mask, []).append((value, name))
+        self._size += 1
+
+    def find(self, value: int, accept: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        Returns the name of an image within max_distance of the hash or None.
+        Images whose name is rejected by accept are skipped
+        """
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for candidate, name in table.get(value >> shift & mask, ()):
+                if hamming_distance(value, candidate) <= self.max_distance \
+                        and (accept is None or accept(name)):
+                    return name
+        return None
+
+
+class NearDuplicateIndex:
+    """
+    Rejects images which are near duplicates of an image already in the dataset.
+    The hashes are persisted in an append only file in the dataset dir, so the index survives runs
+    without hashing the whole dataset again
+    """
+    FILE_NAME = ".phash_index.txt"
+
+    _instances: Dict[Path, "NearDuplicateIndex"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, dataset_path: Path, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.dataset_path = dataset_path.resolve()
+        self.file_path = self.dataset_path / self.FILE_NAME
+        self.max_distance = max_distance
+        self._index = MultiIndexHashIndex(max_distance)
+        self._lock = threading.Lock()
+
+        if self.file_path.exists():
+            with open(self.file_path, "r", encoding="utf-8") as index_file:
+                for line in index_file:
+                    try:
+                        value, name = line.rstrip("\n").split(" ", 1)
+                        self._index.add(int(value, 16), name)
+                    except ValueError:
+                        continue  # a run that was killed mid write can leave a partial last line
+
+        self._file = open(  # pylint: disable=consider-using-with
+            self.file_path, "a", encoding="utf-8", buffering=1)
+
+    @classmethod
+    def for_path(cls, dataset_path: Path,
+                 max_distance: int = DEFAULT_MAX_DISTANCE) -> "NearDuplicateIndex":
+        """
+        Returns the index of the dataset. Jobs writing to the same dataset share one index, so
+        they have to use the same max_distance
+        """
+        dataset_path = dataset_path.resolve()
+        with cls._instances_lock:
+            if dataset_path not in cls._instances:
+                cls._instances[dataset_path] = cls(dataset_path, max_distance)
+            index = cls._instances[dataset_path]
+        if index.max_distance != max_distance:
+            raise ValueError(f"the near duplicates of {dataset_path} are already checked with "
+                             f"max_distance {index.max_distance}")
+        return index
+
+    def __len__(self):
+        return len(self._index)
+
+    def check_and_add(self, value: int, name: str,
+                      is_stored: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        Returns the name of the near duplicate of the hash if there is one.
+        Otherwise the hash is added under name and None is returned.
+        Images for which is_stored returns False, e.g. the ones of an unfinished shard deleted
+        after a crash, are no duplicates anymore
+        """
+        with self._lock:
+            duplicate = self._index.find(value, is_stored)
+            if duplicate is not None:
+                return duplicate
+            self._index.add(value, name)
+            self._file.write(f"{value:016x} {name}\n")
+            return None
+
+    def close(self):
+        """Closes the index file. for_path will open the index again"""
+        with self._instances_lock:
+            if self._instances.get(self.dataset_path) is self:
+                self._instances.pop(self.dataset_path)
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,95 @@
+"""Adaptive rate limiting of the requests to the search engines"""
+import asyncio
+import threading
+import time
+from typing import Dict
+
+DEFAULT_RATE = 2.0  # requests per second
+DEFAULT_BURST = 4
+DEFAULT_MIN_RATE = 0.1
+DEFAULT_MAX_RATE = 10.0
+DEFAULT_SLOW_LATENCY = 3.0  # seconds
+
+THROTTLE_STATUSES = (403, 429, 503)
+INCREASE_STEP = 0.1  # requests per second added after every fast successful response
+THROTTLE_FACTOR = 0.5
+EMPTY_PAGE_FACTOR = 0.75
+SLOW_FACTOR = 0.9
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket for a single host whose rate adapts to the responses (AIMD).
+    Fast successful responses increase the rate additively. Throttling statuses, empty result pages
+    and slow responses decrease it multiplicatively, so the rate settles just below the limit of
+    the host. A throttling status also empties the bucket, which pauses the next requests
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 min_rate: float = DEFAULT_MIN_RATE, max_rate: float = DEFAULT_MAX_RATE,
+                 slow_latency: float = DEFAULT_SLOW_LATENCY):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.slow_latency = slow_latency
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _try_acquire(self) -> float:
+        """Takes a token and returns 0 or returns how long to wait for the next token"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a request may be sent"""
+        while wait := self._try_acquire():
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Waits without blocking the event loop until a request may be sent"""
+        while wait := self._try_acquire():
+            await asyncio.sleep(wait)
+
+    def _decrease(self, factor: float):
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def on_response(self, status_code: int, latency: float):
+        """Adapts the rate to the status and latency of a response"""
+        with self._lock:
+            if status_code in THROTTLE_STATUSES:
+                self._decrease(THROTTLE_FACTOR)
+                self._tokens = min(self._tokens, 0)
+            elif latency > self.slow_latency:
+                self._decrease(SLOW_FACTOR)
+            elif status_code < 400:
+                self.rate = min(self.max_rate, self.rate + INCREASE_STEP)
+
+    def on_empty_page(self):
+        """Search engines often answer with empty pages instead of an error when they throttle"""
+        with self._lock:
+            self._decrease(EMPTY_PAGE_FACTOR)
+
+
+_rate_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host: str) -> AdaptiveRateLimiter:
+    """Returns the rate limiter of the host which is shared by all jobs"""
+    host = host.lower()
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = AdaptiveRateLimiter()
+        return _rate_limiters[host]
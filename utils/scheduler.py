@@ -0,0 +1,194 @@
+"""Runs (search engine, keyword) scrape jobs in parallel"""
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from search_engines.registry import SearchEngineFactory
+from utils.checkpoint import JobCheckpoint
+from utils.dataset_writer import DatasetWriter
+from utils.disk_writer import DEFAULT_N_THREADS, WriteBehindWriter
+from utils.download_index import DownloadIndex
+from utils.download_urls import download_urls, DEFAULT_N_WORKERS
+from utils.image_processing import ImageProcessor, ProcessOptions
+from utils.page_cache import PageCache
+from utils.perceptual_hash import NearDuplicateIndex
+from utils.target_count import MAX_OVERFETCH, DownloadTarget, SuccessRates, extend_search
+from utils.url_dedup import UrlDeduplicator
+
+DEFAULT_MAX_JOBS = 8
+DEFAULT_MAX_JOBS_PER_ENGINE = 2
+
+
+class ScrapeJob(NamedTuple):
+    """
+    A single keyword which should be scraped with a single search engine.
+    A job can cover only a part of the results, n_images urls (or images in target mode) starting
+    at result offset. Without n_images the n_samples of the scheduler are used
+    """
+    search_engine: str
+    keyword: str
+    offset: int = 0
+    n_images: Optional[int] = None
+
+
+class JobResult(NamedTuple):
+    """Outcome of a finished ScrapeJob"""
+    job: ScrapeJob
+    n_images: int
+    duration: float
+    error: Optional[str] = None
+
+
+def expand_jobs(search_engines: Iterable[str], keywords: Iterable[str]) -> List[ScrapeJob]:
+    """
+    Creates a job for every search engine and keyword. The jobs are interleaved round robin
+    over the search engines so that the first jobs to run hit different hosts
+    """
+    keywords = list(keywords)
+    per_engine = [[ScrapeJob(search_engine, keyword) for keyword in keywords]
+                  for search_engine in search_engines]
+    return [job for jobs in itertools.zip_longest(*per_engine) for job in jobs if job is not None]
+
+
+class ScrapeScheduler:
+    """
+    Runs scrape jobs concurrently. At most max_jobs run at the same time and at most
+    max_jobs_per_engine of them use the same search engine. engine_limits can override the per
+    engine cap for single search engines. All jobs share one UrlDeduplicator, so an url found by
+    several engines or keywords is only downloaded once per scheduler.
+    The progress of every job is checkpointed in the dataset dir, so running the same jobs again
+    after an interruption continues where they stopped. If a page_cache is given the search
+    engines take result pages from it. With near_duplicate_distance images whose perceptual hash
+    differs from an image in the dataset by at most that many bits are rejected (needs pillow).
+    With process_options all jobs share a pool of n_processes processes which decodes, validates
+    and normalizes the downloaded images (needs pillow).
+    All jobs hand their images to one WriteBehindWriter, which stores them off the download
+    threads. It gets a thread per image processing process, so the processing pool stays busy.
+    With a writer the images are stored in its layout and every image gets a manifest record with
+    its keyword and search engine.
+    By default n_samples urls are collected per job. With target_mode every job continues until
+    n_samples images are saved (or MAX_OVERFETCH times as many urls are used up), requesting only
+    as many urls as the observed success rate of its search engine suggests
+    """
+
+    def __init__(self, dataset_path: Path, n_samples: int, max_jobs: int = DEFAULT_MAX_JOBS,
+                 max_jobs_per_engine: int = DEFAULT_MAX_JOBS_PER_ENGINE,
+                 engine_limits: Optional[Dict[str, int]] = None,
+                 n_workers: int = DEFAULT_N_WORKERS, page_cache: Optional[PageCache] = None,
+                 near_duplicate_distance: Optional[int] = None,
+                 process_options: Optional[ProcessOptions] = None,
+                 n_processes: Optional[int] = None, writer: Optional[DatasetWriter] = None,
+                 target_mode: bool = False):
+        self.dataset_path = dataset_path
+        self.n_samples = n_samples
+        self.max_jobs = max_jobs
+        self.max_jobs_per_engine = max_jobs_per_engine
+        self.engine_limits = engine_limits or {}
+        self.n_workers = n_workers
+        self.page_cache = page_cache
+        self.near_duplicates = None
+        if near_duplicate_distance is not None:
+            self.near_duplicates = NearDuplicateIndex.for_path(dataset_path,
+                                                               near_duplicate_distance)
+        self.processor = None
+        if process_options is not None:
+            self.processor = ImageProcessor(n_processes, process_options)
+        self.disk_writer = WriteBehindWriter(max(DEFAULT_N_THREADS, self.processor.n_processes)
+                                             if self.processor else DEFAULT_N_THREADS)
+        self.writer = writer
+        self.target_mode = target_mode
+        self.success_rates = SuccessRates()
+        self.url_deduplicator = UrlDeduplicator()
+
+        self._lock = threading.Lock()
+        self._engine_semaphores: Dict[str, threading.Semaphore] = {}
+
+    def _get_engine_semaphore(self, search_engine: str) -> threading.Semaphore:
+        with self._lock:
+            if search_engine not in self._engine_semaphores:
+                limit = self.engine_limits.get(search_engine, self.max_jobs_per_engine)
+                self._engine_semaphores[search_engine] = threading.Semaphore(limit)
+            return self._engine_semaphores[search_engine]
+
+    def run_job(self, job: ScrapeJob,
+                url_deduplicator: Optional[UrlDeduplicator] = None) -> JobResult:
+        """
+        Runs a single job, by default deduplicated with the url_deduplicator of the scheduler.
+        Jobs with an offset need a search engine with an OFFSET_CURSOR
+        """
+        url_deduplicator = url_deduplicator or self.url_deduplicator
+        n_samples = job.n_images or self.n_samples
+        part = f"{job.offset}+{n_samples}" if job.n_images or job.offset else ""
+        with self._get_engine_semaphore(job.search_engine):
+            start = time.perf_counter()
+            checkpoint = JobCheckpoint.for_job(self.dataset_path, job.search_engine, job.keyword,
+                                               part)
+            try:
+                # urls saved by a killed run whose image never reached the dataset, e.g. because
+                # it was in an unfinished shard, are downloaded again
+                checkpoint.reopen_missing(DownloadIndex.for_path(self.dataset_path).__contains__)
+                target, n_urls = None, n_samples
+                if self.target_mode:
+                    # images saved by an earlier run of the job count towards the target
+                    target = DownloadTarget(max(n_samples - checkpoint.n_saved, 0),
+                                            self.success_rates.get(job.search_engine))
+                    n_urls = n_samples * MAX_OVERFETCH
+                cursor = checkpoint.cursor
+                if job.offset and not cursor:
+                    se_class = SearchEngineFactory.get_se_class(job.search_engine)
+                    cursor = {se_class.OFFSET_CURSOR: job.offset}
+                search_engine = SearchEngineFactory.get_se(
+                    job.search_engine, keyword=job.keyword,
+                    n_images=target.urls_needed() if target else n_samples, stream=True,
+                    cursor=cursor, page_cache=self.page_cache)
+                urls = url_deduplicator.filter(checkpoint.iter_img_urls(search_engine, n_urls))
+                if target is not None:
+                    urls = extend_search(urls, search_engine, target)
+                n_images = download_urls(self.dataset_path, urls, n_workers=self.n_workers,
+                                         on_done=checkpoint.mark_done,
+                                         metric_labels={"engine": job.search_engine},
+                                         near_duplicates=self.near_duplicates,
+                                         processor=self.processor, writer=self.writer,
+                                         manifest_fields={"keyword": job.keyword,
+                                                          "engine": job.search_engine},
+                                         target=target, disk_writer=self.disk_writer)
+            except Exception as error:  # pylint: disable=broad-except
+                # a failing job must not take the other jobs down with it
+                return JobResult(job, 0, time.perf_counter() - start, repr(error))
+            finally:
+                checkpoint.close()
+            return JobResult(job, n_images, time.perf_counter() - start)
+
+    def run(self, jobs: Iterable[ScrapeJob]) -> List[JobResult]:
+        """Runs all jobs and returns their results in the order of the jobs"""
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+                return list(executor.map(self.run_job, jobs))
+        finally:
+            self.close()
+
+    def close(self):
+        """Writes the queued images, stops the image processing and finalizes the dataset writer"""
+        self.disk_writer.close()
+        if self.processor is not None:
+            self.processor.close()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def format_summary(results: List[JobResult], total_duration: Optional[float] = None) -> str:
+    """Returns a table with time and image count of every job"""
+    lines = [f"{'search engine':<15} {'keyword':<25} {'images':>7} {'time (s)':>9}  error"]
+    for result in results:
+        line = (f"{result.job.search_engine:<15} {result.job.keyword:<25} "
+                f"{result.n_images:>7} {result.duration:>9.1f}  {result.error or ''}")
+        lines.append(line.rstrip())
+
+    total = f"{len(results)} jobs, {sum(result.n_images for result in results)} images"
+    if total_duration is not None:
+        total += f" in {total_duration:.1f}s"
+    lines.append(total)
+    return "\n".join(lines)
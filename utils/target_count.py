@@ -0,0 +1,133 @@
+"""Scraping until a number of images is saved instead of a number of urls is collected"""
+import math
+import threading
+from typing import Dict, Iterable, Iterator
+
+from search_engines.search_engine_interface import SearchEngineInterface
+
+DEFAULT_PRIOR_RATE = 0.7  # share of saved urls assumed before an engine has any downloads
+PRIOR_WEIGHT = 20  # downloads the prior is worth, later observations outweigh it quickly
+MIN_SUCCESS_RATE = 0.05
+DEFAULT_MARGIN = 0.1  # extra urls requested on top of the estimate
+MAX_OVERFETCH = 10  # a job never takes more than this many urls per wanted image
+
+
+class SuccessRate:
+    """Share of the urls of a search engine which end up saved, estimated from its downloads"""
+
+    def __init__(self, prior: float = DEFAULT_PRIOR_RATE, prior_weight: int = PRIOR_WEIGHT):
+        self.prior = prior
+        self.prior_weight = prior_weight
+        self.n_urls = 0
+        self.n_saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, saved: bool):
+        """Records the outcome of a download"""
+        with self._lock:
+            self.n_urls += 1
+            self.n_saved += saved
+
+    @property
+    def value(self) -> float:
+        """The observed rate, pulled towards the prior while there are only a few downloads"""
+        with self._lock:
+            rate = (self.n_saved + self.prior * self.prior_weight) / \
+                (self.n_urls + self.prior_weight)
+        return max(rate, MIN_SUCCESS_RATE)
+
+
+class SuccessRates:
+    """The success rates of all search engines, shared by the jobs of a scheduler"""
+
+    def __init__(self):
+        self._rates: Dict[str, SuccessRate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, search_engine: str) -> SuccessRate:
+        """Returns the rate of the search engine"""
+        with self._lock:
+            if search_engine not in self._rates:
+                self._rates[search_engine] = SuccessRate()
+            return self._rates[search_engine]
+
+    def report(self) -> str:
+        """Returns the observed rate of every search engine"""
+        with self._lock:
+            rates = dict(self._rates)
+        return "\n".join(f"{name}: {rate.n_saved} of {rate.n_urls} urls saved "
+                         f"(estimated success rate {rate.value:.0%})"
+                         for name, rate in rates.items())
+
+
+class DownloadTarget:
+    """
+    Number of images a job wants to save. download_urls only takes another url from the search
+    while the downloads in flight are probably not enough to reach the target and stops once it is
+    reached, so dead links are replaced without requesting a big fixed surplus of urls
+    """
+
+    def __init__(self, n_images: int, success_rate: SuccessRate, margin: float = DEFAULT_MARGIN):
+        self.n_images = n_images
+        self.success_rate = success_rate
+        self.margin = margin
+        self.n_saved = 0
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def reached(self) -> bool:
+        """True if n_images are saved"""
+        return self.n_saved >= self.n_images
+
+    def urls_needed(self) -> int:
+        """How many more urls the search probably has to deliver to reach the target"""
+        with self._condition:
+            missing = self.n_images - self.n_saved
+            needed = math.ceil(missing / self.success_rate.value * (1 + self.margin))
+            return max(needed - self.in_flight, 0)
+
+    def acquire(self) -> bool:
+        """
+        Blocks until another url is needed and counts it as in flight.
+        Returns False when the target is reached
+        """
+        with self._condition:
+            while not self.reached:
+                expected = self.n_saved + self.in_flight * self.success_rate.value
+                if expected < self.n_images:
+                    self.in_flight += 1
+                    return True
+                self._condition.wait()
+            return False
+
+    def cancel(self):
+        """Gives back an acquired url which was not downloaded, e.g. because the search ended"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def release(self, saved: bool):
+        """Reports the outcome of the download of an acquired url"""
+        self.success_rate.record(saved)
+        with self._condition:
+            self.in_flight -= 1
+            self.n_saved += saved
+            self._condition.notify_all()
+
+
+def extend_search(urls: Iterable[str], search_engine: SearchEngineInterface,
+                  target: DownloadTarget) -> Iterator[str]:
+    """
+    Yields the urls found by the stream mode search_engine (e.g. through a checkpoint and a
+    deduplicator). Before every url is taken, n_images of the search engine is raised to what the
+    target still needs, so the search pages on with its cursor only as far as necessary
+    """
+    def extend():
+        search_engine.n_images = max(search_engine.n_images,
+                                     search_engine.n_yielded + max(target.urls_needed(), 1))
+
+    extend()
+    for url in urls:
+        yield url
+        extend()
@@ -0,0 +1,105 @@
+"""Async search unittests"""
+
+import asyncio
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from search_engines.async_search_engine_interface import AsyncSearchEngineInterface, aiohttp
+from search_engines.registry import SearchEngineFactory
+from utils.async_search import search
+from utils.page_cache import PageCache
+from utils.scheduler import ScrapeJob
+
+
+@SearchEngineFactory.register_se(name="Slow SE", asynchronous=True)
+class SlowSe(AsyncSearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine which waits before every url and counts the searches running at once"""
+    running = 0
+    max_running = 0
+
+    async def _iter_img_links(self):
+        SlowSe.running += 1
+        SlowSe.max_running = max(SlowSe.max_running, SlowSe.running)
+        try:
+            for i in range(self.n_images):
+                await asyncio.sleep(0.01)
+                if self.keyword == "broken" and i == 1:
+                    raise ValueError("no more pages")
+                yield f"https://example.com/{self.keyword}/{i}.jpg"
+        finally:
+            SlowSe.running -= 1
+
+
+class PagedAsyncSe(AsyncSearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine with 2 pages of 3 results in memory, all later pages are empty"""
+    n_requests = 0
+
+    async def _request(self, method, url, **kwargs):
+        PagedAsyncSe.n_requests += 1
+        page = int(url.rsplit("=", 1)[1])
+        return " ".join(f"{page}-{i}" for i in range(3)) if page < 2 else ""
+
+    async def _iter_img_links(self):
+        page = 0
+        while True:
+            url = f"https://paged.example.com/?page={page}"
+            results = (await self._fetch_page("GET", url, is_valid=bool)).split()
+            for result in results:
+                yield f"https://paged.example.com/{result}.jpg"
+            if not self._page_done(url, len(results)):
+                return
+            page += 1
+
+
+class ThreadCheckingCache(PageCache):
+    """Page cache which records the threads it is used from"""
+
+    def __init__(self, cache_dir: Path):
+        super().__init__(cache_dir)
+        self.threads = set()
+
+    def lookup(self, method, url, **kwargs):
+        self.threads.add(threading.current_thread())
+        return super().lookup(method, url, **kwargs)
+
+    def put(self, key, text):
+        self.threads.add(threading.current_thread())
+        super().put(key, text)
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def tearDown(self):
+        SearchEngineFactory.remove_se("Slow SE", asynchronous=True)
+
+    def test_bounded_concurrency(self):
+        """All searches run in one loop, at most max_searches at once, errors stay in their job"""
+        jobs = [ScrapeJob("Slow SE", f"keyword{number}") for number in range(20)]
+        jobs.append(ScrapeJob("Slow SE", "broken"))
+        results = search(jobs, 3, max_searches=5)
+
+        self.assertEqual(SlowSe.max_running, 5)
+        self.assertEqual([result.job for result in results], jobs)
+        self.assertEqual([len(result.urls) for result in results], [3] * 20 + [1])
+        self.assertIsNone(results[0].error)
+        self.assertIn("no more pages", results[-1].error)
+
+    def test_page_cache(self):
+        """Cached pages are read in a thread and the engine stops after the empty pages"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            page_cache = ThreadCheckingCache(Path(tmp_dir))
+            urls = asyncio.run(PagedAsyncSe("moon", 10, page_cache=page_cache).get_img_urls())
+            self.assertEqual(len(urls), 6)
+            self.assertEqual(PagedAsyncSe.n_requests, 5)
+
+            # the empty pages are not cached
+            asyncio.run(PagedAsyncSe("moon", 10, page_cache=page_cache).get_img_urls())
+            self.assertEqual(PagedAsyncSe.n_requests, 8)
+            self.assertEqual(page_cache.hits, 2)
+            self.assertNotIn(threading.main_thread(), page_cache.threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
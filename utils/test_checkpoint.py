@@ -0,0 +1,70 @@
+"""JobCheckpoint unittests"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from search_engines.search_engine_interface import SearchEngineInterface
+from utils.checkpoint import JobCheckpoint
+
+
+class PagedSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine with 4 pages of 3 results"""
+
+    def _iter_img_links(self):
+        page = self.cursor.get("page", 0)
+        n_found = 0
+        while n_found < self.n_images and page < 4:
+            self.cursor["page"] = page
+            for i in range(3):
+                yield f"https://example.com/{page}/{i}.jpg"
+                n_found += 1
+            page += 1
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.dataset_path = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self):
+        """A resumed job replays the open urls and continues the search until it is exhausted"""
+        checkpoint = JobCheckpoint.for_job(self.dataset_path, "Paged SE", "moon")
+        urls = checkpoint.iter_img_urls(PagedSe("moon", 20, stream=True), 20)
+        first_run = [next(urls) for _ in range(5)]
+        for url in first_run[:4]:
+            checkpoint.mark_done(url)
+        checkpoint.close()
+
+        checkpoint = JobCheckpoint.for_job(self.dataset_path, "Paged SE", "moon")
+        self.assertEqual(checkpoint.cursor, {"page": 1})
+        search_engine = PagedSe("moon", 20, stream=True, cursor=checkpoint.cursor)
+        second_run = list(checkpoint.iter_img_urls(search_engine, 20))
+        checkpoint.close()
+
+        self.assertEqual(second_run[0], first_run[4])
+        self.assertEqual(len(first_run[:4] + second_run), 12)
+        self.assertTrue(checkpoint.search_done)
+
+    def test_reopen_missing(self):
+        """Saved urls whose image is not in the dataset anymore are downloaded again"""
+        checkpoint = JobCheckpoint.for_job(self.dataset_path, "Paged SE", "moon")
+        urls = list(checkpoint.iter_img_urls(PagedSe("moon", 3, stream=True), 3))
+        for url in urls:
+            checkpoint.mark_done(url, saved=url != urls[2])
+        self.assertEqual(checkpoint.reopen_missing(lambda url: url == urls[0]), 1)
+        checkpoint.close()
+
+        checkpoint = JobCheckpoint.for_job(self.dataset_path, "Paged SE", "moon")
+        self.assertEqual(checkpoint.n_saved, 1)
+        self.assertEqual(checkpoint.completed, {urls[0], urls[2]})
+        self.assertEqual(list(checkpoint.iter_img_urls(PagedSe("moon", 3, stream=True), 3)),
+                         [urls[1]])
+        checkpoint.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Dataset writer unittests"""
+
+import json
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+
+from utils.dataset_writer import MANIFEST_FILE_NAME, DatasetWriter, ShardDatasetWriter
+from utils.download_index import DownloadIndex
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.dataset_path = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, writer: DatasetWriter, name: str) -> str:
+        tmp_path = self.dataset_path / f".{name}.part"
+        tmp_path.write_bytes(name.encode() * 10)
+        return writer.write(tmp_path, f"{name}.jpg", {"url": f"https://example.com/{name}.jpg"})
+
+    def _manifest(self):
+        with open(self.dataset_path / MANIFEST_FILE_NAME, "r", encoding="utf-8") as manifest:
+            return [json.loads(line) for line in manifest]
+
+    def test_prefix_layout(self):
+        """Images are moved into a directory named by their hash prefix"""
+        writer = DatasetWriter.for_path(self.dataset_path, "prefix")
+        self.assertEqual(self._write(writer, "abc"), "ab/abc.jpg")
+        self.assertTrue((self.dataset_path / "ab" / "abc.jpg").is_file())
+        # the record is on disk before the download index gets the url
+        self.assertEqual(self._manifest()[0]["size"], 30)
+        self.assertTrue(writer.is_stored("abc.jpg"))
+        writer.close()
+
+    def test_shards(self):
+        """Full shards are finalized with their manifest records, the last one on close"""
+        writer = DatasetWriter.for_path(self.dataset_path, "shards", shard_size=2)
+        locations = [self._write(writer, name) for name in ("aaa", "bbb", "ccc")]
+        self.assertEqual(locations[0], "shard-000000.tar/aaa.jpg")
+        self.assertEqual(len(self._manifest()), 2)
+        self.assertFalse((self.dataset_path / "shard-000001.tar").exists())
+
+        writer.close()
+        self.assertEqual([record["file"] for record in self._manifest()], locations)
+        with tarfile.open(self.dataset_path / "shard-000001.tar") as shard:
+            self.assertEqual(shard.getnames(), ["ccc.jpg"])
+
+        index = DownloadIndex(self.dataset_path)
+        index.add("https://example.com/aaa.jpg", "aaa", locations[0])
+        self.assertIn("https://example.com/aaa.jpg", index)
+        index.close()
+
+    def test_killed_run(self):
+        """The unfinished shard of a killed run is deleted and its images are not stored"""
+        writer = DatasetWriter.for_path(self.dataset_path, "shards", shard_size=2)
+        for name in ("aaa", "bbb", "ccc"):
+            self._write(writer, name)
+        self.assertTrue(writer.is_stored("ccc.jpg"))
+
+        # the run is killed before the second shard is finalized
+        writer._shard_file.close()  # pylint: disable=protected-access
+        writer._manifest.close()  # pylint: disable=protected-access
+        DatasetWriter._instances.clear()  # pylint: disable=protected-access
+
+        restarted = DatasetWriter.for_path(self.dataset_path, "shards", shard_size=2)
+        self.assertTrue(restarted.is_stored("aaa.jpg"))
+        self.assertFalse(restarted.is_stored("ccc.jpg"))
+        self.assertEqual(list(self.dataset_path.glob(".*.part")), [])
+        restarted.close()
+
+    def test_named_shards(self):
+        """Writers with different names share the dataset dir without touching the other shards"""
+        first = ShardDatasetWriter(self.dataset_path, shard_size=2, name="host-1")
+        self.assertEqual(self._write(first, "aaa"), "shard-host-1-000000.tar/aaa.jpg")
+        second = ShardDatasetWriter(self.dataset_path, shard_size=2, name="host-2")
+        self.assertEqual(self._write(second, "bbb"), "shard-host-2-000000.tar/bbb.jpg")
+        self.assertTrue((self.dataset_path / ".shard-host-1-000000.tar.part").exists())
+
+        # the first writer is killed and restarted while the second one keeps writing
+        first._shard_file.close()  # pylint: disable=protected-access
+        first._manifest.close()  # pylint: disable=protected-access
+        restarted = ShardDatasetWriter(self.dataset_path, shard_size=2, name="host-1")
+        self.assertFalse((self.dataset_path / ".shard-host-1-000000.tar.part").exists())
+        self.assertEqual(self._write(restarted, "ccc"), "shard-host-1-000001.tar/ccc.jpg")
+        second.close()
+        restarted.close()
+        self.assertEqual(sorted(path.name for path in self.dataset_path.glob("*.tar")),
+                         ["shard-host-1-000001.tar", "shard-host-2-000000.tar"])
+
+    def test_options(self):
+        """A shared writer refuses other options"""
+        writer = DatasetWriter.for_path(self.dataset_path, "shards", shard_size=2)
+        self.assertIs(DatasetWriter.for_path(self.dataset_path, "shards", shard_size=2), writer)
+        with self.assertRaises(ValueError):
+            DatasetWriter.for_path(self.dataset_path, "shards", shard_size=3)
+        with self.assertRaises(ValueError):
+            DatasetWriter.for_path(self.dataset_path, "flat")
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Write-behind writer unittests"""
+
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from utils.disk_writer import WriteBehindWriter
+from utils.metrics import Metrics
+
+
+def _delete(tmp_path: Path):
+    os.unlink(tmp_path)
+    return None, None
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = Path(self.tmp_dir.name)
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _submit(self, writer: WriteBehindWriter, data: bytes, finish):
+        """Writes data to a temp file like a download and submits it"""
+        handle, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".", suffix=".part")
+        with os.fdopen(handle, "wb") as tmp_file:
+            tmp_file.write(data)
+        return writer.submit(Path(tmp_name), len(data), finish)
+
+    def _move(self, tmp_path: Path, name: str):
+        """Moves the file into the images dir"""
+        directory = self.path / "images"
+        directory.mkdir(exist_ok=True)
+        os.replace(tmp_path, directory / name)
+        return name, directory
+
+    def test_write(self):
+        """The temp files are synced and finish moves them to their final name"""
+        writer = WriteBehindWriter(n_threads=2, sync_every=2, metrics=self.metrics)
+        futures = [self._submit(writer, f"image {i}".encode(),
+                                lambda tmp_path, i=i: self._move(tmp_path, f"{i}.jpg"))
+                   for i in range(5)]
+        writer.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual([future.result() for future in futures], [f"{i}.jpg" for i in range(5)])
+        self.assertEqual(sorted(path.name for path in self.path.iterdir()), ["images"])
+        self.assertEqual((self.path / "images" / "3.jpg").read_bytes(), b"image 3")
+        self.assertEqual(self.metrics.gauge("disk_queue_depth"), 0)
+
+    def test_failed_finish(self):
+        """The temp file of a failed finish is deleted and the future gets its error"""
+        def finish(tmp_path):
+            raise OSError(f"can not move {tmp_path}")
+
+        writer = WriteBehindWriter(n_threads=1, metrics=self.metrics)
+        future = self._submit(writer, b"data", finish)
+        writer.close()
+        self.assertIsInstance(future.exception(), OSError)
+        self.assertEqual(list(self.path.iterdir()), [])
+
+    def test_backpressure(self):
+        """submit blocks while the queued bytes are over the limit"""
+        release = threading.Event()
+        writer = WriteBehindWriter(n_threads=1, max_queue_bytes=10, metrics=self.metrics)
+        # blocks the thread
+        self._submit(writer, b"12345678", lambda tmp_path: (release.wait(), None))
+        self._submit(writer, b"12345678", _delete)
+
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (self._submit(writer, b"12345678", _delete),
+                                         submitted.set()), daemon=True).start()
+        self.assertFalse(submitted.wait(0.2))
+        self.assertEqual(self.metrics.gauge("disk_queue_bytes"), 8)
+
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        writer.flush()
+        self.assertGreater(self.metrics.total("disk_backpressure_seconds_total"), 0.1)
+        writer.close()
+
+    def test_sync_before_results(self):
+        """
+        Futures are done after the sync of their batch, the last batch syncs when idle.
+        Only the directories the files were moved into are synced
+        """
+        events, synced = [], []
+        release = threading.Event()
+        writer = WriteBehindWriter(n_threads=1, sync_every=2, sync_seconds=60,
+                                   metrics=self.metrics)
+        with mock.patch("utils.disk_writer._sync_directory",
+                        side_effect=lambda directory: (events.append("sync"),
+                                                       synced.append(directory))):
+            futures = [self._submit(writer, b"data", lambda tmp_path: (release.wait(), self.path))]
+            futures.append(self._submit(writer, b"data",
+                                        lambda tmp_path: self._move(tmp_path, "a.jpg")))
+            futures.append(self._submit(writer, b"data", _delete))
+            for future in futures:
+                future.add_done_callback(lambda future: events.append("done"))
+            release.set()
+            writer.flush()
+            writer.close()
+        self.assertEqual(events, ["sync", "sync", "done", "done", "done"])
+        self.assertEqual(set(synced), {self.path, self.path / "images"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""DownloadIndex unittests"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from utils.download_index import DownloadIndex
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.dataset_path = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reload(self):
+        """Entries are still there after the index was opened again"""
+        index = DownloadIndex(self.dataset_path)
+        (self.dataset_path / "abc.jpg").write_bytes(b"")
+        index.add("https://example.com/a.jpg", "abc", "abc.jpg")
+        index.close()
+
+        index = DownloadIndex(self.dataset_path)
+        self.assertIn("https://example.com/a.jpg", index)
+        self.assertEqual(index.get("https://example.com/a.jpg").md5, "abc")
+        index.close()
+
+    def test_missing_file(self):
+        """Urls whose file was deleted from the dataset are not known anymore"""
+        index = DownloadIndex(self.dataset_path)
+        index.add("https://example.com/a.jpg", "abc", "abc.jpg")
+        self.assertNotIn("https://example.com/a.jpg", index)
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+"""Download unittests against a local image server"""
+
+import io
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from unittest import mock
+
+from utils.dataset_writer import DatasetWriter
+from utils.download_urls import download_urls
+from utils.metrics import Metrics
+from utils.perceptual_hash import Image, NearDuplicateIndex
+
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """
+    Answers every path with the status, headers and body registered for it in pages, a header
+    with the value None is left out. The body bytes which reached the client are counted in sent
+    """
+    pages: Dict[str, Tuple[int, Dict[str, Optional[str]], bytes]] = {}
+    sent: Dict[str, int] = {}
+    delay = 0.0  # seconds every response takes
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the request and records how many requests run at the same time"""
+        cls = type(self)
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        try:
+            time.sleep(self.delay)
+            self._answer()
+        finally:
+            with cls.lock:
+                cls.running -= 1
+
+    def _answer(self):
+        status, headers, body = self.pages.get(self.path, (404, {}, b""))
+        self.send_response(status)
+        for name, value in {"Content-Length": str(len(body)), **headers}.items():
+            if value is not None:
+                self.send_header(name, value)
+        self.end_headers()
+        self.sent[self.path] = 0
+        try:
+            for start in range(0, len(body), CHUNK_SIZE):
+                self.wfile.write(body[start:start + CHUNK_SIZE])
+                self.sent[self.path] += len(body[start:start + CHUNK_SIZE])
+        except ConnectionError:
+            pass  # the client aborted the download
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def _png(size: Tuple[int, int], color: int = 0) -> bytes:
+    output = io.BytesIO()
+    Image.new("L", size, color).save(output, "PNG")
+    return output.getvalue()
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.dataset_path = Path(self.tmp_dir.name)
+        self.metrics = Metrics()
+        ImageHandler.pages = {}
+        ImageHandler.sent = {}
+        ImageHandler.delay = 0.0
+        ImageHandler.max_running = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _download(self, paths, **kwargs) -> int:
+        return download_urls(self.dataset_path, [self.url + path for path in paths],
+                             metrics=self.metrics, **kwargs)
+
+    def _reasons(self) -> Dict[str, float]:
+        return {reason: self.metrics.total("download_results_total", reason=reason)
+                for reason in ("headers", "magic_number", "size")}
+
+    def test_rejected_headers(self):
+        """Error statuses, non image types and too big lengths are rejected before the body"""
+        body = PNG_HEADER + bytes(32 * 1024 * 1024)
+        ImageHandler.pages = {
+            "/missing.png": (404, {"Content-Type": "text/html"}, b"<html>not found</html>"),
+            "/page.png": (200, {"Content-Type": "text/html; charset=utf-8"}, body),
+            "/huge.png": (200, {"Content-Type": "image/png"}, body)}
+        self.assertEqual(self._download(["/missing.png", "/page.png", "/huge.png"]), 0)
+        self.assertEqual(self._reasons(), {"headers": 3, "magic_number": 0, "size": 0})
+        # the socket buffers take a few megabytes before the server notices the abort
+        self.assertLess(ImageHandler.sent["/page.png"], len(body) // 2)
+        self.assertLess(ImageHandler.sent["/huge.png"], len(body) // 2)
+        self.assertEqual(list(self.dataset_path.glob("*.png")), [])
+
+    def test_rejected_magic_number(self):
+        """Bodies which are not an image by their first bytes are rejected after the first chunk"""
+        html = b"<!DOCTYPE html>" + bytes(32 * 1024 * 1024)
+        riff = b"RIFF\x24\x00\x00\x00"
+        ImageHandler.pages = {
+            "/page": (200, {"Content-Type": "application/octet-stream"}, html),
+            "/sound": (200, {"Content-Type": "image/webp"}, riff + b"WAVEfmt " + bytes(64)),
+            "/image": (200, {"Content-Type": None}, riff + b"WEBPVP8 " + bytes(64))}
+        self.assertEqual(self._download(["/page", "/sound", "/image"],
+                                        max_image_size=2 * len(html)), 1)
+        self.assertEqual(self._reasons(), {"headers": 0, "magic_number": 2, "size": 0})
+        self.assertLess(ImageHandler.sent["/page"], len(html) // 2)
+        self.assertEqual([path.suffix for path in self.dataset_path.iterdir()
+                          if not path.name.startswith(".")], [".webp"])
+
+    def test_rejected_size(self):
+        """A body without Content-Length is aborted once it gets bigger than max_image_size"""
+        body = PNG_HEADER + bytes(32 * 1024 * 1024)
+        ImageHandler.pages = {"/endless.png": (200, {"Content-Type": "image/png",
+                                                     "Content-Length": None}, body),
+                              "/small.png": (200, {"Content-Type": "image/png",
+                                                   "Content-Length": None}, body[:1000])}
+        self.assertEqual(self._download(["/endless.png", "/small.png"], max_image_size=1000), 1)
+        self.assertEqual(self._reasons(), {"headers": 0, "magic_number": 0, "size": 1})
+        self.assertLess(ImageHandler.sent["/endless.png"], len(body) // 2)
+        self.assertEqual(len(list(self.dataset_path.glob("*.png"))), 1)
+        self.assertEqual(list(self.dataset_path.glob(".*.part")), [])
+
+    def test_streamed_urls(self):
+        """Urls of a generator are downloaded while it still yields, not after it is exhausted"""
+        ImageHandler.pages = {f"/{i}.png": (200, {"Content-Type": "image/png"},
+                                            PNG_HEADER + bytes([i]) * 10) for i in range(3)}
+        first_done = threading.Event()
+        waited = []
+
+        def urls():
+            yield self.url + "/0.png"
+            waited.append(first_done.wait(5))
+            yield from (f"{self.url}/{i}.png" for i in range(1, 3))
+
+        saved = download_urls(self.dataset_path, urls(), queue_size=1, metrics=self.metrics,
+                              on_done=lambda url, saved: first_done.set())
+        self.assertEqual(saved, 3)
+        self.assertEqual(waited, [True])
+
+    def test_concurrency(self):
+        """n_workers downloads run at the same time, up to max_per_host against one host"""
+        ImageHandler.pages = {f"/{i}.png": (200, {"Content-Type": "image/png"},
+                                            PNG_HEADER + bytes([i]) * 10) for i in range(12)}
+        ImageHandler.delay = 0.1
+        start = time.perf_counter()
+        self.assertEqual(self._download([f"/{i}.png" for i in range(12)], n_workers=8,
+                                        max_per_host=4), 12)
+        self.assertEqual(ImageHandler.max_running, 4)
+        # three rounds of four parallel requests instead of twelve one after another
+        self.assertLess(time.perf_counter() - start, 0.8)
+
+    @unittest.skipIf(Image is None, "pillow is not installed")
+    def test_decompression_bomb(self):
+        """An image which pillow refuses to decode is rejected, the other images are saved"""
+        ImageHandler.pages = {"/bomb.png": (200, {"Content-Type": "image/png"}, _png((100, 100))),
+                              "/small.png": (200, {"Content-Type": "image/png"}, _png((10, 10)))}
+        near_duplicates = NearDuplicateIndex(self.dataset_path)
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            saved = self._download(["/bomb.png", "/small.png"], near_duplicates=near_duplicates)
+        near_duplicates.close()
+        self.assertEqual(saved, 1)
+        self.assertEqual(self.metrics.total("download_results_total", reason="undecodable"), 1)
+
+    def test_max_per_host_across_jobs(self):
+        """Parallel jobs share the per host limit instead of each getting its own"""
+        ImageHandler.pages = {f"/{i}.png": (200, {"Content-Type": "image/png"},
+                                            PNG_HEADER + bytes([i]) * 10) for i in range(24)}
+        ImageHandler.delay = 0.05
+        jobs = [threading.Thread(target=self._download,
+                                 args=([f"/{i}.png" for i in range(job, 24, 3)],),
+                                 kwargs={"n_workers": 8, "max_per_host": 2})
+                for job in range(3)]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+        self.assertEqual(len(list(self.dataset_path.glob("*.png"))), 24)
+        self.assertLessEqual(ImageHandler.max_running, 2)
+
+    def test_streamed_body(self):
+        """The body is streamed to a temp file which is moved, or deleted if the download breaks"""
+        big = PNG_HEADER + bytes(range(256)) * 4096
+        ImageHandler.pages = {"/big.png": (200, {"Content-Type": "image/png"}, big),
+                              "/cut.png": (200, {"Content-Type": "image/png",
+                                                 "Content-Length": str(len(big))}, big[:1000])}
+        self.assertEqual(self._download(["/big.png", "/cut.png"]), 1)
+        self.assertEqual([path.read_bytes() for path in self.dataset_path.glob("*.png")], [big])
+        self.assertEqual(list(self.dataset_path.glob(".*.part")), [])
+        self.assertEqual(self.metrics.total("download_results_total", result="error"), 1)
+
+    def test_sync_prefix_directory(self):
+        """The directory an image is moved into is synced before the url is indexed"""
+        ImageHandler.pages = {"/a.png": (200, {"Content-Type": "image/png"}, _png((10, 10)))}
+        writer = DatasetWriter.for_path(self.dataset_path, "prefix")
+        synced = []
+        with mock.patch("utils.disk_writer._sync_directory", side_effect=synced.append):
+            self.assertEqual(self._download(["/a.png"], writer=writer), 1)
+        writer.close()
+        location = next(self.dataset_path.glob("*/*.png"))
+        self.assertEqual(synced, [location.parent])
+
+
+if __name__ == '__main__':
+    unittest.main()
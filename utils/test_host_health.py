@@ -0,0 +1,136 @@
+"""Host health unittests"""
+
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from utils.download_urls import download_urls
+from utils.host_health import HostHealth, get_host_health
+from utils.metrics import Metrics
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Answers with a png, after delay seconds"""
+    delay = 0.0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the request"""
+        time.sleep(self.delay)
+        body = b"\x89PNG\r\n\x1a\n" + self.path.encode() * 10
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TarpitHandler(ImageHandler):
+    """Image host which takes half a second for every response"""
+    delay = 0.5
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_circuit(self):
+        """The circuit opens after the failures, then a single trial download tests the host"""
+        health = HostHealth(failure_threshold=3, open_seconds=0.05)
+        for _ in range(3):
+            self.assertTrue(health.allow())
+            health.on_failure(0.1)
+        self.assertTrue(health.is_open)
+        self.assertFalse(health.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(health.allow())
+        self.assertFalse(health.allow())  # the trial is still running
+        health.on_failure(0.1)
+        time.sleep(0.06)
+        self.assertFalse(health.allow())  # failed trials double the cooldown
+
+        time.sleep(0.05)
+        self.assertTrue(health.allow())
+        health.on_success(0.1)
+        self.assertTrue(health.allow())
+        self.assertFalse(health.is_open)
+
+    def test_slow(self):
+        """Hosts are slow when their average latency is above slow_latency"""
+        health = HostHealth(slow_latency=1.0)
+        health.on_success(0.2)
+        self.assertFalse(health.slow)
+        for _ in range(5):
+            health.on_success(10)
+        self.assertTrue(health.slow)
+
+    def test_dead_host(self):
+        """Only the first urls of a dead host are requested, the others are skipped"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]  # nothing listens on the port after the socket is closed
+        urls = [f"http://127.0.0.1:{port}/{i}.jpg" for i in range(20)]
+        done = []
+        metrics = Metrics()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            saved = download_urls(Path(tmp_dir), urls, n_workers=1, metrics=metrics,
+                                  on_done=lambda url, saved: done.append(url))
+        self.assertEqual(saved, 0)
+        self.assertEqual(len(done), 3)
+        self.assertEqual(metrics.total("download_results_total", reason="host_down"), 17)
+
+    def _download_tarpit(self, n_tarpit_urls: int, queue_size: int):
+        """
+        Downloads n_tarpit_urls from a slow host and 10 urls from a fast host. Returns the number
+        of saved images, the metrics and the seconds after which every passed url was done
+        """
+        servers = [ThreadingHTTPServer(("127.0.0.1", 0), handler)
+                   for handler in (TarpitHandler, ImageHandler)]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        tarpit, fast = [f"127.0.0.1:{server.server_port}" for server in servers]
+        for _ in range(5):
+            get_host_health(tarpit).on_success(100)
+
+        done = {}
+        urls = [f"http://{tarpit}/{i}.png" for i in range(n_tarpit_urls)] + \
+               [f"http://{fast}/{i}.png" for i in range(10)]
+        metrics = Metrics()
+        start = time.perf_counter()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                saved = download_urls(Path(tmp_dir), urls, n_workers=4, queue_size=queue_size,
+                                      slow_workers=1, metrics=metrics,
+                                      on_done=lambda url, saved: done.update(
+                                          {url: time.perf_counter() - start}))
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+        return saved, metrics, [done.get(url) for url in urls]
+
+    def test_tarpit(self):
+        """A full slow lane does not hold up the urls of fast hosts behind it"""
+        saved, metrics, done = self._download_tarpit(4, queue_size=2)
+        self.assertEqual(saved, 14)
+        # the tarpit urls take 2 seconds one after another
+        self.assertLess(max(done[4:]), 0.4)
+        self.assertGreater(max(done[:4]), 1.5)
+        self.assertGreaterEqual(metrics.total("download_deferred_total"), 1)
+
+    def test_slow_lane_full(self):
+        """Slow urls which fit neither into the slow lane nor into the deferred urls are skipped"""
+        saved, metrics, done = self._download_tarpit(6, queue_size=1)
+        skipped = metrics.total("download_results_total", reason="slow_lane_full")
+        # the slow worker, the slow lane and the deferred urls hold at most three urls
+        self.assertGreaterEqual(skipped, 3)
+        self.assertEqual(saved + skipped, 16)
+        self.assertEqual(done.count(None), skipped)
+        self.assertEqual(metrics.total("download_deferred_total"), 1)
+
+if __name__ == '__main__':
+    unittest.main()
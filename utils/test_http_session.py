@@ -0,0 +1,88 @@
+"""Http session unittests"""
+
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from utils.http_session import build_session, get_session
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Answers /flaky with two 503s before a 200, /throttled with a 503 and a Retry-After of 8 seconds
+    before a 200 and /slow after a second
+    """
+    calls = 0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the request"""
+        if self.path == "/slow":
+            time.sleep(1)
+        elif self.path in ("/flaky", "/throttled"):
+            FlakyHandler.calls += 1
+            if FlakyHandler.calls <= (2 if self.path == "/flaky" else 1):
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                if self.path == "/throttled":
+                    self.send_header("Retry-After", "8")
+                self.end_headers()
+                return
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_retries(self):
+        """Retry statuses are retried until the request succeeds"""
+        FlakyHandler.calls = 0
+        with build_session(retries=3, backoff_factor=0) as session:
+            response = session.get(f"{self.url}/flaky")
+        self.assertEqual((response.status_code, FlakyHandler.calls), (200, 3))
+
+        FlakyHandler.calls = 0
+        with build_session(retries=1, backoff_factor=0) as session:
+            self.assertEqual(session.get(f"{self.url}/flaky").status_code, 503)
+
+    def test_retry_after(self):
+        """Sessions without respect_retry_after retry after their backoff"""
+        FlakyHandler.calls = 0
+        start = time.perf_counter()
+        with build_session(retries=1, backoff_factor=0, respect_retry_after=False) as session:
+            self.assertEqual(session.get(f"{self.url}/throttled").status_code, 200)
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_default_timeout(self):
+        """Requests without a timeout get the timeout of the session"""
+        with build_session(timeout=(1.0, 0.2), retries=0) as session:
+            # with the retry adapter the timeout surfaces wrapped in a ConnectionError
+            with self.assertRaisesRegex(requests.exceptions.RequestException, "Read timed out"):
+                session.get(f"{self.url}/slow")
+            self.assertEqual(session.get(f"{self.url}/slow", timeout=5).text, "ok")
+
+    def test_shared_sessions(self):
+        """Sessions are shared by name"""
+        self.assertIs(get_session("test"), get_session("test"))
+        self.assertIsNot(get_session("test"), get_session("other test"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Image processing unittests"""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from utils.download_urls import _detect_format
+from utils.image_processing import ProcessOptions, process_image
+from utils.perceptual_hash import Image
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_detect_format(self):
+        """The extension comes from the first bytes of the file and not from the url"""
+        self.assertEqual(_detect_format(b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"), "jpg")
+        self.assertEqual(_detect_format(b"RIFF\x10\x00\x00\x00WEBPVP8 "), "webp")
+        self.assertIsNone(_detect_format(b"RIFF\x10\x00\x00\x00WAVEfmt "))
+        self.assertIsNone(_detect_format(b"<!DOCTYPE html>"))
+
+    @unittest.skipIf(Image is None, "pillow is not installed")
+    def test_truncated_image(self):
+        """A truncated jpeg is rejected and deleted"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, ".image.part")
+            Image.radial_gradient("L").save(path, "JPEG")
+            with open(path, "r+b") as image_file:
+                image_file.truncate(os.path.getsize(path) // 2)
+
+            result = process_image(path, ProcessOptions())
+            self.assertIsNone(result.path)
+            self.assertEqual(result.reason, "undecodable")
+            self.assertFalse(os.path.exists(path))
+
+    @unittest.skipIf(Image is None, "pillow is not installed")
+    def test_convert_and_resize(self):
+        """A png with alpha channel is converted to a downscaled jpeg"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, ".image.part")
+            Image.new("RGBA", (300, 200), (255, 0, 0, 128)).save(path, "PNG")
+
+            result = process_image(path, ProcessOptions(target_format="jpg", max_side=150), True)
+            self.assertEqual(result.extension, "jpg")
+            self.assertIsNotNone(result.phash)
+            self.assertFalse(os.path.exists(path))
+            with Image.open(Path(result.path)) as image:
+                self.assertEqual((image.format, image.size), ("JPEG", (150, 100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Metrics unittests"""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from utils.metrics import Metrics
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_counters(self):
+        """Counters are summed per label set, total sums over the matching label sets"""
+        self.metrics.inc("download_results_total", result="saved", engine="Bing SE")
+        self.metrics.inc("download_results_total", result="saved", engine="Duckgo SE")
+        self.metrics.inc("download_results_total", 2, result="error", engine="Bing SE")
+        self.assertEqual(self.metrics.total("download_results_total"), 4)
+        self.assertEqual(self.metrics.total("download_results_total", result="saved"), 2)
+        self.assertEqual(self.metrics.total("download_results_total", engine="Bing SE"), 3)
+        self.assertEqual(self.metrics.total("unknown_total"), 0)
+
+    def test_histograms(self):
+        """Observations are counted in the cumulative buckets"""
+        for value in (0.003, 0.2, 0.2, 100):
+            self.metrics.observe("download_seconds", value)
+        histogram = self.metrics.to_json()["histograms"]["download_seconds"][0]
+        self.assertEqual(histogram["count"], 4)
+        self.assertAlmostEqual(histogram["sum"], 100.403)
+        self.assertEqual(histogram["buckets"]["0.005"], 1)
+        self.assertEqual(histogram["buckets"]["0.25"], 3)
+        self.assertEqual(histogram["buckets"]["30.0"], 3)
+
+    def test_prometheus(self):
+        """The text export has types, buckets and escaped label values"""
+        self.metrics.inc("search_urls_total", keyword='say "cheese"\\\n')
+        self.metrics.observe("download_seconds", 0.2)
+        self.metrics.set_gauge("disk_queue_depth", 3)
+        text = self.metrics.to_prometheus()
+        self.assertIn("# TYPE ws_search_urls_total counter", text)
+        self.assertIn('ws_search_urls_total{keyword="say \\"cheese\\"\\\\\\n"} 1', text)
+        self.assertIn('ws_download_seconds_bucket{le="0.25"} 1', text)
+        self.assertIn('ws_download_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("ws_disk_queue_depth 3", text)
+        self.assertTrue(all(line.count('"') % 2 == 0 for line in text.splitlines()))
+
+    def test_json_export(self):
+        """The json export contains every metric with its labels"""
+        self.metrics.inc("search_urls_total", 5, engine="Bing SE")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "metrics.json"
+            self.metrics.export(str(path), "json")
+            exported = json.loads(path.read_text(encoding="utf-8"))
+        self.assertEqual(exported["counters"]["search_urls_total"],
+                         [{"labels": {"engine": "Bing SE"}, "value": 5}])
+
+    def test_summary(self):
+        """The summary shows the urls, the saved images and the errors"""
+        self.metrics.inc("search_urls_total", 10)
+        self.metrics.inc("download_results_total", 4, result="saved")
+        self.metrics.inc("download_results_total", 1, result="error")
+        summary = self.metrics.summary()
+        self.assertIn("10 urls found", summary)
+        self.assertIn("4 images saved", summary)
+        self.assertIn("1 errors", summary)
+        self.assertNotIn("disk queue", summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
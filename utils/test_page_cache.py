@@ -0,0 +1,67 @@
+"""PageCache unittests"""
+
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from utils.page_cache import PageCache
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache_dir = Path(self.tmp_dir.name)
+        self.requests = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _request(self, method, url, **_):
+        self.requests.append((method, url))
+        return SimpleNamespace(ok=True, text=f"page of {url}")
+
+    def test_ttl(self):
+        """Entries older than the ttl are requested again"""
+        cache = PageCache(self.cache_dir, ttl=0.05)
+        cache.fetch(self._request, "GET", "https://example.com/1")
+        cache.fetch(self._request, "GET", "https://example.com/1")
+        self.assertEqual((cache.hits, len(self.requests)), (1, 1))
+
+        time.sleep(0.1)
+        self.assertEqual(cache.fetch(self._request, "GET", "https://example.com/1"),
+                         "page of https://example.com/1")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_lru_eviction(self):
+        """The least recently used entries are removed when the cache is too big"""
+        cache = PageCache(self.cache_dir, max_size=10_000)
+        keys = [cache.key("GET", f"https://example.com/{i}") for i in range(3)]
+        for age, key in zip((30, 20, 10), keys):
+            cache.put(key, "x" * 4000)
+            os.utime(self.cache_dir / f"{key}.json", (time.time() - age, time.time() - age))
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_invalid_pages(self):
+        """Pages rejected by is_valid and error responses are not cached"""
+        cache = PageCache(self.cache_dir)
+        for _ in range(2):
+            cache.fetch(self._request, "GET", "https://example.com/empty",
+                        is_valid=lambda text: "results" in text)
+        self.assertEqual(len(self.requests), 2)
+
+        def failing_request(method, url, **kwargs):
+            self._request(method, url, **kwargs)
+            return SimpleNamespace(ok=False, text="rate limited")
+        for _ in range(2):
+            cache.fetch(failing_request, "GET", "https://example.com/429")
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(cache.hits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Perceptual hash unittests"""
+
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from utils.perceptual_hash import (Image, MultiIndexHashIndex, NearDuplicateIndex, dhash,
+                                   hamming_distance)
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_index_matches_brute_force(self):
+        """The index finds a hash within max_distance exactly when a linear scan does"""
+        rng = random.Random(0)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        index = MultiIndexHashIndex(max_distance=6)
+        for number, value in enumerate(hashes):
+            index.add(value, str(number))
+
+        queries = [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+                   for value in hashes[:100]] + [rng.getrandbits(64) for _ in range(100)]
+        for query in queries:
+            expected = any(hamming_distance(query, value) <= 6 for value in hashes)
+            self.assertEqual(index.find(query) is not None, expected)
+
+    @unittest.skipIf(Image is None, "pillow is not installed")
+    def test_resized_copy(self):
+        """A resized jpeg copy is a near duplicate, a different image is not"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            original = Image.radial_gradient("L").convert("RGB")
+            original.save(Path(tmp_dir) / "original.png")
+            original.resize((100, 100)).save(Path(tmp_dir) / "copy.jpg", quality=60)
+            Image.linear_gradient("L").save(Path(tmp_dir) / "other.png")
+
+            original_hash = dhash(Path(tmp_dir) / "original.png")
+            self.assertLessEqual(hamming_distance(original_hash, dhash(Path(tmp_dir) / "copy.jpg")),
+                                 6)
+            self.assertGreater(hamming_distance(original_hash, dhash(Path(tmp_dir) / "other.png")),
+                               6)
+
+    def test_for_path(self):
+        """The shared index of a dataset refuses a different max_distance"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = NearDuplicateIndex.for_path(Path(tmp_dir), 4)
+            self.assertIs(NearDuplicateIndex.for_path(Path(tmp_dir), 4), index)
+            with self.assertRaises(ValueError):
+                NearDuplicateIndex.for_path(Path(tmp_dir), 8)
+            index.close()
+
+    def test_lost_image(self):
+        """An image which is not stored anymore does not reject its near duplicates"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = NearDuplicateIndex(Path(tmp_dir))
+            self.assertIsNone(index.check_and_add(0b1011, "lost.jpg"))
+            self.assertEqual(index.check_and_add(0b1001, "copy.jpg"), "lost.jpg")
+            self.assertIsNone(index.check_and_add(0b1001, "new.jpg", "lost.jpg".__ne__))
+            self.assertEqual(index.check_and_add(0b1000, "copy.jpg", "lost.jpg".__ne__), "new.jpg")
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
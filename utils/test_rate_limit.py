@@ -0,0 +1,26 @@
+"""AdaptiveRateLimiter unittests"""
+
+import unittest
+
+from utils.rate_limit import AdaptiveRateLimiter
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_throttle(self):
+        """A 429 halves the rate, fast responses increase it again"""
+        rate_limiter = AdaptiveRateLimiter(rate=2.0)
+        rate_limiter.on_response(429, 0.1)
+        self.assertAlmostEqual(rate_limiter.rate, 1.0)
+        rate_limiter.on_response(200, 0.1)
+        self.assertAlmostEqual(rate_limiter.rate, 1.1)
+
+    def test_min_rate(self):
+        """The rate never drops below min_rate"""
+        rate_limiter = AdaptiveRateLimiter(rate=1.0, min_rate=0.5)
+        for _ in range(10):
+            rate_limiter.on_empty_page()
+        self.assertAlmostEqual(rate_limiter.rate, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
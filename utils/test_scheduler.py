@@ -0,0 +1,137 @@
+"""Scrape scheduler unittests with search engines and images served locally"""
+
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from search_engines.registry import SearchEngineFactory
+from search_engines.search_engine_interface import SearchEngineInterface
+from utils.scheduler import ScrapeJob, ScrapeScheduler, expand_jobs, format_summary
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Answers every path with a different png"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the request"""
+        body = b"\x89PNG\r\n\x1a\n" + self.path.encode() * 10
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class SlowSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """
+    Search engine whose result page takes a while. The results are the same for all engines of
+    the class and depend only on the keyword. It records how many jobs page at the same time
+    """
+    host = ""
+    delay = 0.1
+    lock = threading.Lock()
+    running: Counter = Counter()
+    max_running: Counter = Counter()
+
+    def _iter_img_links(self):
+        cls = SlowSe
+        engine = type(self).__name__
+        with cls.lock:
+            cls.running[engine] += 1
+            cls.running["all"] += 1
+            for key in (engine, "all"):
+                cls.max_running[key] = max(cls.max_running[key], cls.running[key])
+        try:
+            time.sleep(self.delay)
+        finally:
+            with cls.lock:
+                cls.running[engine] -= 1
+                cls.running["all"] -= 1
+        yield from (f"http://{self.host}/{self.keyword}/{i}.png" for i in range(self.n_images))
+
+
+class SlowASe(SlowSe):  # pylint: disable=too-few-public-methods
+    """First engine with the results of SlowSe"""
+
+
+class SlowBSe(SlowSe):  # pylint: disable=too-few-public-methods
+    """Second engine with the results of SlowSe"""
+
+
+class BrokenSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine which fails on the first page"""
+
+    def _iter_img_links(self):
+        raise ValueError("no result page")
+
+
+ENGINES = {"Slow A SE": SlowASe, "Slow B SE": SlowBSe, "Broken SE": BrokenSe}
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        SlowSe.host = f"127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        for name, se_class in ENGINES.items():
+            SearchEngineFactory.register_se(name)(se_class)
+
+    @classmethod
+    def tearDownClass(cls):
+        for name in ENGINES:
+            SearchEngineFactory.remove_se(name)
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.dataset_path = Path(self.tmp_dir.name)
+        SlowSe.running.clear()
+        SlowSe.max_running.clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_caps(self):
+        """Jobs run in parallel within the global cap and the cap of their search engine"""
+        jobs = expand_jobs(["Slow A SE", "Slow B SE"], ["moon", "sun", "star"])
+        scheduler = ScrapeScheduler(self.dataset_path, 5, max_jobs=3, max_jobs_per_engine=2,
+                                    engine_limits={"Slow B SE": 1})
+        start = time.perf_counter()
+        results = scheduler.run(jobs)
+        duration = time.perf_counter() - start
+
+        self.assertEqual(SlowSe.max_running["all"], 3)
+        self.assertEqual(SlowSe.max_running["SlowASe"], 2)
+        self.assertEqual(SlowSe.max_running["SlowBSe"], 1)
+        # the three pages of Slow B SE run one after another, the others beside them
+        self.assertLess(duration, 6 * SlowSe.delay)
+        self.assertEqual([result.job for result in results], jobs)
+
+    def test_results(self):
+        """The engines share the urls of a keyword, a failed job does not stop the others"""
+        jobs = expand_jobs(["Slow A SE", "Slow B SE", "Broken SE"], ["moon", "sun"])
+        results = ScrapeScheduler(self.dataset_path, 5).run(jobs)
+
+        self.assertEqual(len(list(self.dataset_path.glob("*.png"))), 10)
+        # each url is downloaded by the job which found it first
+        self.assertEqual(sum(result.n_images for result in results), 10)
+        failed = [result.job for result in results if result.error]
+        self.assertEqual(failed, [ScrapeJob("Broken SE", "moon"), ScrapeJob("Broken SE", "sun")])
+        self.assertIn("no result page", results[2].error)
+
+        summary = format_summary(results, 1.0)
+        self.assertIn("Broken SE", summary)
+        self.assertTrue(summary.endswith("6 jobs, 10 images in 1.0s"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Target count unittests"""
+
+import unittest
+
+from search_engines.search_engine_interface import SearchEngineInterface
+from utils.download_urls import _take_urls
+from utils.target_count import DownloadTarget, SuccessRate, extend_search
+
+
+class EndlessSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine with pages of 10 results which checks n_images like the real engines"""
+
+    def _iter_img_links(self):
+        n_found = 0
+        while n_found < self.n_images:
+            self.cursor["page"] = n_found // 10
+            for i in range(10):
+                yield f"https://example.com/{n_found}.jpg"
+                n_found += 1
+                if n_found == self.n_images:
+                    return
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_replaces_failed_downloads(self):
+        """Urls are taken until the target is saved, although every second download fails"""
+        target = DownloadTarget(50, SuccessRate())
+        urls = (f"https://example.com/{number}.jpg" for number in range(1000))
+        taken = 0
+        for taken, _ in enumerate(_take_urls(urls, target), 1):
+            target.release(saved=taken % 2 == 1)
+
+        self.assertTrue(target.reached)
+        self.assertEqual(taken, 99)
+        self.assertLess(target.success_rate.value, 0.6)
+
+    def test_extend_search(self):
+        """The search engine is asked for more urls only when the target needs them"""
+        search_engine = EndlessSe("moon", 0, stream=True)
+        target = DownloadTarget(30, SuccessRate(prior=0.5))
+        search_engine.n_images = target.urls_needed()
+        self.assertEqual(search_engine.n_images, 66)
+
+        urls = extend_search(search_engine.iter_img_urls(), search_engine, target)
+        for number, _ in enumerate(_take_urls(urls, target)):
+            target.release(saved=number >= 20)  # the first 20 downloads fail
+
+        self.assertTrue(target.reached)
+        self.assertEqual(search_engine.n_yielded, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
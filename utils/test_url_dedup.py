@@ -0,0 +1,27 @@
+"""UrlDeduplicator unittests"""
+
+import unittest
+
+from utils.url_dedup import UrlDeduplicator, normalize_url
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def test_normalize(self):
+        """Trivially different urls of the same image have the same normal form"""
+        self.assertEqual(normalize_url("http://Example.com:80/a.jpg?b=2&a=1&utm_source=x#top"),
+                         normalize_url("https://example.com/a.jpg?a=1&b=2"))
+        self.assertNotEqual(normalize_url("https://example.com/a.jpg?size=large"),
+                            normalize_url("https://example.com/a.jpg?size=small"))
+
+    def test_filter(self):
+        """Duplicates are dropped and counted"""
+        deduplicator = UrlDeduplicator()
+        urls = ["https://example.com/a.jpg", "http://example.com/a.jpg",
+                "https://example.com/b.jpg"]
+        self.assertEqual(list(deduplicator.filter(urls)),
+                         ["https://example.com/a.jpg", "https://example.com/b.jpg"])
+        self.assertEqual(deduplicator.n_duplicates, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
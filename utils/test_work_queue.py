@@ -0,0 +1,227 @@
+"""Work queue unittests"""
+
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from search_engines.registry import SearchEngineFactory
+from search_engines.search_engine_interface import SearchEngineInterface
+from utils.scheduler import JobResult, ScrapeJob, ScrapeScheduler
+from utils.work_queue import (QueueUrlDeduplicator, QueueWorker, open_work_queue,
+                              split_jobs)
+
+
+@SearchEngineFactory.register_se(name="Offset SE")
+class OffsetSe(SearchEngineInterface):  # pylint: disable=too-few-public-methods
+    """Search engine whose results start at the offset of its cursor, for every keyword"""
+    OFFSET_CURSOR = "offset"
+    host = "example.com"
+
+    def _iter_img_links(self):
+        offset = self.cursor.get(self.OFFSET_CURSOR, 0)
+        yield from (f"http://{self.host}/{i}.png" for i in range(offset, offset + self.n_images))
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Answers every path with a different png"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the request"""
+        body = b"\x89PNG\r\n\x1a\n" + self.path.encode() * 10
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class LeaseLosingScheduler:
+    """Scheduler whose first task loses its lease to another worker while it runs"""
+    max_jobs = 1
+
+    def __init__(self, work_queue):
+        self.work_queue = work_queue
+        self.lost = []
+
+    def run_job(self, job, url_deduplicator):
+        """Gives the first task away and records what the deduplicator does then"""
+        if not self.lost:
+            self.work_queue.fail(url_deduplicator.task_id, "a", "lease expired")
+            self.lost.append(url_deduplicator.lease_lost.wait(1))
+            self.lost.append(list(url_deduplicator.filter(["https://example.com/1.jpg"])))
+        return JobResult(job, 0, 0.0)
+
+    def close(self):
+        """Nothing to close"""
+
+
+class LeaseRenewingScheduler:
+    """Scheduler whose task runs until its lease was renewed"""
+    max_jobs = 1
+
+    def __init__(self, work_queue):
+        self.work_queue = work_queue
+        self.lost = None
+
+    def run_job(self, job, url_deduplicator):
+        """Waits for the first renewal which is not an error"""
+        self.work_queue.renewed.wait(1)
+        self.lost = url_deduplicator.lease_lost.is_set()
+        return JobResult(job, 0, 0.0)
+
+    def close(self):
+        """Nothing to close"""
+
+
+class FlakyRenewQueue:
+    """Work queue whose first renewals fail like a locked database"""
+
+    def __init__(self, work_queue, n_errors: int):
+        self.work_queue = work_queue
+        self.n_errors = n_errors
+        self.renewed = threading.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.work_queue, name)
+
+    def renew(self, *args) -> bool:
+        """Raises for the first n_errors calls"""
+        if self.n_errors:
+            self.n_errors -= 1
+            raise sqlite3.OperationalError("database is locked")
+        renewed = self.work_queue.renew(*args)
+        self.renewed.set()
+        return renewed
+
+
+class MyTestCase(unittest.TestCase):  # pylint: disable=missing-class-docstring
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.work_queue = open_work_queue(str(Path(self.tmp_dir.name) / "queue.db"))
+
+    def tearDown(self):
+        self.work_queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_split_jobs(self):
+        """Only the jobs of search engines with an offset cursor are split"""
+        tasks = split_jobs([ScrapeJob("Offset SE", "moon")], 250, task_size=100)
+        self.assertEqual([(task.offset, task.n_images) for task in tasks],
+                         [(0, 100), (100, 100), (200, 50)])
+        self.assertEqual(self.work_queue.add_tasks(tasks), 3)
+        self.assertEqual(self.work_queue.add_tasks(tasks), 0)
+
+    def test_leases(self):
+        """Expired leases are taken over, completions of the old worker are ignored"""
+        self.work_queue.add_tasks([ScrapeJob("Offset SE", "moon", 0, 10)])
+        task = self.work_queue.lease("a", lease_seconds=0.05)
+        self.assertIsNone(self.work_queue.lease("b"))
+
+        time.sleep(0.1)
+        taken_over = self.work_queue.lease("b")
+        self.assertEqual((taken_over.task_id, taken_over.attempts), (task.task_id, 2))
+        self.assertFalse(self.work_queue.complete(task.task_id, "a", 10))
+        self.assertTrue(self.work_queue.complete(task.task_id, "b", 10))
+        self.assertEqual(self.work_queue.status(), {"done": 1})
+
+    def test_failures(self):
+        """Failed tasks are tried again until max_attempts"""
+        self.work_queue.add_tasks([ScrapeJob("Offset SE", "moon", 0, 10)])
+        for _ in range(2):
+            task = self.work_queue.lease("a")
+            self.work_queue.fail(task.task_id, "a", "ConnectionError()", max_attempts=2)
+        self.assertEqual(self.work_queue.status(), {"failed": 1})
+        self.assertEqual(self.work_queue.failures()[0]["error"], "ConnectionError()")
+
+    def test_claim_url(self):
+        """An url is claimed by the first task, a later attempt of the task can claim it again"""
+        url = "https://example.com/1.jpg"
+        self.assertTrue(self.work_queue.claim_url(url, 1))
+        self.assertFalse(self.work_queue.claim_url(url, 2))
+        self.assertTrue(self.work_queue.claim_url(url, 1, attempt=2))
+        self.assertFalse(self.work_queue.claim_url(url, 1))  # the first attempt was taken over
+
+    def test_claim_urls(self):
+        """A batch of urls is claimed at once with the rules of claim_url"""
+        urls = [f"https://example.com/{i}.jpg" for i in range(4)]
+        self.assertTrue(self.work_queue.claim_url(urls[0], 2))
+        self.assertTrue(self.work_queue.claim_url(urls[1], 1, attempt=2))
+        self.assertEqual(self.work_queue.claim_urls(urls, 1), set(urls[2:]))
+        self.assertEqual(self.work_queue.claim_urls(urls, 1, attempt=2), set(urls[1:]))
+        self.assertEqual(self.work_queue.claim_urls([], 1), set())
+
+    def test_url_deduplicator(self):
+        """The deduplicators of the tasks drop the urls of each other"""
+        first = QueueUrlDeduplicator(self.work_queue, 1)
+        second = QueueUrlDeduplicator(self.work_queue, 2, claim_batch_size=1)
+        urls = ["https://example.com/1.jpg", "http://example.com/2.jpg"]
+        self.assertEqual(list(first.filter(urls)), urls)
+        self.assertEqual(list(second.filter(["https://example.com/2.jpg",
+                                             "https://example.com/3.jpg"])),
+                         ["https://example.com/3.jpg"])
+        self.assertEqual(second.n_duplicates, 1)
+
+        second.lease_lost.set()
+        self.assertEqual(list(second.filter(["https://example.com/4.jpg"])), [])
+
+    def test_worker(self):
+        """Two workers drain the queue and every url is downloaded once"""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        OffsetSe.host = f"127.0.0.1:{server.server_port}"
+        dataset_path = Path(self.tmp_dir.name) / "dataset"
+        # the keywords have the same results, their tasks claim the urls from each other
+        jobs = [ScrapeJob("Offset SE", "moon"), ScrapeJob("Offset SE", "sun")]
+        self.work_queue.add_tasks(split_jobs(jobs, 30, task_size=10))
+
+        work_queues = [open_work_queue(str(Path(self.tmp_dir.name) / "queue.db"))
+                       for _ in range(2)]
+        workers = [QueueWorker(work_queue, ScrapeScheduler(dataset_path, 30, max_jobs=2),
+                               name=name, poll_seconds=0.1)
+                   for work_queue, name in zip(work_queues, "ab")]
+        try:
+            threads = [threading.Thread(target=worker.run) for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for work_queue in work_queues:
+                work_queue.close()
+            server.shutdown()
+            server.server_close()
+
+        results = workers[0].results + workers[1].results
+        self.assertEqual(self.work_queue.status(), {"done": 6})
+        self.assertEqual(sorted(result.job.offset for result in results), [0, 0, 10, 10, 20, 20])
+        self.assertEqual(sum(result.n_images for result in results), 30)
+        self.assertEqual(len(list(dataset_path.glob("*.png"))), 30)
+
+    def test_lost_lease(self):
+        """A task whose lease was taken over stops taking urls"""
+        self.work_queue.add_tasks([ScrapeJob("Offset SE", "moon", 0, 10)])
+        scheduler = LeaseLosingScheduler(self.work_queue)
+        QueueWorker(self.work_queue, scheduler, name="a", lease_seconds=0.15).run()
+        self.assertEqual(scheduler.lost, [True, []])
+        self.assertEqual(self.work_queue.status(), {"done": 1})
+
+    def test_renew_error(self):
+        """A failed renewal is tried again and does not stop the renewals"""
+        self.work_queue.add_tasks([ScrapeJob("Offset SE", "moon", 0, 10)])
+        work_queue = FlakyRenewQueue(self.work_queue, n_errors=2)
+        scheduler = LeaseRenewingScheduler(work_queue)
+        QueueWorker(work_queue, scheduler, name="a", lease_seconds=0.15).run()
+        self.assertTrue(work_queue.renewed.is_set())
+        self.assertFalse(scheduler.lost)
+        self.assertEqual(self.work_queue.status(), {"done": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
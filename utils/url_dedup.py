@@ -0,0 +1,71 @@
+"""Normalization and deduplication of image urls across search engines"""
+import threading
+from typing import Iterable, Iterator, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# query parameters which only track the click and never change the image
+TRACKING_PARAMS = {"fbclid", "gclid", "ref", "ref_src"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _is_tracking_param(key: str) -> bool:
+    key = key.lower()
+    return key.startswith("utm_") or key in TRACKING_PARAMS
+
+
+def normalize_url(url: str) -> str:
+    """
+    Returns a canonical form of the url. http and https, the default port, the case of the host,
+    the fragment, tracking parameters and the order of the query parameters are ignored
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:  # invalid port, keep the url apart from the valid ones
+        port = None
+        host = parts.netloc.lower()
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not _is_tracking_param(key))
+    if scheme in DEFAULT_PORTS:
+        scheme = "https"
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class UrlDeduplicator:
+    """
+    Remembers the normalized urls of a scrape run so every image is only requested once,
+    no matter how many search engines or keywords returned it. It is shared by all jobs of a run
+    """
+
+    def __init__(self):
+        self._seen: Set[str] = set()
+        self._lock = threading.Lock()
+        self.n_urls = 0
+        self.n_duplicates = 0
+
+    def add(self, url: str) -> bool:
+        """Returns True if the url was not seen before"""
+        normalized = normalize_url(url)
+        with self._lock:
+            self.n_urls += 1
+            if normalized in self._seen:
+                self.n_duplicates += 1
+                return False
+            self._seen.add(normalized)
+            return True
+
+    def filter(self, urls: Iterable[str]) -> Iterator[str]:
+        """Yields only the urls which were not seen before. Works lazily on streamed urls"""
+        for url in urls:
+            if url and self.add(url):
+                yield url
+
+    def report(self) -> str:
+        """Returns how many requests were saved by the deduplication"""
+        return (f"{self.n_duplicates} of {self.n_urls} urls were duplicates, "
+                f"{self.n_duplicates} requests saved")
@@ -0,0 +1,431 @@
+"""
+Durable queue of scrape tasks which are shared by worker processes on one or more machines.
+A coordinator splits the jobs of a config into tasks, workers lease them, scrape and download
+them with a ScrapeScheduler and report the results
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from search_engines.registry import SearchEngineFactory
+from utils.metrics import get_metrics
+from utils.scheduler import JobResult, ScrapeJob, ScrapeScheduler
+from utils.url_dedup import UrlDeduplicator, normalize_url
+
+DEFAULT_TASK_SIZE = 500  # urls per task of the search engines which can start at an offset
+DEFAULT_LEASE_SECONDS = 120.0  # a task whose worker did not renew its lease this long is re-leased
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_SECONDS = 5.0
+CLAIM_BATCH_SIZE = 32  # urls claimed in one transaction
+
+
+class Task(NamedTuple):
+    """A leased job of the queue"""
+    task_id: int
+    job: ScrapeJob
+    attempts: int
+
+
+def split_jobs(jobs: Iterable[ScrapeJob], n_samples: int,
+               task_size: int = DEFAULT_TASK_SIZE) -> List[ScrapeJob]:
+    """
+    Splits the jobs of search engines with an OFFSET_CURSOR into parts of task_size urls, so the
+    results of a keyword are scraped by several workers. The other engines can only page from the
+    start and keep a single job per keyword
+    """
+    tasks = []
+    for job in jobs:
+        offset_cursor = SearchEngineFactory.get_se_class(job.search_engine).OFFSET_CURSOR
+        if offset_cursor is None:
+            tasks.append(job._replace(n_images=n_samples))
+            continue
+        tasks.extend(job._replace(offset=offset, n_images=min(task_size, n_samples - offset))
+                     for offset in range(0, n_samples, task_size))
+    return tasks
+
+
+class WorkQueue(ABC):
+    """
+    Interface of the queue backends. Tasks are pending until a worker leases them. A lease
+    expires after lease_seconds unless the worker renews it, then the task is pending again, so
+    the tasks of crashed workers are taken over. A task which failed or expired max_attempts
+    times is failed for good.
+    The queue also stores the config of the scrape and the urls claimed by the tasks, which
+    deduplicates the downloads across all workers
+    """
+
+    def add_tasks(self, jobs: Iterable[ScrapeJob]) -> int:
+        """Adds the jobs which are not in the queue yet and returns how many were added"""
+        raise NotImplementedError
+
+    def lease(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+              max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[Task]:
+        """Leases the next pending task to worker, returns None if no task is pending"""
+        raise NotImplementedError
+
+    def renew(self, task_id: int, worker: str,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extends the lease, returns False if the task is not leased to worker anymore"""
+        raise NotImplementedError
+
+    def complete(self, task_id: int, worker: str, n_images: int) -> bool:
+        """Marks the task as done, returns False if the task is not leased to worker anymore"""
+        raise NotImplementedError
+
+    def fail(self, task_id: int, worker: str, error: str,
+             max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> bool:
+        """
+        Gives the task back to be tried again or marks it failed after max_attempts.
+        Returns False if the task is not leased to worker anymore
+        """
+        raise NotImplementedError
+
+    def claim_url(self, url: str, task_id: int, attempt: int = 1) -> bool:
+        """
+        Returns True if the url should be downloaded by the attempt of the task, because no other
+        task claimed the normalized url before. A later attempt of a task can claim the urls of
+        its earlier attempts again, e.g. after their worker crashed, but not the other way round
+        """
+        raise NotImplementedError
+
+    def claim_urls(self, urls: List[str], task_id: int, attempt: int = 1) -> Set[str]:
+        """Claims the urls like claim_url and returns the claimed ones"""
+        return {url for url in urls if self.claim_url(url, task_id, attempt)}
+
+    def status(self) -> Dict[str, int]:
+        """Returns the number of tasks in every state"""
+        raise NotImplementedError
+
+    def failures(self) -> List[Dict]:
+        """Returns the failed tasks with their errors"""
+        raise NotImplementedError
+
+    def set_config(self, config: Dict):
+        """Stores the config of the scrape for the workers"""
+        raise NotImplementedError
+
+    def get_config(self) -> Optional[Dict]:
+        """Returns the stored config of the scrape"""
+        raise NotImplementedError
+
+    def close(self):
+        """Closes the connection to the queue"""
+
+    def unfinished(self) -> int:
+        """Returns the number of tasks which are pending or leased"""
+        status = self.status()
+        return status.get("pending", 0) + status.get("leased", 0)
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    Queue in an SQLite database. Every call is a short transaction, so many worker processes can
+    share the database file. On several machines it needs a network file system with working
+    locks. The database uses the rollback journal, because the shared memory index of WAL mode
+    only works for processes on the same machine
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            search_engine TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            n_images INTEGER,
+            state TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result INTEGER,
+            error TEXT,
+            UNIQUE (search_engine, keyword, offset)
+        );
+        CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until);
+        CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            task_id INTEGER NOT NULL,
+            attempt INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # autocommit, the transactions which need more than one statement are opened explicitly
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                           check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=DELETE")
+        self._connection.executescript(self.SCHEMA)
+
+    def _execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    def add_tasks(self, jobs: Iterable[ScrapeJob]) -> int:
+        rows = [(job.search_engine, job.keyword, job.offset, job.n_images) for job in jobs]
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO tasks (search_engine, keyword, offset, n_images) "
+                "VALUES (?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+            return self._connection.total_changes - before
+
+    def lease(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+              max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[Task]:
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                # leases which ran out too often belong to tasks which crash their workers
+                self._connection.execute(
+                    "UPDATE tasks SET state = 'failed', error = 'lease expired' "
+                    "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                    (now, max_attempts))
+                row = self._connection.execute(
+                    "SELECT id, search_engine, keyword, offset, n_images, attempts FROM tasks "
+                    "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (worker, now + lease_seconds, row[0]))
+            finally:
+                self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        task_id, search_engine, keyword, offset, n_images, attempts = row
+        return Task(task_id, ScrapeJob(search_engine, keyword, offset, n_images), attempts + 1)
+
+    def renew(self, task_id: int, worker: str,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        return self._execute(
+            "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + lease_seconds, task_id, worker)).rowcount == 1
+
+    def complete(self, task_id: int, worker: str, n_images: int) -> bool:
+        return self._execute(
+            "UPDATE tasks SET state = 'done', result = ?, error = NULL "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (n_images, task_id, worker)).rowcount == 1
+
+    def fail(self, task_id: int, worker: str, error: str,
+             max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> bool:
+        return self._execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_until = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+            (max_attempts, error, task_id, worker)).rowcount == 1
+
+    CLAIM_SQL = ("INSERT INTO urls (url, task_id, attempt) VALUES (?, ?, ?) "
+                 "ON CONFLICT (url) DO UPDATE SET attempt = excluded.attempt "
+                 "WHERE task_id = excluded.task_id AND attempt <= excluded.attempt")
+
+    def claim_url(self, url: str, task_id: int, attempt: int = 1) -> bool:
+        return self._execute(self.CLAIM_SQL, (url, task_id, attempt)).rowcount == 1
+
+    def claim_urls(self, urls: List[str], task_id: int, attempt: int = 1) -> Set[str]:
+        if not urls:
+            return set()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(self.CLAIM_SQL,
+                                             [(url, task_id, attempt) for url in urls])
+                rows = self._connection.execute(
+                    f"SELECT url FROM urls WHERE task_id = ? AND attempt = ? "
+                    f"AND url IN ({', '.join('?' * len(urls))})",
+                    (task_id, attempt, *urls)).fetchall()
+            finally:
+                self._connection.execute("COMMIT")
+        return {url for url, in rows}
+
+    def status(self) -> Dict[str, int]:
+        now = time.time()
+        status = dict(self._execute(
+            "SELECT CASE WHEN state = 'leased' AND lease_until < ? THEN 'expired' ELSE state END, "
+            "count(*) FROM tasks GROUP BY 1", (now,)).fetchall())
+        expired = status.pop("expired", 0)
+        if expired:  # expired leases are taken over by the next lease
+            status["pending"] = status.get("pending", 0) + expired
+        return status
+
+    def failures(self) -> List[Dict]:
+        rows = self._execute("SELECT search_engine, keyword, offset, attempts, error FROM tasks "
+                             "WHERE state = 'failed' ORDER BY id").fetchall()
+        return [dict(zip(("search_engine", "keyword", "offset", "attempts", "error"), row))
+                for row in rows]
+
+    def set_config(self, config: Dict):
+        self._execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('config', ?)",
+                      (json.dumps(config),))
+
+    def get_config(self) -> Optional[Dict]:
+        row = self._execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# backends by the scheme of the queue location, e.g. sqlite:///shared/queue.db
+BACKENDS: Dict[str, Callable[[Path], WorkQueue]] = {"sqlite": SqliteWorkQueue}
+
+
+def open_work_queue(location: str) -> WorkQueue:
+    """Opens the queue at location, a path without a scheme is an SQLite database"""
+    scheme, separator, path = location.partition("://")
+    if not separator:
+        scheme, path = "sqlite", location
+    if scheme not in BACKENDS:
+        raise ValueError(f"{scheme} is not a queue backend, use one of {', '.join(BACKENDS)}")
+    return BACKENDS[scheme](Path(path))
+
+
+class QueueUrlDeduplicator(UrlDeduplicator):
+    """
+    Deduplicator of a task which also drops the urls claimed by other tasks of the queue.
+    filter claims the urls in batches of claim_batch_size with one transaction each, so it reads
+    up to a batch ahead of the downloads.
+    When the worker lost the lease of the task lease_lost is set and no more urls are yielded,
+    so the job ends and leaves the task to the worker which holds the lease now
+    """
+
+    def __init__(self, work_queue: WorkQueue, task_id: int, attempt: int = 1,
+                 claim_batch_size: int = CLAIM_BATCH_SIZE):
+        super().__init__()
+        self.work_queue = work_queue
+        self.task_id = task_id
+        self.attempt = attempt
+        self.claim_batch_size = claim_batch_size
+        self.lease_lost = threading.Event()
+
+    def add(self, url: str) -> bool:
+        if not super().add(url):
+            return False
+        if self.work_queue.claim_url(normalize_url(url), self.task_id, self.attempt):
+            return True
+        with self._lock:
+            self.n_duplicates += 1
+        return False
+
+    def _claim(self, urls: List[str]) -> Iterator[str]:
+        """Yields the urls which this task claimed in the queue while it holds the lease"""
+        normalized = [normalize_url(url) for url in urls]
+        claimed = self.work_queue.claim_urls(normalized, self.task_id, self.attempt)
+        with self._lock:
+            self.n_duplicates += len(urls) - len(claimed)
+        for url, key in zip(urls, normalized):
+            if self.lease_lost.is_set():
+                return
+            if key in claimed:
+                yield url
+
+    def filter(self, urls: Iterable[str]) -> Iterator[str]:
+        batch: List[str] = []
+        for url in urls:
+            if self.lease_lost.is_set():
+                return
+            # only seen by this task so far, the batch is claimed in the queue at once
+            if url and UrlDeduplicator.add(self, url):
+                batch.append(url)
+            if len(batch) >= self.claim_batch_size:
+                yield from self._claim(batch)
+                batch = []
+        if batch:
+            yield from self._claim(batch)
+
+
+def default_worker_name() -> str:
+    """Returns a name which is unique for every worker process"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class QueueWorker:
+    """
+    Leases tasks from the queue and runs them with the scheduler, max_jobs of the scheduler at
+    the same time. The leases of the running tasks are renewed in the background, a task whose
+    lease was taken over by another worker stops taking urls. The worker stops when no task is
+    pending or leased anymore
+    """
+
+    def __init__(self, work_queue: WorkQueue, scheduler: ScrapeScheduler,
+                 name: Optional[str] = None, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, poll_seconds: float = POLL_SECONDS):
+        self.work_queue = work_queue
+        self.scheduler = scheduler
+        self.name = name or default_worker_name()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.results: List[JobResult] = []
+
+        self._running: Dict[int, QueueUrlDeduplicator] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _renew_leases(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                running = list(self._running.items())
+            for task_id, url_deduplicator in running:
+                try:
+                    renewed = self.work_queue.renew(task_id, self.name, self.lease_seconds)
+                except Exception:  # pylint: disable=broad-except
+                    # e.g. a locked database, the lease lasts for two more tries
+                    get_metrics().inc("queue_renew_errors_total")
+                    continue
+                if not renewed:
+                    url_deduplicator.lease_lost.set()
+
+    def _run_task(self, task: Task) -> JobResult:
+        url_deduplicator = QueueUrlDeduplicator(self.work_queue, task.task_id, task.attempts)
+        with self._lock:
+            self._running[task.task_id] = url_deduplicator
+        try:
+            result = self.scheduler.run_job(task.job, url_deduplicator)
+        finally:
+            with self._lock:
+                del self._running[task.task_id]
+        if result.error:
+            self.work_queue.fail(task.task_id, self.name, result.error, self.max_attempts)
+        else:
+            self.work_queue.complete(task.task_id, self.name, result.n_images)
+        return result
+
+    def _work(self):
+        while not self._stop.is_set():
+            task = self.work_queue.lease(self.name, self.lease_seconds, self.max_attempts)
+            if task is None:
+                if self.work_queue.unfinished() == 0:
+                    return
+                # the tasks of other workers can still fail or expire
+                self._stop.wait(self.poll_seconds)
+                continue
+            result = self._run_task(task)
+            with self._lock:
+                self.results.append(result)
+
+    def run(self) -> List[JobResult]:
+        """Works until the queue is drained and returns the results of the tasks of this worker"""
+        renewer = threading.Thread(target=self._renew_leases, daemon=True)
+        renewer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.scheduler.max_jobs) as executor:
+                for future in [executor.submit(self._work)
+                               for _ in range(self.scheduler.max_jobs)]:
+                    future.result()
+        finally:
+            self._stop.set()
+            renewer.join()
+            self.scheduler.close()
+        return self.results